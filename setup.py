@@ -15,6 +15,11 @@ def repo_file_as_string(file_path: str) -> str:
 
 setup(dependency_links=[],
       install_requires=["marshmallow", "aiosmtplib"],
+      extras_require={
+          "dkim": ["cryptography"],
+          "zstd": ["zstandard"],
+          "yaml": ["PyYAML"]
+      },
       name="sremail",
       version="#{VERSION}#",
       description="Python package to make it easier to handle email.",
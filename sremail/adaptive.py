@@ -0,0 +1,358 @@
+"""AIMDLimiter, AdaptiveSender
+
+Sending asynchronously with as many messages in flight to each server as it
+can take, found by watching how it copes rather than by guessing.
+
+Each endpoint gets an AIMD (additive increase, multiplicative decrease)
+limit on sends in flight, like TCP's congestion window. The limit doubles
+every round trip until the server first shows it's struggling, then grows
+by one a round trip. It's cut in half, at most once a round trip, whenever
+the server throttles a send with a 4xx reply, a send fails to connect or
+times out, or a send takes much longer than the quickest one seen.
+
+Example::
+    sender = AdaptiveSender(max_limit=128)
+    await sender.send_all(messages, "smtp.some_server.com:25")
+    print(sender.metrics())
+"""
+import asyncio
+from collections import deque
+import time
+from typing import AsyncIterable, Dict, Iterable, List, Optional, Union
+
+import aiosmtplib
+
+from .dedup import DedupCache
+from .dkim import DKIMSigner
+from .message import Message
+from .outcomes import OutcomeStore
+from .smtp import TLSConfig, send_async
+
+
+class AIMDLimiter:
+    """An adaptive limit on the sends in flight to one endpoint.
+
+    Attributes:
+        limit (float): The current limit, sends wait while int(limit) are in
+            flight.
+        in_flight (int): The sends in flight.
+        sent (int): Sends that succeeded.
+        throttled (int): Sends that were throttled, or failed in a way that
+            suggests the server is overloaded.
+        failed (int): Sends that failed, including those throttled.
+        latency (float): A moving average of how long sends take, in
+            seconds.
+        min_latency (float): The quickest send seen, in seconds.
+    """
+    def __init__(self,
+                 initial_limit: int = 4,
+                 min_limit: int = 1,
+                 max_limit: int = 256,
+                 backoff: float = 0.5,
+                 latency_tolerance: float = 4.0,
+                 throughput_window: float = 10.0) -> None:
+        """Create a limiter.
+
+        Args:
+            initial_limit (int): The limit to start at.
+            min_limit (int): The lowest the limit can go.
+            max_limit (int): The highest the limit can go.
+            backoff (float): What the limit is multiplied by when the server
+                is struggling.
+            latency_tolerance (float): How many times longer than the
+                quickest send a send can take before the server counts as
+                struggling.
+            throughput_window (float): The seconds of recent sends the
+                throughput is measured over.
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.throughput_window = throughput_window
+        self.in_flight = 0
+        self.sent = 0
+        self.throttled = 0
+        self.failed = 0
+        self.latency = 0.0
+        self.min_latency = float("inf")
+        self._slow_start = True
+        # completions since the limit was last cut, and the sends that were
+        # in flight when it was, so it's only cut once for the same
+        # congestion
+        self._since_backoff = 0
+        self._in_flight_at_backoff = 0
+        self._completions = deque()
+        self._waiters: List[asyncio.Future] = []
+
+    @property
+    def throughput(self) -> float:
+        """Sends that succeeded per second, over the throughput window."""
+        self._trim_completions(time.monotonic())
+        return len(self._completions) / self.throughput_window
+
+    async def acquire(self) -> None:
+        """Wait until a send can be started, and count it as in flight."""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self,
+                latency: float,
+                succeeded: bool = True,
+                throttled: bool = False) -> None:
+        """Count a send as no longer in flight, and adjust the limit by how
+        it went.
+
+        Args:
+            latency (float): How long the send took, in seconds.
+            succeeded (bool): Whether the message was sent.
+            throttled (bool): Whether the send failed in a way that suggests
+                the server is overloaded.
+        """
+        self.in_flight -= 1
+        self._since_backoff += 1
+        if succeeded:
+            self.sent += 1
+            now = time.monotonic()
+            self._completions.append(now)
+            self._trim_completions(now)
+            self.latency = latency if not self.latency else \
+                0.9 * self.latency + 0.1 * latency
+            self.min_latency = min(self.min_latency, latency)
+        else:
+            self.failed += 1
+        if throttled:
+            self.throttled += 1
+
+        if throttled or (succeeded and latency >
+                         self.latency_tolerance * self.min_latency):
+            if self._since_backoff > self._in_flight_at_backoff:
+                self._slow_start = False
+                self._since_backoff = 0
+                self._in_flight_at_backoff = self.in_flight
+                self.limit = max(float(self.min_limit),
+                                 self.limit * self.backoff)
+        elif succeeded:
+            self.limit = min(
+                float(self.max_limit),
+                self.limit + (1.0 if self._slow_start else 1.0 / self.limit))
+        self._wake()
+
+    def cancel(self) -> None:
+        """Count a send as no longer in flight without it having gone to the
+        server, i.e. when it was skipped, leaving the limit as it is."""
+        self.in_flight -= 1
+        self._wake()
+
+    def as_dict(self) -> dict:
+        """Get the limiter's metrics as a dict."""
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "failed": self.failed,
+            "latency": self.latency,
+            "min_latency": self.min_latency if self.sent else None,
+            "throughput": self.throughput
+        }
+
+    def _wake(self) -> None:
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    def _trim_completions(self, now: float) -> None:
+        while self._completions and \
+                self._completions[0] < now - self.throughput_window:
+            self._completions.popleft()
+
+
+class AdaptiveSender:
+    """Sends messages asynchronously with send_async(), keeping as many in
+    flight to each endpoint as its AIMDLimiter allows.
+
+    Attributes:
+        limiters (Dict[str, AIMDLimiter]): The limiter of each endpoint sent
+            to, by SMTP server URL.
+    """
+    def __init__(self,
+                 initial_limit: int = 4,
+                 min_limit: int = 1,
+                 max_limit: int = 256,
+                 backoff: float = 0.5,
+                 latency_tolerance: float = 4.0,
+                 timeout: Optional[float] = None,
+                 signer: Optional[DKIMSigner] = None,
+                 tls: Optional[TLSConfig] = None,
+                 outcomes: Optional[OutcomeStore] = None,
+                 dedup: Optional[DedupCache] = None) -> None:
+        """Create a sender.
+
+        Args:
+            initial_limit (int): The limit each endpoint starts at.
+            min_limit (int): The lowest an endpoint's limit can go.
+            max_limit (int): The highest an endpoint's limit can go.
+            backoff (float): What an endpoint's limit is multiplied by when
+                it's struggling.
+            latency_tolerance (float): How many times longer than the
+                quickest send a send can take before its endpoint counts as
+                struggling.
+            timeout (float): The timeout in seconds. If not specified then
+                system default will be used.
+            signer (DKIMSigner): If given, messages will be DKIM signed.
+            tls (TLSConfig): If given, messages will be sent over TLS.
+            outcomes (OutcomeStore): If given, the outcome of sending each
+                message will be recorded in it.
+            dedup (DedupCache): If given, messages won't be sent to
+                recipients that have already accepted them.
+        """
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.timeout = timeout
+        self.signer = signer
+        self.tls = tls
+        self.outcomes = outcomes
+        self.dedup = dedup
+        self.limiters: Dict[str, AIMDLimiter] = {}
+
+    def limiter(self, smtp_url: str) -> AIMDLimiter:
+        """Get the limiter of an endpoint, creating it if needed.
+
+        Args:
+            smtp_url (str): The SMTP server URL.
+
+        Returns:
+            AIMDLimiter: The endpoint's limiter.
+        """
+        limiter = self.limiters.get(smtp_url)
+        if limiter is None:
+            limiter = AIMDLimiter(self.initial_limit, self.min_limit,
+                                  self.max_limit, self.backoff,
+                                  self.latency_tolerance)
+            self.limiters[smtp_url] = limiter
+        return limiter
+
+    async def send(self, message: Message, smtp_url: str) -> bool:
+        """Send a message once the endpoint's limit allows it.
+
+        Args:
+            message (Message): The message to send.
+            smtp_url (str): The SMTP server URL to send the message to.
+
+        Returns:
+            bool: Whether the message was sent, False if every recipient had
+                already accepted it.
+
+        Raises:
+            aiosmtplib.SMTPException: If the message couldn't be sent.
+        """
+        limiter = self.limiter(smtp_url)
+        await limiter.acquire()
+        return await self._send_acquired(message, smtp_url, limiter)
+
+    async def _send_acquired(self, message: Message, smtp_url: str,
+                             limiter: AIMDLimiter) -> bool:
+        """Send a message that already has its place in flight."""
+        start = time.perf_counter()
+        try:
+            sent = await send_async(message, smtp_url, self.timeout,
+                                    self.signer, self.tls, self.outcomes,
+                                    self.dedup)
+        except aiosmtplib.SMTPResponseException as err:
+            limiter.release(time.perf_counter() - start,
+                            succeeded=False,
+                            throttled=400 <= err.code < 500)
+            raise
+        except aiosmtplib.SMTPRecipientsRefused:
+            limiter.release(time.perf_counter() - start, succeeded=False)
+            raise
+        except (aiosmtplib.SMTPException, OSError):
+            # connection failures and timeouts are the server struggling too
+            limiter.release(time.perf_counter() - start,
+                            succeeded=False,
+                            throttled=True)
+            raise
+        except BaseException:
+            limiter.release(time.perf_counter() - start, succeeded=False)
+            raise
+        if sent:
+            limiter.release(time.perf_counter() - start)
+        else:
+            # skipped sends never reached the server, so say nothing about it
+            limiter.cancel()
+        return sent
+
+    async def send_all(self, messages: Union[Iterable[Message],
+                                             AsyncIterable[Message]],
+                       smtp_url: str) -> int:
+        """Send messages from an iterable or asynchronous iterable, as many
+        at once as the endpoint's limit allows.
+
+        Messages that can't be sent are counted in the endpoint's metrics
+        rather than raised, so one throttled message doesn't stop the rest.
+
+        Args:
+            messages (Union[Iterable[Message], AsyncIterable[Message]]): The
+                messages to send.
+            smtp_url (str): The SMTP server URL to send the messages to.
+
+        Returns:
+            int: The number of messages sent, not counting any skipped as
+                every recipient had already accepted them.
+        """
+        limiter = self.limiter(smtp_url)
+        sent = 0
+        in_flight = set()
+
+        async def send_one(message: Message) -> None:
+            nonlocal sent
+            try:
+                if await self._send_acquired(message, smtp_url, limiter):
+                    sent += 1
+            except (aiosmtplib.SMTPException, OSError):
+                pass
+
+        async def start(message: Message) -> None:
+            # wait for room before taking the next message, so messages
+            # are only taken from the iterable as they can be sent
+            await limiter.acquire()
+            task = asyncio.ensure_future(send_one(message))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if hasattr(messages, "__aiter__"):
+            async for message in messages:
+                await start(message)
+        else:
+            for message in messages:
+                await start(message)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        if self.outcomes is not None:
+            self.outcomes.flush()
+        return sent
+
+    def metrics(self) -> Dict[str, dict]:
+        """Get the current limit, throughput and counts of each endpoint.
+
+        Returns:
+            Dict[str, dict]: The metrics of each endpoint, by SMTP server
+                URL, see AIMDLimiter.as_dict().
+        """
+        return {
+            smtp_url: limiter.as_dict()
+            for smtp_url, limiter in self.limiters.items()
+        }
@@ -10,14 +10,21 @@ from typing import Optional
 from email.utils import parseaddr, formataddr
 from marshmallow import fields
 
+from . import profiling
+
 
 class Address:
     """Class to store an email address, as in a MIME file.
 
+    The formatted address is cached, as it's needed every time a message is
+    rendered.
+
     Attributes:
         name (str): The real name of the email address. Can be empty.
         email (str): The email address.
     """
+    _formatted = None
+
     def __init__(self, addr_str: str) -> None:
         """Create a new address from a string.
 
@@ -36,8 +43,30 @@ class Address:
         if "@" not in self.email:
             raise ValueError("Email was not an email address")
 
+    @property
+    def name(self) -> str:
+        """The real name of the email address. Can be empty."""
+        return self._name
+
+    @name.setter
+    def name(self, value: str) -> None:
+        self._name = value
+        self._formatted = None
+
+    @property
+    def email(self) -> str:
+        """The email address."""
+        return self._email
+
+    @email.setter
+    def email(self, value: str) -> None:
+        self._email = value
+        self._formatted = None
+
     def __str__(self):
-        return formataddr((self.name, self.email))
+        if self._formatted is None:
+            self._formatted = formataddr((self.name, self.email))
+        return self._formatted
 
     def __repr__(self):
         return f"address.Address(\"{str(self)}\")"
@@ -67,4 +96,5 @@ class AddressField(fields.String):
         return super()._serialize(val, attr, obj, **kwargs)
 
     def _deserialize(self, value, attr, data, **kwargs) -> Optional[Address]:
-        return self._validated(value)
+        with profiling.timed("address_parsing"):
+            return self._validated(value)
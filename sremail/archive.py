@@ -0,0 +1,386 @@
+"""ArchiveWriter, ArchiveReader
+
+A compressed, deduplicated archive of flattened messages, for keeping
+generated messages around to replay later.
+
+Messages are stored flattened, ready to go on the wire, along with their
+envelope, in compressed segments. As on the wire, Bcc headers are left out,
+and Bcc recipients are only kept in the envelope. Attachment payloads are
+stored once, by content hash, no matter how many messages they're attached
+to, and an index at the end of the file allows for random access. Reading
+the archive from start to end is sequential, as every attachment is written
+before the first message that uses it.
+
+Example::
+    with ArchiveWriter("corpus.sremail") as archive:
+        for msg in messages:
+            archive.write(msg)
+
+    with ArchiveReader("corpus.sremail") as archive:
+        for wire in archive:
+            smtp.sendmail(wire.from_addr, wire.to_addrs, wire.data,
+                          wire.mail_options)
+
+Layout::
+    MAGIC, codec (1 byte)
+    frames: kind (1 byte), length (4 bytes), compressed frame data
+        B (blob): sha256 digest (32 bytes), payload
+        S (segment): message count (4 bytes), then per message its length
+            (4 bytes), the length of its envelope (4 bytes) and envelope,
+            its Message-ID, sender, space separated mail options and
+            recipients, NUL separated and UTF-8 encoded, then chunks, which
+            are either L, length (4 bytes) and literal bytes, or R and the
+            digest of a blob
+        I (index): message count (4 bytes), then per message the offset of
+            its segment (8 bytes) and its position in it (4 bytes), blob
+            count (4 bytes), then per blob its digest and offset (8 bytes)
+    index offset (8 bytes), MAGIC
+"""
+from collections import OrderedDict
+import email.message
+import hashlib
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Tuple, Union
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+from .message import Message
+from .smtp import RenderedMessage
+
+MAGIC = b"SREMARC\x01"
+"""Marks the start and end of an archive."""
+
+CODECS = {"zlib": 1, "zstd": 2}
+"""The compression codecs archives can be written with."""
+
+_FRAME_HEADER = struct.Struct(">cI")
+_UINT32 = struct.Struct(">I")
+_UINT64 = struct.Struct(">Q")
+_INDEX_ENTRY = struct.Struct(">QI")
+_DIGEST_SIZE = 32
+
+
+class _Codec:
+    """Compresses and decompresses frames."""
+    def __init__(self, codec_id: int, level: int) -> None:
+        if codec_id == CODECS["zstd"]:
+            if zstandard is None:
+                raise ImportError("zstd archives require the 'zstandard' "
+                                  "package, install it with "
+                                  "'pip install sremail[zstd]'")
+            self.compress = zstandard.ZstdCompressor(level=level).compress
+            self.decompress = zstandard.ZstdDecompressor().decompress
+        elif codec_id == CODECS["zlib"]:
+            self.compress = lambda data: zlib.compress(data, level)
+            self.decompress = zlib.decompress
+        else:
+            raise ValueError(f"Unknown archive codec {codec_id}")
+
+
+class ArchiveWriter:
+    """Writes messages to an archive.
+
+    Attributes:
+        count (int): The number of messages written.
+    """
+    def __init__(self,
+                 file_path: str,
+                 codec: str = "zlib",
+                 level: int = 6,
+                 segment_size: int = 64,
+                 min_blob_size: int = 1024) -> None:
+        """Create a new archive, overwriting the file if it exists.
+
+        Args:
+            file_path (str): The path of the archive.
+            codec (str): The compression codec to use, one of CODECS.
+            level (int): The compression level.
+            segment_size (int): The number of messages compressed together.
+            min_blob_size (int): Attachment payloads smaller than this aren't
+                worth deduplicating and are stored inline.
+
+        Raises:
+            ValueError: If the codec is unknown.
+            ImportError: If the codec is 'zstd' and zstandard isn't installed.
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown archive codec '{codec}'")
+        self._codec = _Codec(CODECS[codec], level)
+        self._segment_size = segment_size
+        self._min_blob_size = min_blob_size
+        self._file = open(file_path, "wb")
+        self._file.write(MAGIC + bytes([CODECS[codec]]))
+        self._blobs: Dict[bytes, int] = {}
+        self._index: List[Tuple[int, int]] = []
+        self._segment: List[bytes] = []
+        self.count = 0
+
+    def write(self, message: Union[Message, email.message.Message,
+                                   RenderedMessage]) -> None:
+        """Write a message to the archive.
+
+        Args:
+            message (Union[Message, email.message.Message, RenderedMessage]):
+                The message. Already rendered messages, i.e. from render() or
+                another archive, are stored as they are, without
+                deduplicating their attachments.
+        """
+        if isinstance(message, Message):
+            message = message.as_mime()
+        if isinstance(message, RenderedMessage):
+            wire = message
+            chunks = self._literal(wire.data)
+        else:
+            wire = RenderedMessage(message)
+            chunks = self._chunks(message, wire.data)
+        envelope = "\0".join([
+            wire.message_id or "", wire.from_addr,
+            " ".join(wire.mail_options), *wire.to_addrs
+        ]).encode("utf-8")
+        record = _UINT32.pack(len(envelope)) + envelope + chunks
+        self._segment.append(_UINT32.pack(len(record)) + record)
+        self.count += 1
+        if len(self._segment) >= self._segment_size:
+            self._flush_segment()
+
+    def close(self) -> None:
+        """Write out the index and close the archive."""
+        if self._file.closed:
+            return
+        self._flush_segment()
+        index = [_UINT32.pack(len(self._index))]
+        index.extend(_INDEX_ENTRY.pack(*entry) for entry in self._index)
+        index.append(_UINT32.pack(len(self._blobs)))
+        index.extend(digest + _UINT64.pack(offset)
+                     for digest, offset in self._blobs.items())
+        index_offset = self._write_frame(b"I", b"".join(index))
+        self._file.write(_UINT64.pack(index_offset) + MAGIC)
+        self._file.close()
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @staticmethod
+    def _literal(data: bytes) -> bytes:
+        return b"L" + _UINT32.pack(len(data)) + data
+
+    def _chunks(self, mime_message: email.message.Message,
+                flattened: bytes) -> bytes:
+        """Split a flattened message into chunks, referencing its attachments
+        by digest."""
+        chunks = []
+        position = 0
+        for part in mime_message.walk():
+            if part.is_multipart() or \
+                    part.get_content_disposition() != "attachment":
+                continue
+            payload = part.get_payload()
+            if not isinstance(payload, str) or \
+                    len(payload) < self._min_blob_size:
+                continue
+            # the generator writes payloads out line by line with CRLFs
+            wire_payload = payload.replace("\n", "\r\n").encode(
+                "ascii", "surrogateescape")
+            start = flattened.find(wire_payload, position)
+            if start == -1:
+                continue
+            digest = hashlib.sha256(wire_payload).digest()
+            if digest not in self._blobs:
+                self._blobs[digest] = self._write_frame(
+                    b"B", digest + wire_payload)
+            chunks.append(self._literal(flattened[position:start]))
+            chunks.append(b"R" + digest)
+            position = start + len(wire_payload)
+        chunks.append(self._literal(flattened[position:]))
+        return b"".join(chunks)
+
+    def _flush_segment(self) -> None:
+        if not self._segment:
+            return
+        offset = self._file.tell()
+        self._index.extend(
+            (offset, position) for position in range(len(self._segment)))
+        self._write_frame(
+            b"S",
+            _UINT32.pack(len(self._segment)) + b"".join(self._segment))
+        self._segment = []
+
+    def _write_frame(self, kind: bytes, data: bytes) -> int:
+        offset = self._file.tell()
+        compressed = self._codec.compress(data)
+        self._file.write(_FRAME_HEADER.pack(kind, len(compressed)))
+        self._file.write(compressed)
+        return offset
+
+
+class ArchiveReader:
+    """Reads messages from an archive, ready to send on the wire with their
+    envelopes."""
+    def __init__(self, file_path: str, blob_cache_size: int = 64) -> None:
+        """Open an archive.
+
+        Args:
+            file_path (str): The path of the archive.
+            blob_cache_size (int): The number of attachment payloads to keep
+                cached. Payloads that have dropped out of the cache are read
+                again from the file when they're next needed.
+
+        Raises:
+            ValueError: If the file isn't an archive, or wasn't closed
+                properly when it was written.
+        """
+        self._file: BinaryIO = open(file_path, "rb")
+        header = self._file.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            self._file.close()
+            raise ValueError(f"'{file_path}' is not an sremail archive")
+        self._codec = _Codec(header[-1], 0)
+
+        self._file.seek(-(_UINT64.size + len(MAGIC)), 2)
+        footer = self._file.read()
+        if footer[_UINT64.size:] != MAGIC:
+            self._file.close()
+            raise ValueError(f"'{file_path}' is incomplete")
+        self._index_offset = _UINT64.unpack(footer[:_UINT64.size])[0]
+        self._index = None
+        self._blob_offsets = None
+        self._blobs: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._blob_cache_size = blob_cache_size
+        self._segment_offset = None
+        self._segment: List[bytes] = []
+
+    def __iter__(self) -> Iterator[RenderedMessage]:
+        """Read every message in the archive, in order, from start to end.
+
+        Yields:
+            RenderedMessage: The flattened messages and their envelopes.
+        """
+        offset = len(MAGIC) + 1
+        while offset < self._index_offset:
+            # random access may have moved the file on between messages
+            self._file.seek(offset)
+            kind, data = self._read_frame()
+            offset = self._file.tell()
+            if kind == b"B":
+                self._cache_blob(data[:_DIGEST_SIZE], data[_DIGEST_SIZE:])
+            elif kind == b"S":
+                for record in _split_segment(data):
+                    yield self._assemble(record)
+
+    def __len__(self) -> int:
+        self._load_index()
+        return len(self._index)
+
+    def __getitem__(self, position: int) -> RenderedMessage:
+        """Read a single message using the index.
+
+        Args:
+            position (int): The position of the message in the archive.
+
+        Returns:
+            RenderedMessage: The flattened message and its envelope.
+        """
+        self._load_index()
+        segment_offset, segment_position = self._index[position]
+        if segment_offset != self._segment_offset:
+            self._file.seek(segment_offset)
+            self._segment = _split_segment(self._read_frame()[1])
+            self._segment_offset = segment_offset
+        return self._assemble(self._segment[segment_position])
+
+    def close(self) -> None:
+        """Close the archive."""
+        self._file.close()
+
+    def __enter__(self) -> "ArchiveReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _read_frame(self) -> Tuple[bytes, bytes]:
+        kind, length = _FRAME_HEADER.unpack(
+            self._file.read(_FRAME_HEADER.size))
+        return (kind, self._codec.decompress(self._file.read(length)))
+
+    def _load_index(self) -> None:
+        if self._index is not None:
+            return
+        self._file.seek(self._index_offset)
+        data = memoryview(self._read_frame()[1])
+        count = _UINT32.unpack_from(data)[0]
+        position = _UINT32.size
+        self._index = [
+            _INDEX_ENTRY.unpack_from(data, position + i * _INDEX_ENTRY.size)
+            for i in range(count)
+        ]
+        position += count * _INDEX_ENTRY.size
+        count = _UINT32.unpack_from(data, position)[0]
+        position += _UINT32.size
+        self._blob_offsets = {}
+        for _ in range(count):
+            digest = bytes(data[position:position + _DIGEST_SIZE])
+            position += _DIGEST_SIZE
+            self._blob_offsets[digest] = _UINT64.unpack_from(data,
+                                                             position)[0]
+            position += _UINT64.size
+
+    def _blob(self, digest: bytes) -> bytes:
+        blob = self._blobs.get(digest)
+        if blob is not None:
+            self._blobs.move_to_end(digest)
+            return blob
+        self._load_index()
+        self._file.seek(self._blob_offsets[digest])
+        blob = self._read_frame()[1][_DIGEST_SIZE:]
+        self._cache_blob(digest, blob)
+        return blob
+
+    def _cache_blob(self, digest: bytes, blob: bytes) -> None:
+        self._blobs[digest] = blob
+        self._blobs.move_to_end(digest)
+        while len(self._blobs) > self._blob_cache_size:
+            self._blobs.popitem(last=False)
+
+    def _assemble(self, record: bytes) -> RenderedMessage:
+        length = _UINT32.unpack_from(record)[0]
+        position = _UINT32.size
+        message_id, from_addr, mail_options, *to_addrs = record[
+            position:position + length].decode("utf-8").split("\0")
+        position += length
+        chunks = []
+        while position < len(record):
+            kind = record[position:position + 1]
+            position += 1
+            if kind == b"L":
+                length = _UINT32.unpack_from(record, position)[0]
+                position += _UINT32.size
+                chunks.append(record[position:position + length])
+                position += length
+            else:
+                chunks.append(self._blob(record[position:position +
+                                                _DIGEST_SIZE]))
+                position += _DIGEST_SIZE
+        return RenderedMessage.from_wire(message_id or None, from_addr,
+                                         to_addrs, b"".join(chunks),
+                                         mail_options.split())
+
+
+def _split_segment(data: bytes) -> List[bytes]:
+    """Split a segment into the records of its messages."""
+    count = _UINT32.unpack_from(data)[0]
+    position = _UINT32.size
+    records = []
+    for _ in range(count):
+        length = _UINT32.unpack_from(data, position)[0]
+        position += _UINT32.size
+        records.append(data[position:position + length])
+        position += length
+    return records
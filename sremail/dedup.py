@@ -0,0 +1,151 @@
+"""DedupCache
+
+A cache of which recipients have already accepted which messages, so
+retries and resumed runs don't send them again.
+
+Entries are keyed by Message-ID and recipient, expire after a TTL, and the
+oldest are dropped once the cache is full. The cache can be persisted to a
+file, which every entry is appended to as it's added, and which is read back
+in when the cache is opened again. The file is flushed after every add(),
+so a run that crashes can be resumed without sending again to recipients
+that already accepted a message.
+
+Example::
+    with DedupCache(file_path="sent.dedup") as dedup:
+        smtp.send_all(messages, "smtp.some_server.com:25", dedup=dedup)
+"""
+from collections import OrderedDict
+import os
+import threading
+import time
+from typing import Iterable, Optional, Tuple
+
+
+class DedupCache:
+    """A bounded, expiring set of (Message-ID, recipient) pairs.
+
+    Attributes:
+        max_size (int): The most entries kept, the oldest are dropped first.
+        ttl (float): How long entries are kept, in seconds.
+        file_path (str): The file the cache is persisted to, if any.
+    """
+    def __init__(self,
+                 max_size: int = 1000000,
+                 ttl: float = 24 * 60 * 60,
+                 file_path: Optional[str] = None) -> None:
+        """Create a cache, loading the entries persisted to file_path that
+        haven't expired.
+
+        Args:
+            max_size (int): The most entries to keep.
+            ttl (float): How long to keep entries, in seconds.
+            file_path (str): If given, entries will be persisted to this file.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.file_path = file_path
+        # entries all live as long as each other, so insertion order is
+        # expiry order
+        self._entries: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._file = None
+        if file_path is not None:
+            self._load()
+            # compact the file down to the entries that are left
+            with open(file_path + ".tmp", "w", encoding="utf-8") as out_file:
+                out_file.writelines(
+                    f"{expiry}\t{message_id}\t{recipient}\n"
+                    for (message_id, recipient), expiry in
+                    self._entries.items())
+            os.replace(file_path + ".tmp", file_path)
+            self._file = open(file_path, "a", encoding="utf-8")
+
+    def __contains__(self, entry: Tuple[str, str]) -> bool:
+        return self.seen(*entry)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(time.time())
+            return len(self._entries)
+
+    def seen(self, message_id: str, recipient: str) -> bool:
+        """Check whether a recipient has already accepted a message.
+
+        Args:
+            message_id (str): The Message-ID of the message.
+            recipient (str): The recipient's address.
+
+        Returns:
+            bool: Whether the recipient is in the cache for the message.
+        """
+        with self._lock:
+            expiry = self._entries.get((message_id, recipient))
+            return expiry is not None and expiry > time.time()
+
+    def add(self, message_id: str, recipients: Iterable[str]) -> None:
+        """Add the recipients that have accepted a message, writing them out
+        to the file if there is one.
+
+        Args:
+            message_id (str): The Message-ID of the message.
+            recipients (Iterable[str]): The recipients' addresses.
+        """
+        now = time.time()
+        expiry = now + self.ttl
+        with self._lock:
+            for recipient in recipients:
+                key = (message_id, recipient)
+                self._entries.pop(key, None)
+                self._entries[key] = expiry
+                if self._file is not None:
+                    self._file.write(f"{expiry}\t{message_id}\t{recipient}\n")
+            if self._file is not None:
+                self._file.flush()
+            self._expire(now)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def flush(self) -> None:
+        """Write any buffered entries out to the file."""
+        if self._file is not None:
+            with self._lock:
+                self._file.flush()
+
+    def close(self) -> None:
+        """Write any buffered entries out and close the file."""
+        if self._file is not None:
+            with self._lock:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "DedupCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            key, expiry = next(iter(self._entries.items()))
+            if expiry > now:
+                break
+            del self._entries[key]
+
+    def _load(self) -> None:
+        if not os.path.exists(self.file_path):
+            return
+        now = time.time()
+        with open(self.file_path, "r", encoding="utf-8") as in_file:
+            for line in in_file:
+                expiry, _, key = line.rstrip("\n").partition("\t")
+                message_id, _, recipient = key.partition("\t")
+                try:
+                    expiry = float(expiry)
+                except ValueError:
+                    # the last line may have been cut short by a crash
+                    continue
+                if expiry > now and recipient:
+                    self._entries.pop((message_id, recipient), None)
+                    self._entries[(message_id, recipient)] = expiry
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,213 @@
+"""DKIMSigner
+
+DKIM (RFC 6376) signing of MIME messages using relaxed/relaxed
+canonicalization.
+
+Parsed private keys are cached per key, and body hashes are cached per body
+key, so signing many messages that share a body and attachments only costs
+the canonicalization of their headers.
+"""
+import base64
+from collections import OrderedDict
+import email.message
+from email.generator import BytesGenerator
+from functools import lru_cache
+import hashlib
+from io import BytesIO
+import re
+import time
+from typing import Hashable, Iterable, Optional, Union
+
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+except ImportError:  # pragma: no cover - optional dependency
+    serialization = None
+
+DEFAULT_SIGNED_HEADERS = ("From", "Sender", "Reply-To", "Subject", "Date",
+                          "To", "Cc", "Message-Id", "Mime-Version",
+                          "Content-Type")
+"""Headers signed by default, if they are present on the message."""
+
+_WSP_RUN = re.compile(rb"[ \t]+")
+_TRAILING_WSP = re.compile(rb"[ \t]+\r\n")
+_FOLD = re.compile(rb"\r?\n(?=[ \t])")
+_LINE_ENDING = re.compile(rb"\r?\n")
+
+
+def canonicalize_header(name: bytes, value: bytes) -> bytes:
+    """Canonicalize a header using the 'relaxed' algorithm.
+
+    Args:
+        name (bytes): The header name.
+        value (bytes): The raw (possibly folded) header value.
+
+    Returns:
+        bytes: The canonicalized header, terminated with CRLF.
+
+    See:
+        https://tools.ietf.org/html/rfc6376#section-3.4.2
+    """
+    value = _WSP_RUN.sub(b" ", _FOLD.sub(b"", value)).strip(b" \t\r\n")
+    return name.strip().lower() + b":" + value + b"\r\n"
+
+
+def canonicalize_body(body: bytes) -> bytes:
+    """Canonicalize a message body using the 'relaxed' algorithm.
+
+    Args:
+        body (bytes): The raw message body.
+
+    Returns:
+        bytes: The canonicalized body.
+
+    See:
+        https://tools.ietf.org/html/rfc6376#section-3.4.4
+    """
+    body = _LINE_ENDING.sub(b"\r\n", body)
+    if not body.endswith(b"\r\n"):
+        body += b"\r\n"
+    body = _TRAILING_WSP.sub(b"\r\n", _WSP_RUN.sub(b" ", body))
+    body = body.rstrip(b"\r\n")
+    return body + b"\r\n" if body else b""
+
+
+@lru_cache(maxsize=32)
+def _load_private_key(key_data: bytes, password: Optional[bytes]):
+    """Parse a PEM private key. Cached, as parsing RSA keys is expensive."""
+    if serialization is None:
+        raise ImportError(
+            "DKIM signing requires the 'cryptography' package, install it "
+            "with 'pip install sremail[dkim]'")
+    return serialization.load_pem_private_key(key_data, password=password)
+
+
+class DKIMSigner:
+    """Signs MIME messages with a DKIM-Signature header.
+
+    Attributes:
+        domain (str): The signing domain (d= tag).
+        selector (str): The selector (s= tag).
+        signed_headers (tuple): The names of the headers to sign, if present.
+    """
+    def __init__(self,
+                 domain: str,
+                 selector: str,
+                 private_key: Union[str, bytes],
+                 password: Optional[bytes] = None,
+                 signed_headers: Iterable[str] = DEFAULT_SIGNED_HEADERS,
+                 body_cache_size: int = 1024) -> None:
+        """Create a new DKIM signer.
+
+        Args:
+            domain (str): The signing domain.
+            selector (str): The DNS selector the public key is published
+                under.
+            private_key (Union[str, bytes]): The PEM encoded RSA or Ed25519
+                private key.
+            password (bytes): The password of the private key, if encrypted.
+            signed_headers (Iterable[str]): The headers to sign, if present
+                on the message.
+            body_cache_size (int): The number of body hashes to keep cached.
+
+        Raises:
+            ImportError: If the 'cryptography' package is not installed.
+            ValueError: If the private key is not RSA or Ed25519.
+        """
+        if isinstance(private_key, str):
+            private_key = private_key.encode("ascii")
+        self._key = _load_private_key(private_key, password)
+        if isinstance(self._key, rsa.RSAPrivateKey):
+            algorithm = "rsa-sha256"
+        elif isinstance(self._key, ed25519.Ed25519PrivateKey):
+            algorithm = "ed25519-sha256"
+        else:
+            raise ValueError("DKIM keys must be RSA or Ed25519")
+
+        self.domain = domain
+        self.selector = selector
+        self.signed_headers = tuple(signed_headers)
+        self._tag_prefix = (f"v=1; a={algorithm}; c=relaxed/relaxed; "
+                            f"d={domain}; s={selector};")
+        self._body_hashes = OrderedDict()
+        self._body_cache_size = body_cache_size
+
+    def sign(self,
+             mime_message: email.message.EmailMessage,
+             body_key: Optional[Hashable] = None
+             ) -> email.message.EmailMessage:
+        """Sign a MIME message, prepending a DKIM-Signature header to it.
+
+        Args:
+            mime_message (email.message.EmailMessage): The message to sign.
+            body_key (Hashable): Identifies the body of the message. Messages
+                with the same body key MUST flatten to the same body, so the
+                body hash can be reused between them. Keys are kept in the
+                body hash cache, so should be small, i.e. a digest of the
+                body rather than the body itself. If not given the body hash
+                is always computed.
+
+        Returns:
+            email.message.EmailMessage: The signed message, for chaining.
+        """
+        body_hash = self._body_hash(mime_message, body_key)
+
+        policy = mime_message.policy
+        headers = []
+        names = []
+        available = list(mime_message.items())
+        for name in self.signed_headers:
+            # sign the last instance of a header first, see RFC6376 5.4.2
+            for i in range(len(available) - 1, -1, -1):
+                if available[i][0].lower() == name.lower():
+                    header_name, header_value = available.pop(i)
+                    folded = policy.fold_binary(header_name, header_value)
+                    raw_name, raw_value = folded.split(b":", 1)
+                    headers.append(canonicalize_header(raw_name, raw_value))
+                    names.append(name.lower())
+                    break
+
+        unsigned = (f"{self._tag_prefix} t={int(time.time())};\r\n"
+                    f" h={':'.join(names)};\r\n bh={body_hash};\r\n b=")
+        headers.append(
+            canonicalize_header(b"DKIM-Signature",
+                                unsigned.encode("ascii"))[:-2])
+        signature = base64.b64encode(self._sign(b"".join(headers)))
+        folded_signature = "\r\n ".join(
+            signature[i:i + 72].decode("ascii")
+            for i in range(0, len(signature), 72))
+
+        # insert the pre-folded header directly, otherwise the policy would
+        # refold the long b= tag into RFC2047 encoded words
+        mime_message._headers.insert(  # pylint: disable=protected-access
+            0,
+            policy.header_source_parse(
+                [f"DKIM-Signature: {unsigned}{folded_signature}\r\n"]))
+        return mime_message
+
+    def _sign(self, data: bytes) -> bytes:
+        if isinstance(self._key, rsa.RSAPrivateKey):
+            return self._key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        # ed25519-sha256 signs the SHA-256 digest, see RFC8463
+        return self._key.sign(hashlib.sha256(data).digest())
+
+    def _body_hash(self, mime_message: email.message.EmailMessage,
+                   body_key: Optional[Hashable]) -> str:
+        if body_key is not None and body_key in self._body_hashes:
+            self._body_hashes.move_to_end(body_key)
+            return self._body_hashes[body_key]
+
+        flattened = BytesIO()
+        BytesGenerator(flattened, mangle_from_=False,
+                       policy=mime_message.policy).flatten(mime_message)
+        raw = flattened.getvalue()
+        separator = re.search(rb"\r?\n\r?\n", raw)
+        body = raw[separator.end():] if separator else b""
+        body_hash = base64.b64encode(
+            hashlib.sha256(canonicalize_body(body)).digest()).decode("ascii")
+
+        if body_key is not None:
+            self._body_hashes[body_key] = body_hash
+            if len(self._body_hashes) > self._body_cache_size:
+                self._body_hashes.popitem(last=False)
+        return body_hash
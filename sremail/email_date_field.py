@@ -5,12 +5,28 @@ Defines a Marshmallow field for an email date.
 Author:
     Sam Gibson <sgibson@glasswallsolutions.com>
 """
-from datetime import datetime
+from datetime import datetime, timedelta
 from email.utils import parsedate_to_datetime, format_datetime
+from functools import lru_cache
+from typing import Optional
 
 from marshmallow.fields import Field
 
 
+@lru_cache(maxsize=1024)
+def _cached_format(value: datetime, offset: Optional[timedelta]) -> str:
+    # pylint: disable=unused-argument
+    return format_datetime(value)
+
+
+def _format_datetime(value: datetime) -> str:
+    """Format a date, cached, as messages generated in bulk tend to share
+    dates. The same instant in different time zones compares equal, so the
+    offset is part of the key, otherwise it'd be formatted in whichever time
+    zone was cached first."""
+    return _cached_format(value, value.utcoffset())
+
+
 class EmailDate(Field):
     """A formatted email date (RFC2822).
 
@@ -34,7 +50,7 @@ class EmailDate(Field):
     def _serialize(self, value: datetime, attr, obj, **kwargs) -> str:
         if value is None:
             return None
-        return format_datetime(value)
+        return _format_datetime(value)
 
     def _deserialize(self, value: str, attr, data, **kwargs) -> datetime:
         return parsedate_to_datetime(value)
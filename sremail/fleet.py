@@ -0,0 +1,279 @@
+"""Fleet, FleetStats
+
+Sending from several processes at once, to get past what one process can
+send with the GIL in the way.
+
+The parent process renders messages onto a shared queue, and each worker
+process takes them off it and sends them over a pool of asynchronous
+connections. When the messages run out the workers report back what they
+sent, which is added up into one set of stats.
+
+Example::
+    fleet = Fleet("smtp.some_server.com:25", workers=8, connections=16)
+    stats = fleet.run(spec.generate(1000000))
+    print(stats.messages_per_second)
+"""
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import os
+import queue
+import time
+from typing import Dict, Iterable, List, Optional
+
+import aiosmtplib
+
+from .dkim import DKIMSigner
+from .message import Message
+from .smtp import TLSConfig, connect_async, render
+
+
+class FleetStats:
+    """What a fleet sent.
+
+    Attributes:
+        messages (int): Messages accepted.
+        failed (int): Messages that couldn't be sent.
+        recipients (int): Recipients accepted.
+        refused (int): Recipients refused.
+        bytes (int): Bytes of message data accepted.
+        errors (Dict[str, int]): The number of each error messages failed
+            with, by SMTP reply code or exception type.
+        elapsed (float): Seconds from the first message being queued to the
+            last being sent.
+    """
+    def __init__(self) -> None:
+        self.messages = 0
+        self.failed = 0
+        self.recipients = 0
+        self.refused = 0
+        self.bytes = 0
+        self.errors: Dict[str, int] = Counter()
+        self.elapsed = 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        """The rate messages were accepted at."""
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        """The rate message data was accepted at."""
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def add(self, other: "FleetStats") -> None:
+        """Add the counts of another set of stats to these ones.
+
+        Args:
+            other (FleetStats): The stats to add.
+        """
+        self.messages += other.messages
+        self.failed += other.failed
+        self.recipients += other.recipients
+        self.refused += other.refused
+        self.bytes += other.bytes
+        self.errors.update(other.errors)
+
+    def as_dict(self) -> dict:
+        """Get the stats as a dict, including the rates."""
+        stats = dict(vars(self))
+        stats["errors"] = dict(self.errors)
+        stats["messages_per_second"] = self.messages_per_second
+        stats["bytes_per_second"] = self.bytes_per_second
+        return stats
+
+
+class Fleet:
+    """Sends messages from several worker processes.
+
+    Attributes:
+        smtp_url (str): The SMTP server URL the workers send to.
+        workers (int): The number of worker processes.
+        connections (int): The number of connections each worker sends over.
+        queue_size (int): The most rendered messages waiting to be sent.
+        timeout (float): The timeout in seconds for the workers' connections.
+        tls (TLSConfig): The TLS settings for the workers' connections.
+    """
+    def __init__(self,
+                 smtp_url: str,
+                 workers: Optional[int] = None,
+                 connections: int = 8,
+                 queue_size: int = 1024,
+                 timeout: Optional[float] = None,
+                 tls: Optional[TLSConfig] = None,
+                 start_method: Optional[str] = None) -> None:
+        """Create a fleet. No processes are started until run() is called.
+
+        Args:
+            smtp_url (str): The SMTP server URL to send to.
+            workers (int): The number of worker processes. If not specified,
+                one per CPU.
+            connections (int): The number of connections each worker sends
+                over at once.
+            queue_size (int): The most rendered messages to hold waiting to
+                be sent.
+            timeout (float): The timeout in seconds. If not specified, the
+                system default timeout will be used.
+            tls (TLSConfig): If given, the workers will connect over TLS.
+                SSLContexts can't be pickled, so this needs the 'fork' start
+                method.
+            start_method (str): The multiprocessing start method to use. If
+                not specified, the platform default is used.
+        """
+        self.smtp_url = smtp_url
+        self.workers = workers or os.cpu_count() or 1
+        self.connections = connections
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.tls = tls
+        self._context = multiprocessing.get_context(start_method)
+
+    def run(self,
+            messages: Iterable[Message],
+            signer: Optional[DKIMSigner] = None) -> FleetStats:
+        """Send messages, returning once they have all been sent.
+
+        Messages are rendered in this process as the workers take them, so
+        generators of any length can be sent in bounded memory.
+
+        Args:
+            messages (Iterable[Message]): The messages to send.
+            signer (DKIMSigner): If given, the messages will be DKIM signed.
+
+        Returns:
+            FleetStats: What the workers sent, added up.
+
+        Raises:
+            RuntimeError: If every worker exits before the messages are all
+                queued.
+        """
+        work = self._context.Queue(self.queue_size)
+        results = self._context.Queue()
+        processes = [
+            self._context.Process(target=_work,
+                                  args=(self.smtp_url, self.connections,
+                                        self.timeout, self.tls, work,
+                                        results),
+                                  name=f"sremail-fleet-{i}",
+                                  daemon=True) for i in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        started = time.perf_counter()
+        try:
+            for message in messages:
+                wire = render(message, signer)
+                if not _put(work, (wire.from_addr, wire.to_addrs, wire.data,
+                                   wire.mail_options), processes):
+                    raise RuntimeError("The fleet's workers have all exited")
+        finally:
+            # one for every connection of every worker to stop on
+            for _ in range(self.workers * self.connections):
+                if not _put(work, None, processes):
+                    break
+
+        stats = FleetStats()
+        reported = 0
+        while reported < len(processes):
+            try:
+                stats.add(results.get(timeout=0.1))
+                reported += 1
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes) \
+                        and results.empty():
+                    break
+        stats.elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+        return stats
+
+
+def _put(work: multiprocessing.Queue, item,
+         processes: List[multiprocessing.Process]) -> bool:
+    """Put an item on the work queue, giving up if the workers have all
+    exited, as then nothing will take it off.
+
+    Returns:
+        bool: Whether the item was put on the queue.
+    """
+    while True:
+        try:
+            work.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            if not any(process.is_alive() for process in processes):
+                return False
+
+
+def _work(smtp_url: str, connections: int, timeout: Optional[float],
+          tls: Optional[TLSConfig], work: multiprocessing.Queue,
+          results: multiprocessing.Queue) -> None:
+    """Send messages from the work queue until told to stop, then put what
+    was sent on the results queue. Runs in the worker processes."""
+    stats = FleetStats()
+    # the queue can only be waited on by blocking a thread
+    with ThreadPoolExecutor(connections) as executor:
+        asyncio.run(
+            _send_from(smtp_url, connections, timeout, tls, work, executor,
+                       stats))
+    results.put(stats)
+
+
+async def _send_from(smtp_url: str, connections: int,
+                     timeout: Optional[float], tls: Optional[TLSConfig],
+                     work: multiprocessing.Queue, executor: ThreadPoolExecutor,
+                     stats: FleetStats) -> None:
+    loop = asyncio.get_running_loop()
+
+    async def send_over_connection() -> None:
+        smtp = None
+        while True:
+            item = await loop.run_in_executor(executor, work.get)
+            if item is None:
+                break
+            from_addr, to_addrs, data, mail_options = item
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = await connect_async(smtp_url, timeout, tls)
+                refused, _ = await smtp.sendmail(from_addr, to_addrs, data,
+                                                 mail_options)
+            except aiosmtplib.SMTPRecipientsRefused as err:
+                stats.failed += 1
+                stats.refused += len(err.recipients)
+                stats.errors[str(err.recipients[0].code) if err.recipients
+                             else type(err).__name__] += 1
+                await _reset(smtp)
+            except aiosmtplib.SMTPResponseException as err:
+                stats.failed += 1
+                stats.errors[str(err.code)] += 1
+                await _reset(smtp)
+            except (aiosmtplib.SMTPException, OSError) as err:
+                stats.failed += 1
+                stats.errors[type(err).__name__] += 1
+                if smtp is not None:
+                    smtp.close()
+                smtp = None
+            else:
+                stats.messages += 1
+                stats.recipients += len(to_addrs) - len(refused)
+                stats.refused += len(refused)
+                stats.bytes += len(data)
+        if smtp is not None and smtp.is_connected:
+            try:
+                await smtp.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                smtp.close()
+
+    await asyncio.gather(*(send_over_connection()
+                           for _ in range(connections)))
+
+
+async def _reset(smtp: Optional[aiosmtplib.SMTP]) -> None:
+    """Reset a connection after a failed transaction, if it's still open."""
+    if smtp is not None and smtp.is_connected:
+        try:
+            await smtp.rset()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
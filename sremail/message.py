@@ -7,19 +7,31 @@ Author:
 """
 from __future__ import annotations  # to allow Message to return itself in methods...
 
+import binascii
+from concurrent.futures import ThreadPoolExecutor
 import email.message
 from email.message import MIMEPart
-from email.mime.text import MIMEText
+import email.policy
+from email import quoprimime
+from email.utils import make_msgid
+from functools import lru_cache, partial
+import hashlib
 from io import IOBase
-import mimetypes
+import mmap
+import os
 from os import path
-from typing import List
+import threading
+from typing import Iterable, List, Optional, Tuple, Union
+import weakref
 
-from marshmallow import Schema, fields, validates_schema, post_dump, pre_dump,\
+from marshmallow import Schema, fields, validates_schema, post_dump,\
     ValidationError, INCLUDE
 
+from . import profiling
 from .address import AddressField
+from .dkim import DKIMSigner
 from .email_date_field import EmailDate
+from .mime_types import DEFAULT_RESOLVER, SNIFF_SIZE, MimeResolver
 
 
 def mime_headerize(snake_case_val: str) -> str:
@@ -44,10 +56,6 @@ class MessageHeadersSchema(Schema):
     cc = fields.List(AddressField())
     bcc = fields.List(AddressField())
 
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self.cached_unknown_fields = {}
-
     class Meta:
         # a bit of a hack... as 'from' is a python keyword, we need to declare
         # the from field here and alias it to attribute 'from_addresses'
@@ -75,39 +83,333 @@ class MessageHeadersSchema(Schema):
         if not data.get("to") and not data.get("bcc"):
             raise ValidationError("One of 'to', or 'bcc' must be supplied")
 
-    @pre_dump()
-    def cache_unknown_fields(self, data):
-        """Cache any fields that were unknown, so we can dump them later on."""
-        field_names = [
+    @post_dump(pass_original=True)
+    def dump_unknown_fields(self, data, original):
+        """Add the fields that were unknown to the dumped output.
+
+        They're worked out from the original data on each dump, rather than
+        kept on the schema, so the schema can be shared between threads.
+        """
+        field_names = {
             field.attribute or field.name for field in self.fields.values()
-        ]
-        self.cached_unknown_fields.clear()
-        for key, value in data.items():
+        }
+        for key, value in original.items():
             if key not in field_names:
-                self.cached_unknown_fields[key] = value
-        return data
-
-    @post_dump()
-    def dump_unknown_fields(self, data):
-        """Add the unknown fields to the dumped output."""
-        for key, value in self.cached_unknown_fields.items():
-            new_key = mime_headerize(key)
-            data[new_key] = value
+                data[mime_headerize(key)] = value
         return data
 
 
 MESSAGE_HEADERS_SCHEMA = MessageHeadersSchema(unknown=INCLUDE)
 """Schema instance for validating message headers."""
 
+_UTF8_POLICY = email.policy.default.clone(utf8=True)
+"""Policy of messages to be sent with SMTPUTF8."""
+
+
+@lru_cache(maxsize=4096)
+def _cached_header(name: str, value: Union[str, Tuple[str, ...]]):
+    """Parse a header value into a header object.
+
+    Header objects are immutable, so they're cached and shared between
+    messages, saving the header registry from parsing the same values (i.e.
+    large recipient lists) again for each message.
+
+    Args:
+        name (str): The header name.
+        value (Union[str, Tuple[str, ...]]): The header value, or a list of
+            addresses to be joined up with commas.
+
+    Returns:
+        The header object, to be set on an email.message.EmailMessage.
+
+    Raises:
+        ValueError: If the value contains a linefeed or carriage return.
+    """
+    if isinstance(value, tuple):
+        value = ", ".join(value)
+    if len(value.splitlines()) > 1:
+        raise ValueError("Header values may not contain linefeed "
+                         "or carriage return characters")
+    return email.policy.default.header_factory(name, value)
+
+
+# RFC2045 limits base64 encoded lines to 76 characters
+_BASE64_LINE_LENGTH = 76
+
+
+def _encode_base64(data: bytes) -> str:
+    """Base64 encode data for use as a MIME payload.
+
+    The whole buffer is encoded in one call and then split into lines, which is
+    a lot quicker than encoding line-by-line as the email package does.
+
+    Args:
+        data (bytes): The data to encode, any bytes-like object.
+
+    Returns:
+        str: The encoded data, in lines terminated with newlines.
+    """
+    encoded = binascii.b2a_base64(data, newline=False)
+    lines = [
+        encoded[i:i + _BASE64_LINE_LENGTH]
+        for i in range(0, len(encoded), _BASE64_LINE_LENGTH)
+    ]
+    lines.append(b"")
+    return b"\n".join(lines).decode("ascii")
+
+
+# RFC5322 limits lines to 998 characters, not counting the CRLF
+_MAX_LINE_LENGTH = 998
+
+
+@lru_cache(maxsize=256)
+def _encode_body(text: str, eight_bit: bool) -> Tuple[str, str, str]:
+    """Encode a text body with the cheapest transfer encoding that's correct
+    for its content.
+
+    ASCII is sent as it is (7bit), as is UTF-8 if the server takes 8bit
+    data, otherwise it's sent as whichever of quoted-printable or base64 is
+    smaller. The encoded payloads are immutable strings, so they're cached
+    and shared between messages with the same body, which are then only
+    encoded once.
+
+    Args:
+        text (str): The body.
+        eight_bit (bool): Whether the server takes 8bit data (8BITMIME).
+
+    Returns:
+        Tuple[str, str, str]: The charset, transfer encoding and payload.
+    """
+    data = text.encode("utf-8", "surrogateescape")
+    charset = "us-ascii" if data.isascii() else "utf-8"
+    short_lines = all(
+        len(line) <= _MAX_LINE_LENGTH for line in data.splitlines())
+    if short_lines and charset == "us-ascii":
+        return charset, "7bit", text
+    if short_lines and eight_bit:
+        # the generator writes surrogate escaped payloads out as raw bytes
+        return charset, "8bit", data.decode("ascii", "surrogateescape")
+    quoted = quoprimime.body_encode(data.decode("latin-1"))
+    encoded = _encode_base64(data)
+    if len(quoted) <= len(encoded):
+        return charset, "quoted-printable", quoted
+    return charset, "base64", encoded
+
+
+def _body_part(text: str, subtype: str, eight_bit: bool) -> MIMEPart:
+    """Create a text body part, see _encode_body().
+
+    Parts are mutable, so each message gets its own, sharing only the
+    encoded payload.
+
+    Args:
+        text (str): The body.
+        subtype (str): The text subtype, i.e. 'plain' or 'html'.
+        eight_bit (bool): Whether the server takes 8bit data (8BITMIME).
+
+    Returns:
+        MIMEPart: The body part.
+    """
+    charset, encoding, payload = _encode_body(text, eight_bit)
+    # the same headers as email.mime.text.MIMEText gives
+    part = MIMEPart()
+    part["Content-Type"] = f"text/{subtype}"
+    part.set_param("charset", charset)
+    part["MIME-Version"] = "1.0"
+    part["Content-Transfer-Encoding"] = encoding
+    part.set_payload(payload)
+    return part
+
+
+def _add_binary_headers(attachment: MIMEPart, file_name: str,
+                        resolver: MimeResolver, data: bytes) -> None:
+    """Add the headers set_content would give a base64 encoded attachment."""
+    main_type, sub_type = resolver.resolve(file_name, data)
+    attachment["Content-Type"] = f"{main_type}/{sub_type}"
+    attachment["Content-Transfer-Encoding"] = "base64"
+    attachment.add_header("Content-Disposition",
+                          "attachment",
+                          filename=path.basename(file_name))
+
+
+def _create_attachment(data: Union[bytes, str],
+                       file_name: str,
+                       resolver: MimeResolver = DEFAULT_RESOLVER) -> MIMEPart:
+    """Create an attachment from the contents of a file.
+
+    Args:
+        data (Union[bytes, str]): The contents of the file.
+        file_name (str): The name of the file, used for MIME type
+            identification.
+        resolver (MimeResolver): Resolves the MIME type of the file.
+
+    Returns:
+        MIMEPart: The attachment.
+    """
+    attachment = MIMEPart()
+
+    if isinstance(data, str):
+        # we need special handling for set_content with datatype of str, as
+        # for some reason this method doesn't like 'maintype'
+        # see: https://docs.python.org/3/library/
+        # email.contentmanager.html#email.contentmanager.set_content
+        sample = data[:SNIFF_SIZE].encode("utf-8", "surrogateescape")
+        attachment.set_content(data,
+                               subtype=resolver.resolve(file_name, sample)[1],
+                               filename=path.basename(file_name),
+                               disposition="attachment")
+        return attachment
+
+    # binary data is encoded in bulk rather than through set_content
+    _add_binary_headers(attachment, file_name, resolver, data)
+    attachment.set_payload(_encode_base64(data))
+    return attachment
+
+
+def _read_attachment(file_path: str,
+                     resolver: MimeResolver = DEFAULT_RESOLVER) -> MIMEPart:
+    """Read a file into an attachment."""
+    with open(file_path, "rb") as attachment_file:
+        return _create_attachment(attachment_file.read(), file_path, resolver)
+
+
+class _MappedFile:
+    """A read-only memory map of a file, shared by the attachments of it."""
+    def __init__(self, file_path: str) -> None:
+        with open(file_path, "rb") as mapped_file:
+            self.mapping = mmap.mmap(mapped_file.fileno(),
+                                     0,
+                                     access=mmap.ACCESS_READ)
+        self._digest = None
+
+    @property
+    def digest(self) -> bytes:
+        """A hash of the file's content."""
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.mapping,
+                                           digest_size=16).digest()
+        return self._digest
+
+    def __del__(self) -> None:
+        self.mapping.close()
+
+
+# mappings are keyed by the file and its modification time and size, and
+# only live for as long as an attachment is using them
+_MAPPED_FILES = weakref.WeakValueDictionary()
+_MAPPED_FILES_LOCK = threading.Lock()
+
+
+def _map_file(file_path: str) -> _MappedFile:
+    """Get the shared mapping of a file, mapping it if needed."""
+    stat = os.stat(file_path)
+    key = (path.realpath(file_path), stat.st_mtime_ns, stat.st_size)
+    with _MAPPED_FILES_LOCK:
+        mapped_file = _MAPPED_FILES.get(key)
+        if mapped_file is None:
+            mapped_file = _MappedFile(file_path)
+            _MAPPED_FILES[key] = mapped_file
+        return mapped_file
+
+
+class MappedAttachment(MIMEPart):
+    """An attachment backed by a memory mapped file.
+
+    The payload is encoded straight from the mapping whenever it is read, so
+    the OS page cache holds the only full copy of the file, and every
+    attachment of the same file shares one mapping.
+
+    Setting a payload on the attachment detaches it from the file.
+    """
+    _mapped_file = None
+
+    def __init__(self,
+                 file_path: str,
+                 resolver: MimeResolver = DEFAULT_RESOLVER) -> None:
+        """Create an attachment from a file.
+
+        Args:
+            file_path (str): The path to the file to attach.
+            resolver (MimeResolver): Resolves the MIME type of the file.
+
+        Raises:
+            ValueError: If the file is empty, as empty files can't be mapped.
+        """
+        super().__init__()
+        mapped_file = _map_file(file_path)
+        _add_binary_headers(self, file_path, resolver,
+                            mapped_file.mapping[:SNIFF_SIZE])
+        self._mapped_file = mapped_file
+
+    @property
+    def _payload(self) -> Optional[str]:
+        if self._mapped_file is not None:
+            with memoryview(self._mapped_file.mapping) as view:
+                return _encode_base64(view)
+        return self.__dict__.get("_encoded_payload")
+
+    @_payload.setter
+    def _payload(self, value: Optional[str]) -> None:
+        if value is not None:
+            self._mapped_file = None
+        self.__dict__["_encoded_payload"] = value
+
+
+def _map_attachment(file_path: str,
+                    resolver: MimeResolver = DEFAULT_RESOLVER) -> MIMEPart:
+    """Create a memory mapped attachment, if the file can be mapped."""
+    if os.stat(file_path).st_size == 0:
+        return _read_attachment(file_path, resolver)
+    return MappedAttachment(file_path, resolver)
+
+
+def _attachment_digest(attachment: MIMEPart) -> bytes:
+    """Get a hash of an attachment's payload.
+
+    The hash is kept on the attachment alongside the payload it was computed
+    from, so each payload is only hashed once however many messages share
+    it. Mapped attachments are hashed straight from their mapping.
+    """
+    mapped_file = getattr(attachment, "_mapped_file", None)
+    if mapped_file is not None:
+        return mapped_file.digest
+    # get_payload() scans the whole payload for surrogates on every call
+    payload = attachment._payload  # pylint: disable=protected-access
+    cached = attachment.__dict__.get("_sremail_digest")
+    if cached is None or cached[0] is not payload:
+        digest = hashlib.blake2b(
+            str(payload).encode("utf-8", "surrogateescape"),
+            digest_size=16).digest()
+        cached = attachment.__dict__["_sremail_digest"] = (payload, digest)
+    return cached[1]
+
+
+def _boundary(digest: bytes) -> str:
+    """Get a MIME boundary from a digest, in the email package's format."""
+    return "===============%019d==" % (int.from_bytes(digest[:8], "big") %
+                                         10**19)
+
 
 class Message:
     """A MIME message.
 
     Attributes:
         headers (dict): The headers of the MIME message.
+        html (str): The HTML body of the message, if it has one.
         attachments (List[email.message.Message]): MIME objects attached to the message.
+        mime_resolver (MimeResolver): Resolves the MIME types of attachments
+            as they are attached. Set it on a message, or a subclass, to
+            resolve types differently.
     """
-    def __init__(self, body: str = "", **headers) -> None:
+    mime_resolver = DEFAULT_RESOLVER
+    html = None
+    _message_id = None
+    _message_id_derived = False
+
+    def __init__(self,
+                 body: str = "",
+                 html: Optional[str] = None,
+                 **headers) -> None:
         """Create a message, specifying headers as kwargs.
 
         MUST use headers ('to' OR 'bcc') AND 'date' AND 'from_addresses'.
@@ -120,20 +422,27 @@ class Message:
 
         Args:
             body: The plaintext body of the email.
+            html: The HTML body of the email. If there's a plaintext body too,
+                they're sent as alternatives.
             kwargs: The headers.
         """
         # make sure the headers are valid
-        validation_result = MESSAGE_HEADERS_SCHEMA.validate(
-            MESSAGE_HEADERS_SCHEMA.dump(headers))
+        with profiling.timed("validation", self):
+            validation_result = MESSAGE_HEADERS_SCHEMA.validate(
+                MESSAGE_HEADERS_SCHEMA.dump(headers))
         if len(validation_result) > 0:
             raise ValueError(validation_result)
 
         self.headers = headers
         self.body = body
+        self.html = html
         self.attachments = []
 
     @classmethod
-    def with_headers(cls, headers: dict, body: str = "") -> Message:
+    def with_headers(cls,
+                     headers: dict,
+                     body: str = "",
+                     html: Optional[str] = None) -> Message:
         """Create a new MIME message with given headers. This allows you to
         create a message using raw headers.
 
@@ -166,6 +475,7 @@ class Message:
         Args:
             headers (dict): The raw headers to put on the Message.
             body (str): The body of the Message.
+            html (str): The HTML body of the Message.
 
         Returns:
             Message: The created Message object.
@@ -173,10 +483,11 @@ class Message:
         self = cls.__new__(cls)
         self.headers = headers
         self.body = body
+        self.html = html
         self.attachments = []
         return self
 
-    def attach(self, file_path: str) -> Message:
+    def attach(self, file_path: str, mapped: bool = False) -> Message:
         """Attach a file to the message.
 
         This method returns the object, so
@@ -185,10 +496,19 @@ class Message:
 
         Args:
             file_path (str): The path to the file to attach.
+            mapped (bool): Whether to memory map the file rather than read
+                it. Mapped attachments are encoded each time the message is
+                rendered, but don't hold a copy of the file in memory, and
+                are shared between messages attaching the same file.
 
         Returns:
             Message: this Message, for chaining.
         """
+        if mapped:
+            with profiling.timed("attachment_encoding", self):
+                self.attachments.append(
+                    _map_attachment(file_path, self.mime_resolver))
+            return self
         with open(file_path, "rb") as attachment_file:
             return self.attach_stream(attachment_file, file_path)
 
@@ -206,62 +526,200 @@ class Message:
         Returns:
             Message: this Message, for chaining.
         """
-        mime_type = mimetypes.guess_type(file_name)[0]
+        with profiling.timed("attachment_encoding", self):
+            self.attachments.append(
+                _create_attachment(stream.read(), file_name,
+                                   self.mime_resolver))
+        return self
 
-        # it's possible we get a file that doesn't have a mime type, like a
-        # Linux executable, or a mach-o file - in that case just set it
-        # to octet-stream as a generic stream of bytes
-        if mime_type is None:
-            main_type, sub_type = ("application", "octet-stream")
-        else:
-            main_type, sub_type = mime_type.split("/")
-        attachment = MIMEPart()
+    def attach_all(self,
+                   file_paths: Iterable[str],
+                   max_workers: Optional[int] = None,
+                   mapped: bool = False) -> Message:
+        """Attach many files to the message, reading and encoding them in
+        parallel. The attachments are added in the order they are given.
 
-        # we need special handling for set_content with datatype of str, as
-        # for some reason this method doesn't like 'maintype'
-        # see: https://docs.python.org/3/library/
-        # email.contentmanager.html#email.contentmanager.set_content
-        content_args = {"subtype": sub_type}
-        if main_type != "text":
-            content_args["maintype"] = main_type
-        file_name = path.basename(file_name)
-        attachment.set_content(stream.read(),
-                               filename=file_name,
-                               disposition="attachment",
-                               **content_args)
-        self.attachments.append(attachment)
+        This method returns the object, so
+        you can chain it like::
+            msg.attach_all(["file.pdf", "test.txt"]).attach("word.doc")
+
+        Args:
+            file_paths (Iterable[str]): The paths to the files to attach.
+            max_workers (int): The number of worker threads to use. If not
+                specified, the ThreadPoolExecutor default will be used.
+            mapped (bool): Whether to memory map the files, see attach().
+
+        Returns:
+            Message: this Message, for chaining.
+        """
+        with profiling.timed("attachment_encoding", self), \
+                ThreadPoolExecutor(max_workers) as executor:
+            self.attachments.extend(
+                executor.map(
+                    partial(_map_attachment if mapped else _read_attachment,
+                            resolver=self.mime_resolver), file_paths))
         return self
 
-    def as_mime(self) -> email.message.EmailMessage:
+    @property
+    def message_id(self) -> str:
+        """The Message-ID of this message.
+
+        If the headers don't give one, a unique one is generated at the
+        sender's domain the first time it's needed, and kept from then on.
+        See derive_message_id() for one that's the same every time.
+        """
+        if self._message_id is None:
+            self._message_id = self._header_message_id() or make_msgid(
+                domain=self._sender_domain())
+        return self._message_id
+
+    def derive_message_id(self) -> str:
+        """Give this message a Message-ID generated from a hash of its
+        headers, body and attachments, unless the headers give one.
+
+        The same message then gets the same Message-ID however many times
+        it's created and sent, and in whichever process, which is what
+        DedupCache needs to recognise resends. The smtp senders call this
+        when they're given a cache, before rendering the message.
+
+        Returns:
+            str: The Message-ID.
+        """
+        if not self._message_id_derived:
+            self._message_id = self._header_message_id() or \
+                self._generate_message_id()
+            self._message_id_derived = True
+        return self._message_id
+
+    def as_mime(self,
+                signer: Optional[DKIMSigner] = None,
+                eight_bit: bool = False,
+                utf8: bool = False) -> email.message.EmailMessage:
         """Get this message as a Python standard library Message object.
 
+        Args:
+            signer (DKIMSigner): If given, the message will be DKIM signed.
+            eight_bit (bool): Whether the server it's going to takes 8bit
+                data (advertises 8BITMIME), in which case non-ASCII bodies
+                are sent as they are rather than encoded. It should be sent
+                with the BODY=8BITMIME mail option.
+            utf8 (bool): Whether it's going to be sent with the SMTPUTF8 mail
+                option, in which case it's given a policy that writes
+                non-ASCII headers as UTF-8 rather than encoded words. It must
+                be flattened with that policy, as it's signed with it.
+
         Returns:
             email.message.EmailMessage
         """
-        mime_message = email.message.EmailMessage()
+        with profiling.timed("rendering", self):
+            return self._render_mime(signer, eight_bit, utf8)
+
+    def _render_mime(self, signer: Optional[DKIMSigner], eight_bit: bool,
+                     utf8: bool) -> email.message.EmailMessage:
+        mime_message = email.message.EmailMessage(
+            policy=_UTF8_POLICY if utf8 else email.policy.default)
         mime_message.add_header("Content-Type", "multipart/mixed")
         mime_message.add_header("MIME-Version", "1.0")
         dumped_headers = MESSAGE_HEADERS_SCHEMA.dump(self.headers)
         for key, val in dumped_headers.items():
-            # make sure lists are joined up with commas
             if isinstance(val, list):
-                joined_list = ", ".join(val)
-                val = joined_list
+                val = _cached_header(key, tuple(str(i) for i in val))
+            elif isinstance(val, str):
+                val = _cached_header(key, val)
             mime_message[key] = val
+        if "Message-ID" not in mime_message:
+            mime_message["Message-ID"] = self.message_id
 
         # add the body if it exists
-        if self.body:
-            mime_message.attach(MIMEText(self.body))
+        alternatives = None
+        if self.body and self.html:
+            alternatives = MIMEPart()
+            alternatives["Content-Type"] = "multipart/alternative"
+            alternatives.attach(_body_part(self.body, "plain", eight_bit))
+            alternatives.attach(_body_part(self.html, "html", eight_bit))
+            mime_message.attach(alternatives)
+        elif self.body or self.html:
+            mime_message.attach(
+                _body_part(self.body, "plain", eight_bit) if self.body else
+                _body_part(self.html, "html", eight_bit))
 
         # now the attachments
         for attachment in self.attachments:
             mime_message.attach(attachment)
 
+        if signer is not None:
+            # messages with the same body and attachments get the same
+            # boundary, so they flatten to the same body and the signer can
+            # reuse its body hash
+            body_key = self._body_key(eight_bit, utf8)
+            mime_message.set_boundary(_boundary(body_key))
+            if alternatives is not None:
+                alternatives.set_boundary(
+                    _boundary(
+                        hashlib.blake2b(
+                            f"{self.body}\0{self.html}".encode(
+                                "utf-8", "surrogateescape"),
+                            digest_size=8).digest()))
+            signer.sign(mime_message, body_key)
+
         return mime_message
 
+    def _header_message_id(self) -> Optional[str]:
+        """Get the Message-ID the headers give, if they give one."""
+        for key, value in self.headers.items():
+            if key.replace("_", "-").lower() == "message-id":
+                return str(value)
+        return None
+
+    def _sender_domain(self) -> str:
+        """Get the domain of the first sender, for generating Message-IDs."""
+        for key, value in self.headers.items():
+            if key.lower() in ("from", "from_addresses") and value:
+                sender = value[0] if isinstance(value, (list, tuple)) \
+                    else value
+                domain = str(sender).rpartition("@")[2].rstrip(">")
+                if domain:
+                    return domain
+        return "sremail"
+
+    def _generate_message_id(self) -> str:
+        """Generate a Message-ID from a hash of the message's content, at
+        the domain of its sender."""
+        dumped_headers = MESSAGE_HEADERS_SCHEMA.dump(self.headers)
+        content = hashlib.blake2b(digest_size=16)
+        for key, val in sorted(dumped_headers.items()):
+            if isinstance(val, list):
+                val = ", ".join(str(i) for i in val)
+            content.update(f"{key}: {val}\0".encode("utf-8",
+                                                   "surrogateescape"))
+        content.update(self.body.encode("utf-8", "surrogateescape"))
+        if self.html:
+            content.update(b"\0" +
+                           self.html.encode("utf-8", "surrogateescape"))
+        for attachment in self.attachments:
+            content.update(repr(attachment.items()).encode("utf-8",
+                                                           "surrogateescape"))
+            content.update(_attachment_digest(attachment))
+        return f"<{content.hexdigest()}@{self._sender_domain()}>"
+
+    def _body_key(self, eight_bit: bool, utf8: bool) -> bytes:
+        """Get a fixed size key identifying the body and attachments of this
+        message, as rendered for a server that does or doesn't take 8bit
+        data, with or without UTF-8 headers."""
+        key = hashlib.blake2b(digest_size=16)
+        key.update(b"8bit\0" if eight_bit else b"7bit\0")
+        key.update(b"utf8\0" if utf8 else b"ascii\0")
+        key.update(f"{self.body}\0{self.html}\0".encode(
+            "utf-8", "surrogateescape"))
+        for attachment in self.attachments:
+            key.update(repr(attachment.items()).encode("utf-8",
+                                                       "surrogateescape"))
+            key.update(_attachment_digest(attachment))
+        return key.digest()
+
     def __eq__(self, other):
         if isinstance(self, other.__class__):
-            return self.body == other.body and \
+            return self.body == other.body and self.html == other.html and \
                 self.headers == other.headers and sorted(
                 self.attachments) == sorted(other.attachments)
         return False
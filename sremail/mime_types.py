@@ -0,0 +1,188 @@
+"""MimeResolver, DEFAULT_TYPES, SIGNATURES
+
+Resolution of the MIME types of attachments.
+
+Types are looked up by file extension in a table compiled once from the
+mimetypes module's built in types, rather than through guess_type(), which
+reads the system's MIME type files the first time it's used and so gives
+different answers on different hosts.
+Files without an extension can have their type sniffed from their first few
+bytes rather than always being sent as application/octet-stream.
+
+Example::
+    resolver = MimeResolver({".eml": "message/rfc822"})
+    msg.mime_resolver = resolver
+    msg.attach("forwarded.eml")
+"""
+import mimetypes
+from os import path
+from typing import Dict, Mapping, Optional, Tuple
+
+DEFAULT_TYPE = ("application", "octet-stream")
+"""The type of files that can't be resolved."""
+
+_ADDED_TYPES = {
+    ".7z": "application/x-7z-compressed",
+    ".docm": "application/vnd.ms-word.document.macroEnabled.12",
+    ".docx": "application/vnd.openxmlformats-officedocument."
+             "wordprocessingml.document",
+    ".dotx": "application/vnd.openxmlformats-officedocument."
+             "wordprocessingml.template",
+    ".gz": "application/gzip",
+    ".ics": "text/calendar",
+    ".md": "text/markdown",
+    ".odp": "application/vnd.oasis.opendocument.presentation",
+    ".ods": "application/vnd.oasis.opendocument.spreadsheet",
+    ".odt": "application/vnd.oasis.opendocument.text",
+    ".pptm": "application/vnd.ms-powerpoint.presentation.macroEnabled.12",
+    ".pptx": "application/vnd.openxmlformats-officedocument."
+             "presentationml.presentation",
+    ".rar": "application/vnd.rar",
+    ".rtf": "application/rtf",
+    ".webp": "image/webp",
+    ".xlsm": "application/vnd.ms-excel.sheet.macroEnabled.12",
+    ".xlsx": "application/vnd.openxmlformats-officedocument."
+             "spreadsheetml.sheet",
+    ".xlt": "application/vnd.ms-excel",
+}
+
+DEFAULT_TYPES: Dict[str, str] = {
+    # the built in table, before any of the system's files are read into it
+    **mimetypes._types_map_default,  # pylint: disable=protected-access
+    **_ADDED_TYPES
+}
+"""The extensions resolved by default: the mimetypes module's built in
+table, which is the same on every host, plus common office, archive and
+image formats it doesn't have. Anything not in it is sent as DEFAULT_TYPE."""
+
+SIGNATURES: Tuple[Tuple[bytes, str], ...] = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (b"Rar!\x1a\x07", "application/vnd.rar"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),
+    (b"{\\rtf", "application/rtf"),
+    (b"%!PS", "application/postscript"),
+    (b"<?xml", "application/xml"),
+)
+"""The magic bytes content is sniffed for, and the type they mark."""
+
+SNIFF_SIZE = 512
+"""How many bytes from the start of a file are looked at to sniff its type."""
+
+# bytes that don't turn up in text, other than in escape sequences
+_BINARY_BYTES = bytes(set(range(32)) - set(b"\t\n\f\r\x1b"))
+
+_CACHE_SIZE = 4096
+
+
+def _split(mime_type: str) -> Tuple[str, str]:
+    main_type, _, sub_type = mime_type.partition("/")
+    return (main_type, sub_type)
+
+
+class MimeResolver:
+    """Resolves the (maintype, subtype) of files from their names, and
+    optionally their content.
+
+    Attributes:
+        sniff (bool): Whether to sniff the type of files without an
+            extension from their content.
+    """
+    def __init__(self,
+                 types: Optional[Mapping[str, str]] = None,
+                 sniff: bool = True) -> None:
+        """Create a resolver.
+
+        Args:
+            types (Mapping[str, str]): Extensions, including the leading '.',
+                and the MIME types to resolve them to. These are added to,
+                and override, DEFAULT_TYPES.
+            sniff (bool): Whether to sniff the type of files without an
+                extension from their content.
+        """
+        types = {**DEFAULT_TYPES, **(types or {})}
+        self._table = {
+            extension.lower(): _split(mime_type)
+            for extension, mime_type in types.items()
+        }
+        self.sniff = sniff
+        # keyed by the extension as given, so lookups skip lower()-ing it
+        self._cache: Dict[str, Tuple[str, str]] = {}
+
+    @classmethod
+    def from_system(cls, sniff: bool = True) -> "MimeResolver":
+        """Create a resolver that also knows every type in the system's MIME
+        type files, as the mimetypes module does.
+
+        Args:
+            sniff (bool): Whether to sniff the type of files without an
+                extension from their content.
+
+        Returns:
+            MimeResolver: The resolver.
+        """
+        mimetypes.init()
+        return cls(mimetypes.types_map, sniff)
+
+    def resolve(self,
+                file_name: str,
+                data: Optional[bytes] = None) -> Tuple[str, str]:
+        """Resolve the type of a file.
+
+        Args:
+            file_name (str): The name of the file.
+            data (bytes): The start of the file's content, at least
+                SNIFF_SIZE bytes of it if it's that big. Only looked at if
+                the file has no extension.
+
+        Returns:
+            Tuple[str, str]: The maintype and subtype.
+        """
+        extension = path.splitext(file_name)[1]
+        if not extension:
+            if self.sniff and data is not None:
+                return sniff(data)
+            return DEFAULT_TYPE
+        mime_type = self._cache.get(extension)
+        if mime_type is None:
+            mime_type = self._table.get(extension.lower(), DEFAULT_TYPE)
+            if len(self._cache) < _CACHE_SIZE:
+                self._cache[extension] = mime_type
+        return mime_type
+
+
+def sniff(data: bytes) -> Tuple[str, str]:
+    """Sniff the type of a file from the start of its content.
+
+    Args:
+        data (bytes): The start of the file's content.
+
+    Returns:
+        Tuple[str, str]: The maintype and subtype, DEFAULT_TYPE if it isn't
+            recognised.
+    """
+    sample = bytes(data[:SNIFF_SIZE])
+    for signature, mime_type in SIGNATURES:
+        if sample.startswith(signature):
+            return _split(mime_type)
+    if not sample or sample.translate(None, _BINARY_BYTES) != sample:
+        return DEFAULT_TYPE
+    try:
+        sample.decode("utf-8")
+    except UnicodeDecodeError as err:
+        # the sample may have cut a character in half
+        if err.start < len(sample) - 3:
+            return DEFAULT_TYPE
+    return ("text", "plain")
+
+
+DEFAULT_RESOLVER = MimeResolver()
+"""The resolver messages use unless given another."""
@@ -0,0 +1,223 @@
+"""OutcomeStore
+
+An append-only SQLite store of what happened to every message sent, for
+working out afterwards which recipients were refused, by which server.
+
+Outcomes are buffered and inserted in batches, in one transaction per batch,
+and are indexed by recipient and status so they can be queried quickly after
+runs of millions of messages. SQLite gives out the ids of the sends, so any
+number of stores can write to the same database, i.e. from several processes.
+
+Example::
+    with OutcomeStore("outcomes.db") as outcomes:
+        smtp.send_all(messages, "smtp.some_server.com:25", outcomes=outcomes)
+        for refusal in outcomes.with_status(REFUSED):
+            print(refusal["recipient"], refusal["code"], refusal["endpoint"])
+
+Every message sent is a row in the 'sends' table, and each of its recipients
+a row in the 'recipients' table, which can also be queried directly through
+the store's connection.
+"""
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+ACCEPTED = "accepted"
+"""Status of a recipient the server accepted the message for."""
+
+REFUSED = "refused"
+"""Status of a recipient the server refused."""
+
+FAILED = "failed"
+"""Status of a recipient that didn't get the message because it failed."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sends (
+    id INTEGER PRIMARY KEY,
+    message_id TEXT,
+    endpoint TEXT NOT NULL,
+    code INTEGER,
+    error TEXT,
+    started REAL NOT NULL,
+    elapsed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recipients (
+    send_id INTEGER NOT NULL REFERENCES sends (id),
+    recipient TEXT NOT NULL,
+    status TEXT NOT NULL,
+    code INTEGER,
+    response TEXT
+);
+CREATE INDEX IF NOT EXISTS recipients_recipient ON recipients (recipient);
+CREATE INDEX IF NOT EXISTS recipients_status ON recipients (status);
+CREATE INDEX IF NOT EXISTS sends_message_id ON sends (message_id);
+"""
+
+_SELECT = """
+SELECT sends.message_id, sends.endpoint, sends.error, sends.started,
+    sends.elapsed, recipients.recipient, recipients.status, recipients.code,
+    recipients.response
+FROM recipients JOIN sends ON sends.id = recipients.send_id
+"""
+
+
+class OutcomeStore:
+    """Records the outcome of sending messages to a SQLite database.
+
+    Attributes:
+        connection (sqlite3.Connection): The connection to the database, for
+            querying it directly. Call flush() first to see every outcome.
+        batch_size (int): How many messages' outcomes are buffered before
+            they're inserted.
+    """
+    def __init__(self, db_path: str, batch_size: int = 1000) -> None:
+        """Open a store, creating it if it doesn't exist. Outcomes are added
+        to any already in it.
+
+        Args:
+            db_path (str): The path of the database file.
+            batch_size (int): How many messages' outcomes to buffer before
+                inserting them.
+        """
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # outcomes are only appended, so losing the last batch to a power
+        # cut is fine
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(_SCHEMA)
+        self.batch_size = batch_size
+        # each send with its recipients, which get its id once it's inserted
+        self._sends: List[Tuple[tuple, List[tuple]]] = []
+        self._lock = threading.Lock()
+
+    def record(self,
+               endpoint: str,
+               recipients: Iterable[str],
+               refused: Optional[Mapping[str, Tuple[int,
+                                                    Union[bytes,
+                                                          str]]]] = None,
+               message_id: Optional[str] = None,
+               code: Optional[int] = None,
+               error: Optional[str] = None,
+               started: Optional[float] = None,
+               elapsed: float = 0.0) -> None:
+        """Record the outcome of sending a message.
+
+        Args:
+            endpoint (str): The server the message was sent to.
+            recipients (Iterable[str]): Who the message was sent to.
+            refused (Mapping[str, Tuple[int, Union[bytes, str]]]): The
+                recipients the server refused, and its reply for each.
+            message_id (str): The Message-ID of the message, if it has one.
+            code (int): The server's reply code for the message as a whole.
+            error (str): Why the message wasn't sent, if it wasn't. The
+                recipients that weren't refused are recorded as failed.
+            started (float): When the message started being sent, as a Unix
+                timestamp. Defaults to now.
+            elapsed (float): How long sending the message took, in seconds.
+        """
+        refused = refused or {}
+        not_refused = FAILED if error is not None else ACCEPTED
+        recipient_rows = []
+        for recipient in recipients:
+            reply = refused.get(recipient)
+            if reply is None:
+                recipient_rows.append((recipient, not_refused, None, None))
+            else:
+                response = reply[1].decode("utf-8", "replace") \
+                    if isinstance(reply[1], bytes) else reply[1]
+                recipient_rows.append((recipient, REFUSED, reply[0], response))
+        with self._lock:
+            self._sends.append(
+                ((message_id, endpoint, code, error,
+                  time.time() if started is None else started, elapsed),
+                 recipient_rows))
+            if len(self._sends) >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        """Insert the buffered outcomes."""
+        with self._lock:
+            self._flush()
+
+    def recipient(self, recipient: str) -> List[dict]:
+        """Get the outcomes for a recipient.
+
+        Args:
+            recipient (str): The recipient's address.
+
+        Returns:
+            List[dict]: For each message sent to the recipient, its
+                message_id, endpoint, error, started and elapsed, and the
+                recipient's status, code and response.
+        """
+        return self._query("WHERE recipients.recipient = ?", (recipient, ))
+
+    def with_status(self,
+                    status: str,
+                    endpoint: Optional[str] = None) -> List[dict]:
+        """Get the outcomes of every recipient with a status.
+
+        Args:
+            status (str): One of ACCEPTED, REFUSED or FAILED.
+            endpoint (str): If given, only outcomes from this server.
+
+        Returns:
+            List[dict]: The outcomes, see recipient().
+        """
+        if endpoint is None:
+            return self._query("WHERE recipients.status = ?", (status, ))
+        return self._query(
+            "WHERE recipients.status = ? AND sends.endpoint = ?",
+            (status, endpoint))
+
+    def counts(self) -> Dict[str, int]:
+        """Count the recipients with each status.
+
+        Returns:
+            Dict[str, int]: The number of recipients with each status.
+        """
+        self.flush()
+        with self._lock:
+            return dict(
+                self.connection.execute(
+                    "SELECT status, COUNT(*) FROM recipients GROUP BY status"
+                ).fetchall())
+
+    def close(self) -> None:
+        """Insert the buffered outcomes and close the store."""
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self) -> "OutcomeStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _flush(self) -> None:
+        if not self._sends:
+            return
+        recipient_rows = []
+        with self.connection:
+            for send, recipients in self._sends:
+                send_id = self.connection.execute(
+                    "INSERT INTO sends (message_id, endpoint, code, error, "
+                    "started, elapsed) VALUES (?, ?, ?, ?, ?, ?)",
+                    send).lastrowid
+                recipient_rows.extend(
+                    (send_id, *recipient) for recipient in recipients)
+            self.connection.executemany(
+                "INSERT INTO recipients VALUES (?, ?, ?, ?, ?)",
+                recipient_rows)
+        self._sends = []
+
+    def _query(self, where: str, parameters: tuple) -> List[dict]:
+        self.flush()
+        with self._lock:
+            return [
+                dict(row) for row in self.connection.execute(
+                    _SELECT + where + " ORDER BY sends.id", parameters)
+            ]
@@ -0,0 +1,287 @@
+"""Profiler, profile, timed, emit
+
+Opt-in profiling of where the time goes when creating and sending messages.
+
+Profiling can be turned on for a block of code::
+    with profiling.profile() as profiler:
+        smtp.send_all(messages, "smtp.some_server.com:25")
+    print(profiler.to_json())
+
+Or for a whole process by setting the SREMAIL_PROFILE environment variable to
+the path of a JSON file, which the summary is written to at the end of every
+send_all(). Callers running their own (e.g. async) send loops can call emit()
+when they're done.
+
+When profiling is off, timing a stage costs a function call and an empty
+'with' block.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+import weakref
+
+STAGES = ("validation", "address_parsing", "attachment_encoding", "rendering",
+          "network")
+"""The stages that are timed. Note 'address_parsing' happens during
+'validation', so the two overlap."""
+
+PROFILE_ENV_VAR = "SREMAIL_PROFILE"
+"""Environment variable to set to a file path to profile the whole process."""
+
+
+class Profiler:
+    """Collects the time spent in each stage, and per message.
+
+    Attributes:
+        top_n (int): How many of the slowest messages to keep.
+        output_path (str): Where emit() writes the summary to, if anywhere.
+    """
+    def __init__(self, top_n: int = 10,
+                 output_path: Optional[str] = None) -> None:
+        """Create a new profiler.
+
+        Args:
+            top_n (int): How many of the slowest messages to keep.
+            output_path (str): The path of a JSON file emit() will write the
+                summary to.
+        """
+        self.top_n = top_n
+        self.output_path = output_path
+        self._stage_totals = defaultdict(float)
+        self._stage_counts = defaultdict(int)
+        # [seconds, label, finalizer] for each message not yet finished
+        self._message_totals = {}
+        self._slowest = []
+        # reentrant, as a message can be finalized by garbage collection
+        # while the lock is held
+        self._lock = threading.RLock()
+
+    def record(self, stage: str, elapsed: float, message=None) -> None:
+        """Record time spent in a stage.
+
+        Args:
+            stage (str): The name of the stage.
+            elapsed (float): The time spent, in seconds.
+            message (Message): The message the time was spent on, if any.
+        """
+        with self._lock:
+            self._stage_totals[stage] += elapsed
+            self._stage_counts[stage] += 1
+            if message is not None:
+                entry = self._entry(message)
+                if entry is not None:
+                    entry[0] += elapsed
+                    # the message may not be fully created yet, so it's
+                    # labelled once it is
+                    if entry[1] is None and hasattr(message, "headers"):
+                        entry[1] = _label(message)
+
+    def finish(self, message) -> None:
+        """Mark a message as done with, so only the slowest are kept.
+
+        Messages that are never finished are finished when they're garbage
+        collected.
+
+        Args:
+            message (Message): The message.
+        """
+        with self._lock:
+            key = getattr(message, _KEY_ATTRIBUTE, None)
+            entry = self._message_totals.get(key)
+            if entry is not None:
+                entry[2].detach()
+                entry[1] = _label(message)
+                self._finish(key)
+
+    def summary(self) -> dict:
+        """Get a summary of the time spent.
+
+        Returns:
+            dict: With the keys 'stages', mapping each stage to its count,
+                total and mean seconds, and 'slowest_messages', a list of
+                the slowest messages and their total seconds.
+        """
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": self._stage_counts[stage],
+                    "total": total,
+                    "mean": total / self._stage_counts[stage]
+                }
+                for stage, total in self._stage_totals.items()
+            }
+            # messages that were never finished still count
+            slowest = list(self._slowest)
+            for seconds, label, _ in self._message_totals.values():
+                slowest.append((seconds, label or "unknown"))
+            slowest = heapq.nlargest(self.top_n, slowest)
+        return {
+            "stages": stages,
+            "slowest_messages": [{
+                "message": label,
+                "seconds": seconds
+            } for seconds, label in slowest]
+        }
+
+    def to_json(self) -> str:
+        """Get the summary as JSON.
+
+        Returns:
+            str: The summary, see summary().
+        """
+        return json.dumps(self.summary(), indent=2)
+
+    def dump(self, file_path: str) -> None:
+        """Write the summary to a JSON file.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        with open(file_path, "w") as out_file:
+            out_file.write(self.to_json())
+
+    def _entry(self, message) -> Optional[list]:
+        """Get the entry of a message, adding one if it hasn't got one."""
+        key = getattr(message, _KEY_ATTRIBUTE, None)
+        entry = self._message_totals.get(key)
+        if entry is None:
+            # keys are never reused, unlike id()s
+            key = next(_KEYS)
+            try:
+                setattr(message, _KEY_ATTRIBUTE, key)
+                finalizer = weakref.finalize(message, self._finish, key)
+            except (AttributeError, TypeError):
+                return None
+            entry = self._message_totals[key] = [0.0, None, finalizer]
+        return entry
+
+    def _finish(self, key: int) -> None:
+        with self._lock:
+            entry = self._message_totals.pop(key, None)
+            if entry is not None:
+                self._push_slowest((entry[0], entry[1] or "unknown"))
+
+    def _push_slowest(self, entry: Tuple[float, str]) -> None:
+        if len(self._slowest) < self.top_n:
+            heapq.heappush(self._slowest, entry)
+        elif entry[0] > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+
+class _Timer:
+    """Times a 'with' block into a profiler."""
+    __slots__ = ("profiler", "stage", "message", "start")
+
+    def __init__(self, profiler: Profiler, stage: str, message) -> None:
+        self.profiler = profiler
+        self.stage = stage
+        self.message = message
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        self.profiler.record(self.stage,
+                             time.perf_counter() - self.start, self.message)
+
+
+class _NullTimer:
+    """Does nothing, used when profiling is off."""
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+_KEY_ATTRIBUTE = "_profiling_key"
+_KEYS = itertools.count()
+
+_ACTIVE_PROFILER = Profiler(output_path=os.environ[PROFILE_ENV_VAR]) \
+    if os.environ.get(PROFILE_ENV_VAR) else None
+
+
+def _label(message) -> str:
+    """Get a label to identify a message by in the summary."""
+    headers = getattr(message, "headers", None)
+    if headers is None:
+        return "unknown"
+    to = headers.get("to") or headers.get("To") or headers.get("bcc") \
+        or headers.get("Bcc") or []
+    date = headers.get("date") or headers.get("Date")
+    return f"to={', '.join(str(addr) for addr in to)} date={date}"
+
+
+def active() -> Optional[Profiler]:
+    """Get the active profiler, if profiling is on."""
+    return _ACTIVE_PROFILER
+
+
+@contextmanager
+def profile(top_n: int = 10,
+            output_path: Optional[str] = None) -> Iterator[Profiler]:
+    """Turn profiling on for a block of code.
+
+    Args:
+        top_n (int): How many of the slowest messages to report.
+        output_path (str): The path of a JSON file to write the summary to
+            at the end of every send_all(), and when the block exits.
+
+    Yields:
+        Profiler: The profiler collecting the timings.
+    """
+    global _ACTIVE_PROFILER  # pylint: disable=global-statement
+    previous = _ACTIVE_PROFILER
+    _ACTIVE_PROFILER = Profiler(top_n, output_path)
+    try:
+        yield _ACTIVE_PROFILER
+    finally:
+        emit()
+        _ACTIVE_PROFILER = previous
+
+
+def timed(stage: str, message=None):
+    """Time a 'with' block as a stage, if profiling is on.
+
+    Example::
+        with profiling.timed("rendering", msg):
+            mime_message = msg.as_mime()
+
+    Args:
+        stage (str): The name of the stage, one of STAGES.
+        message (Message): The message the time is spent on, if any.
+
+    Returns:
+        A context manager.
+    """
+    if _ACTIVE_PROFILER is None:
+        return _NULL_TIMER
+    return _Timer(_ACTIVE_PROFILER, stage, message)
+
+
+def finish(message) -> None:
+    """Mark a message as done with, if profiling is on.
+
+    Args:
+        message (Message): The message.
+    """
+    if _ACTIVE_PROFILER is not None:
+        _ACTIVE_PROFILER.finish(message)
+
+
+def emit() -> None:
+    """Write the summary of the active profiler to its output path, if
+    profiling is on and it has one."""
+    if _ACTIVE_PROFILER is not None and _ACTIVE_PROFILER.output_path:
+        _ACTIVE_PROFILER.dump(_ACTIVE_PROFILER.output_path)
@@ -5,40 +5,564 @@ Methods for sending message.Message objects to SMTP servers.
 Author:
     Sam Gibson <sgibson@glasswallsolutions.com>
 """
+from __future__ import annotations  # to allow SMTPSession to return itself
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import copy
+from email.generator import BytesGenerator
+import email.message
+from email.utils import getaddresses
+from io import BytesIO
+import queue
 import smtplib
-from typing import List, Optional
+import socket
+import ssl
+import threading
+import time
+from typing import AsyncIterable, Dict, Iterable, Iterator, List, Optional, \
+    Tuple, Union
 
 import aiosmtplib
+from aiosmtplib.response import SMTPResponse
 
+from . import profiling
+from .dedup import DedupCache
+from .dkim import DKIMSigner
 from .message import Message
+from .outcomes import OutcomeStore
 
 
-def connect(smtp_url: str, timeout: Optional[float] = None) -> smtplib.SMTP:
+def _split_url(smtp_url: str) -> Tuple[str, Optional[int]]:
+    """Split an SMTP server URL into its host and port, as smtplib does.
+
+    Args:
+        smtp_url (str): The SMTP server URL, i.e. "smtp.some_server.com:25".
+
+    Returns:
+        Tuple[str, Optional[int]]: The host, and the port if there was one.
+    """
+    host, _, port = smtp_url.rpartition(":")
+    if not host or not port.isdigit():
+        return (smtp_url, None)
+    return (host, int(port))
+
+
+class TLSConfig:
+    """TLS settings to share between connections.
+
+    Connections made with the same TLSConfig share its SSLContext, and
+    synchronous connections resume the TLS session of the last connection
+    made to the same host, skipping the full handshake. asyncio can't resume
+    TLS sessions, so asynchronous connections only share the context.
+
+    Attributes:
+        context (ssl.SSLContext): The context connections are made with.
+        start_tls (bool): Whether to upgrade plain connections with STARTTLS,
+            rather than connecting with TLS from the start (SMTPS).
+    """
+    def __init__(self,
+                 context: Optional[ssl.SSLContext] = None,
+                 start_tls: bool = True) -> None:
+        """Create TLS settings.
+
+        Args:
+            context (ssl.SSLContext): The context to make connections with.
+                If not specified, ssl.create_default_context() is used.
+            start_tls (bool): Whether to use STARTTLS rather than SMTPS.
+        """
+        self.context = context or ssl.create_default_context()
+        self.start_tls = start_tls
+        self._sessions: Dict[str, ssl.SSLSession] = {}
+        self._lock = threading.Lock()
+
+    def wrap_socket(self,
+                    sock: socket.socket,
+                    server_hostname: Optional[str] = None,
+                    **kwargs) -> ssl.SSLSocket:
+        """Wrap a socket, resuming the last session with the host if there
+        is one. This lets smtplib use the TLSConfig as its SSLContext.
+
+        Args:
+            sock (socket.socket): The socket to wrap.
+            server_hostname (str): The host being connected to.
+            kwargs: Passed through to SSLContext.wrap_socket().
+
+        Returns:
+            ssl.SSLSocket: The wrapped socket.
+        """
+        with self._lock:
+            session = self._sessions.get(server_hostname)
+        # if the server won't resume the session it just does a full handshake
+        return self.context.wrap_socket(sock,
+                                        server_hostname=server_hostname,
+                                        session=session,
+                                        **kwargs)
+
+    def remember(self, server_hostname: str, sock: ssl.SSLSocket) -> None:
+        """Remember the session of a connection to resume it later.
+
+        With TLS 1.3 the session ticket only arrives after the handshake, so
+        this should be called once the server has replied to something.
+
+        Args:
+            server_hostname (str): The host connected to.
+            sock (ssl.SSLSocket): The connection's socket.
+        """
+        session = sock.session
+        if session is not None:
+            with self._lock:
+                self._sessions[server_hostname] = session
+
+
+def connect(smtp_url: str,
+            timeout: Optional[float] = None,
+            tls: Optional[TLSConfig] = None) -> smtplib.SMTP:
     """Connect to an SMTP server at a URL.
 
     Args:
         smtp_url (str): The SMTP server URL.
         timeout (float): The connection timeout in seconds. If not specified,
             the system default timeout will be used.
+        tls (TLSConfig): If given, the connection will use TLS.
     """
-    return smtplib.SMTP(smtp_url, timeout=timeout)
+    if tls is None:
+        return smtplib.SMTP(smtp_url, timeout=timeout)
+
+    # smtplib verifies the certificate against the host it was given, so it
+    # has to be given the host without the port
+    host, port = _split_url(smtp_url)
+    if tls.start_tls:
+        smtp = smtplib.SMTP(host, port or 0, timeout=timeout)
+        smtp.starttls(context=tls)
+    else:
+        smtp = smtplib.SMTP_SSL(host, port or 0, timeout=timeout, context=tls)
+    smtp.ehlo()
+    tls.remember(host, smtp.sock)
+    return smtp
 
 
 async def connect_async(smtp_url,
-                        timeout: Optional[float] = None) -> aiosmtplib.SMTP:
+                        timeout: Optional[float] = None,
+                        tls: Optional[TLSConfig] = None) -> aiosmtplib.SMTP:
     """Asynchronously connect to an SMTP server at a URL.
 
     Args:
         smtp_url (str): The SMTP server URL.
         timeout (float): The connection timeout in seconds. If not specified,
             the system default timeout will be used.
+        tls (TLSConfig): If given, the connection will use TLS.
+    """
+    hostname, port = _split_url(smtp_url)
+    smtp = aiosmtplib.SMTP(hostname=hostname,
+                           port=port,
+                           timeout=timeout,
+                           use_tls=tls is not None and not tls.start_tls,
+                           start_tls=tls is not None and tls.start_tls,
+                           tls_context=tls.context if tls else None)
+    await smtp.connect()
+    return smtp
+
+
+def _envelope(mime_message: email.message.Message) -> Tuple[str, List[str]]:
+    """Get the envelope sender and recipients of a message from its headers,
+    the same way smtplib.SMTP.send_message() does.
+
+    Args:
+        mime_message (email.message.Message): The message.
+
+    Returns:
+        Tuple[str, List[str]]: The sender and the recipients.
+    """
+    sender = mime_message["Sender"] or mime_message["From"]
+    from_addr = getaddresses([str(sender)])[0][1] if sender else ""
+    to_addrs = [
+        addr for _, addr in getaddresses([
+            str(value) for field in ("To", "Bcc", "Cc")
+            for value in mime_message.get_all(field, [])
+        ])
+    ]
+    return (from_addr, to_addrs)
+
+
+def _needs_smtputf8(message: Message) -> bool:
+    """Whether a message's envelope has any non-ASCII addresses, so it needs
+    sending with SMTPUTF8. Worked out from its headers the same way
+    _envelope() does, so it's known before the message is rendered.
+
+    Args:
+        message (Message): The message.
+
+    Returns:
+        bool: Whether the message needs SMTPUTF8.
     """
-    return await aiosmtplib.SMTP(smtp_url, timeout=timeout)
+    addresses = {}
+    for key, value in message.headers.items():
+        name = key.replace("_", "-").lower()
+        if name == "from-addresses":
+            name = "from"
+        if name in ("sender", "from", "to", "cc", "bcc") and value:
+            addresses[name] = [str(item) for item in value] \
+                if isinstance(value, (list, tuple)) else [str(value)]
+    values = (addresses.get("sender") or addresses.get("from", []))[:1] + [
+        value for name in ("to", "bcc", "cc")
+        for value in addresses.get(name, [])
+    ]
+    # only display names can be non-ASCII without the address being so
+    if all(value.isascii() for value in values):
+        return False
+    return not all(addr.isascii() for _, addr in getaddresses(values))
+
+
+def _error_code(err: BaseException, refused: dict) -> Optional[int]:
+    """Get the reply code of an error sending a message, adding any refused
+    recipients it carries to refused."""
+    if isinstance(err, smtplib.SMTPRecipientsRefused):
+        refused.update(err.recipients)
+    elif isinstance(err, aiosmtplib.SMTPRecipientsRefused):
+        refused.update((recipient.recipient, (recipient.code,
+                                              recipient.message))
+                       for recipient in err.recipients)
+    elif isinstance(err, smtplib.SMTPResponseException):
+        return err.smtp_code
+    elif isinstance(err, aiosmtplib.SMTPResponseException):
+        return err.code
+    return None
+
+
+@contextmanager
+def _delivery(endpoint: str, message_id: str, recipients: List[str],
+              outcomes: Optional[OutcomeStore],
+              dedup: Optional[DedupCache]) -> Iterator[Tuple[List[str], dict]]:
+    """Track sending a message in a 'with' block.
+
+    Recipients that have already accepted the message are left out, and if
+    there's none left the block shouldn't send it. Otherwise the outcome is
+    recorded, if there's a store, and the recipients that accept the message
+    are added to the dedup cache, if there is one.
+
+    Yields:
+        Tuple[List[str], dict]: The recipients to send the message to, and a
+            dict for the block to put the refused recipients in.
+    """
+    refused = {}
+    if dedup is not None:
+        recipients = [
+            recipient for recipient in recipients
+            if not dedup.seen(message_id, recipient)
+        ]
+    if not recipients or outcomes is None:
+        yield (recipients, refused)
+    else:
+        started = time.time()
+        start = time.perf_counter()
+        code = 250
+        error = None
+        try:
+            yield (recipients, refused)
+        except BaseException as err:
+            code = _error_code(err, refused)
+            error = str(err) or type(err).__name__
+            raise
+        finally:
+            outcomes.record(endpoint,
+                            recipients,
+                            refused,
+                            message_id=message_id,
+                            code=code,
+                            error=error,
+                            started=started,
+                            elapsed=time.perf_counter() - start)
+    if dedup is not None and recipients:
+        dedup.add(message_id, (recipient for recipient in recipients
+                               if recipient not in refused))
+
+
+class SMTPConnectionPool:
+    """A pool of synchronous SMTP connections to a server, which can be
+    opened ahead of time so a batch doesn't wait on connection set up.
+
+    Example::
+        with SMTPConnectionPool("smtp.some_server.com:465", tls=TLSConfig(
+                start_tls=False)) as pool:
+            pool.warm_up(8)
+            with pool.connection() as smtp:
+                smtp.send_message(msg.as_mime())
+    """
+    def __init__(self,
+                 smtp_url: str,
+                 timeout: Optional[float] = None,
+                 tls: Optional[TLSConfig] = None) -> None:
+        """Create a pool. No connections are opened until they're needed.
+
+        Args:
+            smtp_url (str): The SMTP server URL.
+            timeout (float): The connection timeout in seconds. If not
+                specified, the system default timeout will be used.
+            tls (TLSConfig): If given, connections will use TLS.
+        """
+        self.smtp_url = smtp_url
+        self.timeout = timeout
+        self.tls = tls
+        self._idle: List[smtplib.SMTP] = []
+        self._lock = threading.Lock()
+
+    def warm_up(self, count: int) -> None:
+        """Open connections in parallel until there are at least count idle.
+
+        With TLS, the first connection is made on its own so the rest can
+        resume its session.
+
+        Args:
+            count (int): The number of idle connections to have.
+        """
+        with self._lock:
+            needed = count - len(self._idle)
+        if needed <= 0:
+            return
+        connections = [self._connect()]
+        if needed > 1:
+            with ThreadPoolExecutor(needed - 1) as executor:
+                connections.extend(
+                    executor.map(lambda _: self._connect(),
+                                 range(needed - 1)))
+        with self._lock:
+            self._idle.extend(connections)
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """Take a connection from the pool, opening one if none are idle.
+
+        Connections are returned to the pool afterwards, unless anything
+        went wrong using them, in which case they're closed as they may be
+        part way through a transaction.
+
+        Yields:
+            smtplib.SMTP: The connection.
+        """
+        with self._lock:
+            smtp = self._idle.pop() if self._idle else None
+        if smtp is None:
+            smtp = self._connect()
+        returned = False
+        try:
+            yield smtp
+            with self._lock:
+                self._idle.append(smtp)
+            returned = True
+        finally:
+            if not returned:
+                smtp.close()
+
+    def close(self) -> None:
+        """Close all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp in idle:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+    def __enter__(self) -> SMTPConnectionPool:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _connect(self) -> smtplib.SMTP:
+        return connect(self.smtp_url, self.timeout, self.tls)
+
+
+class SMTPSession:
+    """Sends messages one after another over a single asynchronous SMTP
+    connection, resetting the transaction in between each one.
+
+    Example::
+        session = await SMTPSession.connect("smtp.some_server.com:25")
+        async with session:
+            await session.send_all(message_generator())
+
+    Attributes:
+        smtp (aiosmtplib.SMTP): The connection messages are sent over.
+        signer (DKIMSigner): Signs messages before they're sent, if set.
+        outcomes (OutcomeStore): Records what happened to each message, if
+            set.
+        dedup (DedupCache): Messages aren't sent again to recipients in it,
+            if set.
+        sent (int): The number of messages sent.
+    """
+    def __init__(self,
+                 smtp: aiosmtplib.SMTP,
+                 signer: Optional[DKIMSigner] = None,
+                 outcomes: Optional[OutcomeStore] = None,
+                 dedup: Optional[DedupCache] = None) -> None:
+        """Create a session on a connection.
+
+        Args:
+            smtp (aiosmtplib.SMTP): A connection, i.e. from connect_async().
+            signer (DKIMSigner): If given, messages will be DKIM signed.
+            outcomes (OutcomeStore): If given, the outcome of sending each
+                message will be recorded in it.
+            dedup (DedupCache): If given, messages won't be sent to
+                recipients that have already accepted them.
+        """
+        self.smtp = smtp
+        self.signer = signer
+        self.outcomes = outcomes
+        self.dedup = dedup
+        self.sent = 0
+        self._in_transaction = False
+        self._eight_bit = None
+
+    @classmethod
+    async def connect(cls,
+                      smtp_url: str,
+                      timeout: Optional[float] = None,
+                      signer: Optional[DKIMSigner] = None,
+                      tls: Optional[TLSConfig] = None,
+                      outcomes: Optional[OutcomeStore] = None,
+                      dedup: Optional[DedupCache] = None) -> SMTPSession:
+        """Connect to an SMTP server at a URL and start a session on it.
+
+        Args:
+            smtp_url (str): The SMTP server URL.
+            timeout (float): The timeout in seconds. If not specified, the
+                system default timeout will be used.
+            signer (DKIMSigner): If given, messages will be DKIM signed.
+            tls (TLSConfig): If given, the connection will use TLS.
+            outcomes (OutcomeStore): If given, the outcome of sending each
+                message will be recorded in it.
+            dedup (DedupCache): If given, messages won't be sent to
+                recipients that have already accepted them.
+
+        Returns:
+            SMTPSession: The session.
+        """
+        return cls(await connect_async(smtp_url, timeout, tls), signer,
+                   outcomes, dedup)
 
+    @classmethod
+    async def warm_up(cls,
+                      smtp_url: str,
+                      count: int,
+                      timeout: Optional[float] = None,
+                      signer: Optional[DKIMSigner] = None,
+                      tls: Optional[TLSConfig] = None,
+                      outcomes: Optional[OutcomeStore] = None,
+                      dedup: Optional[DedupCache] = None
+                      ) -> List[SMTPSession]:
+        """Open several sessions at once, before a batch starts.
 
-def send(message: Message, smtp_url: str,
-         timeout: Optional[float] = None) -> None:
+        Args:
+            smtp_url (str): The SMTP server URL.
+            count (int): The number of sessions to open.
+            timeout (float): The timeout in seconds. If not specified, the
+                system default timeout will be used.
+            signer (DKIMSigner): If given, messages will be DKIM signed.
+            tls (TLSConfig): If given, the connections will use TLS.
+            outcomes (OutcomeStore): If given, the outcome of sending each
+                message will be recorded in it.
+            dedup (DedupCache): If given, messages won't be sent to
+                recipients that have already accepted them.
+
+        Returns:
+            List[SMTPSession]: The sessions.
+        """
+        return list(await asyncio.gather(
+            *(cls.connect(smtp_url, timeout, signer, tls, outcomes, dedup)
+              for _ in range(count))))
+
+    @property
+    def endpoint(self) -> str:
+        """The server the session is connected to, as "host:port"."""
+        return f"{self.smtp.hostname}:{self.smtp.port}"
+
+    async def send(self, message: Message) -> Dict[str, SMTPResponse]:
+        """Send a message.
+
+        Args:
+            message (Message): The message to send.
+
+        Returns:
+            Dict[str, SMTPResponse]: The recipients that were refused, and
+                the server's response for each.
+        """
+        if self._eight_bit is None:
+            if self.smtp.is_ehlo_or_helo_needed:
+                await self.smtp.ehlo()
+            self._eight_bit = self.smtp.supports_extension("8bitmime")
+        if self.dedup is not None:
+            message.derive_message_id()
+        mime_message = message.as_mime(self.signer, self._eight_bit,
+                                       _needs_smtputf8(message))
+        from_addr, to_addrs = _envelope(mime_message)
+        with profiling.timed("network", message), \
+                _delivery(self.endpoint, message.message_id, to_addrs,
+                          self.outcomes, self.dedup) as (recipients, refused):
+            if recipients:
+                if self._in_transaction:
+                    await self.smtp.rset()
+                self._in_transaction = True
+                refused.update((await self.smtp.send_message(
+                    mime_message,
+                    sender=from_addr,
+                    recipients=recipients,
+                    mail_options=_mail_options(mime_message)))[0])
+        profiling.finish(message)
+        if recipients:
+            self.sent += 1
+        return refused
+
+    async def send_all(
+            self, messages: Union[Iterable[Message], AsyncIterable[Message]]
+    ) -> int:
+        """Send messages from an iterable or asynchronous iterable.
+
+        Messages are taken from the iterable one at a time as they are sent,
+        so generators of any length can be sent in constant memory.
+
+        Args:
+            messages (Union[Iterable[Message], AsyncIterable[Message]]): The
+                messages to send.
+
+        Returns:
+            int: The number of messages sent, not counting any skipped as
+                every recipient had already accepted them.
+        """
+        already_sent = self.sent
+        if hasattr(messages, "__aiter__"):
+            async for message in messages:
+                await self.send(message)
+        else:
+            for message in messages:
+                await self.send(message)
+        sent = self.sent - already_sent
+        if self.outcomes is not None:
+            self.outcomes.flush()
+        profiling.emit()
+        return sent
+
+    async def close(self) -> None:
+        """End the session and close the connection."""
+        if self.smtp.is_connected:
+            await self.smtp.quit()
+
+    async def __aenter__(self) -> SMTPSession:
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+
+def send(message: Message,
+         smtp_url: str,
+         timeout: Optional[float] = None,
+         signer: Optional[DKIMSigner] = None,
+         tls: Optional[TLSConfig] = None,
+         outcomes: Optional[OutcomeStore] = None,
+         dedup: Optional[DedupCache] = None) -> bool:
     """Send a Message to an SMTP server at a URL.
 
     Args:
@@ -46,14 +570,41 @@ def send(message: Message, smtp_url: str,
         smtp_url (str): The SMTP server URL to send the message to.
         timeout (float): The timeout in seconds. If not specified then system
             default will be used.
+        signer (DKIMSigner): If given, the message will be DKIM signed.
+        tls (TLSConfig): If given, the message will be sent over TLS.
+        outcomes (OutcomeStore): If given, the outcome of sending the message
+            will be recorded in it.
+        dedup (DedupCache): If given, the message won't be sent to recipients
+            that have already accepted it.
+
+    Returns:
+        bool: Whether the message was sent, False if every recipient had
+            already accepted it.
     """
-    with smtplib.SMTP(smtp_url, timeout=timeout) as smtp:
-        smtp.send_message(message.as_mime())
+    if dedup is not None:
+        message.derive_message_id()
+    mime_message = message.as_mime(signer,
+                                   utf8=_needs_smtputf8(message))
+    from_addr, to_addrs = _envelope(mime_message)
+    with profiling.timed("network", message), \
+            _delivery(smtp_url, message.message_id, to_addrs, outcomes,
+                      dedup) as (recipients, refused):
+        if recipients:
+            with connect(smtp_url, timeout, tls) as smtp:
+                refused.update(
+                    smtp.send_message(mime_message, from_addr, recipients,
+                                      _mail_options(mime_message)) or {})
+    profiling.finish(message)
+    return bool(recipients)
 
 
 async def send_async(message: Message,
                      smtp_url: str,
-                     timeout: Optional[float] = None) -> None:
+                     timeout: Optional[float] = None,
+                     signer: Optional[DKIMSigner] = None,
+                     tls: Optional[TLSConfig] = None,
+                     outcomes: Optional[OutcomeStore] = None,
+                     dedup: Optional[DedupCache] = None) -> bool:
     """Asynchronously send a message to an SMTP server at a URL.
 
     Args:
@@ -61,19 +612,313 @@ async def send_async(message: Message,
         smtp_url (str): The SMTP server URL to send the message to.
         timeout (float): The timeout in seconds. If not specified then system
             default will be used.
+        signer (DKIMSigner): If given, the message will be DKIM signed.
+        tls (TLSConfig): If given, the message will be sent over TLS.
+        outcomes (OutcomeStore): If given, the outcome of sending the message
+            will be recorded in it.
+        dedup (DedupCache): If given, the message won't be sent to recipients
+            that have already accepted it.
+
+    Returns:
+        bool: Whether the message was sent, False if every recipient had
+            already accepted it.
     """
-    await aiosmtplib.send(message.as_mime(),
-                          hostname=smtp_url,
-                          timeout=timeout)
+    if dedup is not None:
+        message.derive_message_id()
+    mime_message = message.as_mime(signer,
+                                   utf8=_needs_smtputf8(message))
+    from_addr, to_addrs = _envelope(mime_message)
+    with profiling.timed("network", message), \
+            _delivery(smtp_url, message.message_id, to_addrs, outcomes,
+                      dedup) as (recipients, refused):
+        if recipients:
+            smtp = await connect_async(smtp_url, timeout, tls)
+            try:
+                refused.update((await smtp.send_message(
+                    mime_message, sender=from_addr,
+                    recipients=recipients))[0])
+            except BaseException:
+                smtp.close()
+                raise
+            await smtp.quit()
+    profiling.finish(message)
+    return bool(recipients)
 
 
-def send_all(messages: List[Message], smtp_url: str) -> None:
-    """Send a list of Messages to an SMTP server at a URL.
+def _mail_options(mime_message: email.message.Message) -> Tuple[str, ...]:
+    """Get the mail options a message needs sending with, for its body."""
+    if any(part.get("Content-Transfer-Encoding") == "8bit"
+           for part in mime_message.walk()):
+        return ("BODY=8BITMIME", )
+    return ()
+
+
+class RenderedMessage:
+    """A message flattened and ready to go on the wire, i.e. to be sent with
+    sendmail() on any connection.
+
+    Attributes:
+        message_id (str): The Message-ID of the message.
+        from_addr (str): The envelope sender.
+        to_addrs (List[str]): The envelope recipients.
+        data (bytes): The flattened message, with CRLF line endings.
+        mail_options (Tuple[str, ...]): The mail options it needs sending
+            with.
+    """
+    __slots__ = ("message_id", "from_addr", "to_addrs", "data",
+                 "mail_options")
+
+    def __init__(self, mime_message: email.message.Message) -> None:
+        """Flatten a MIME message, taking its envelope from its headers the
+        same way smtplib.SMTP.send_message() does.
+
+        Args:
+            mime_message (email.message.Message): The message to flatten.
+
+        Raises:
+            ValueError: If the message needs sending with SMTPUTF8, but was
+                DKIM signed without rendering it for SMTPUTF8 (see render()),
+                as flattening it with UTF-8 headers would break the
+                signature.
+        """
+        self.message_id = mime_message["Message-ID"]
+        self.from_addr, self.to_addrs = _envelope(mime_message)
+        # Bcc recipients get the message, but not the header
+        if "Bcc" in mime_message:
+            mime_message = copy.copy(mime_message)
+            del mime_message["Bcc"]
+
+        policy = mime_message.policy
+        self.mail_options = _mail_options(mime_message)
+        if not all(addr.isascii()
+                   for addr in [self.from_addr, *self.to_addrs]):
+            if not policy.utf8:
+                if "DKIM-Signature" in mime_message:
+                    raise ValueError(
+                        "DKIM signed messages with non-ASCII addresses must "
+                        "be rendered for SMTPUTF8 before they're signed")
+                policy = policy.clone(utf8=True)
+            self.mail_options = ("SMTPUTF8", "BODY=8BITMIME")
+        flattened = BytesIO()
+        BytesGenerator(flattened, policy=policy).flatten(mime_message,
+                                                         linesep="\r\n")
+        self.data = flattened.getvalue()
+
+    @classmethod
+    def from_wire(cls,
+                  message_id: Optional[str],
+                  from_addr: str,
+                  to_addrs: List[str],
+                  data: bytes,
+                  mail_options: Tuple[str, ...] = ()) -> RenderedMessage:
+        """Create a rendered message from one that's already flattened, i.e.
+        read back from an archive.
+
+        Args:
+            message_id (str): The Message-ID of the message.
+            from_addr (str): The envelope sender.
+            to_addrs (List[str]): The envelope recipients.
+            data (bytes): The flattened message, which mustn't have a Bcc
+                header.
+            mail_options (Tuple[str, ...]): The mail options it needs
+                sending with.
+
+        Returns:
+            RenderedMessage: The message.
+        """
+        rendered = cls.__new__(cls)
+        rendered.message_id = message_id
+        rendered.from_addr = from_addr
+        rendered.to_addrs = to_addrs
+        rendered.data = data
+        rendered.mail_options = tuple(mail_options)
+        return rendered
+
+
+def render(message: Message,
+           signer: Optional[DKIMSigner] = None,
+           eight_bit: bool = False) -> RenderedMessage:
+    """Render a message and flatten it ready to go on the wire.
+
+    Messages with non-ASCII envelope addresses are rendered, and signed, with
+    UTF-8 headers, to be sent with SMTPUTF8.
 
     Args:
-        messages (List[Message]): The messages to send.
-        smtp_url (str): The SMTP server URL to send the messages to.
+        message (Message): The message to render.
+        signer (DKIMSigner): If given, the message will be DKIM signed.
+        eight_bit (bool): Whether the server it's going to takes 8bit data,
+            see Message.as_mime().
+
+    Returns:
+        RenderedMessage: The flattened message and its envelope.
+    """
+    return RenderedMessage(
+        message.as_mime(signer, eight_bit, _needs_smtputf8(message)))
+
+
+_END = object()
+"""Put on the queue by the renderer when it runs out of messages."""
+
+
+def _put(out_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put an item on a bounded queue, giving up if told to stop.
+
+    Returns:
+        bool: Whether the item was put on the queue.
     """
-    with smtplib.SMTP(smtp_url) as smtp:
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _render_all(messages: Iterable[Message], signer: Optional[DKIMSigner],
+                eight_bit: bool, derive_ids: bool, out_queue: queue.Queue,
+                stop: threading.Event) -> None:
+    """Render messages onto a queue until they run out or told to stop.
+
+    Errors are put on the queue to be raised by the sender.
+    """
+    try:
         for message in messages:
-            smtp.send_message(message.as_mime())
+            if derive_ids:
+                message.derive_message_id()
+            wire = render(message, signer, eight_bit)
+            if not _put(out_queue, (message, wire), stop):
+                return
+    except BaseException as err:  # pylint: disable=broad-except
+        _put(out_queue, err, stop)
+    else:
+        _put(out_queue, _END, stop)
+
+
+def send_iter(
+    messages: Iterable[Message],
+    smtp_url: str,
+    signer: Optional[DKIMSigner] = None,
+    tls: Optional[TLSConfig] = None,
+    timeout: Optional[float] = None,
+    prefetch: int = 8,
+    outcomes: Optional[OutcomeStore] = None,
+    dedup: Optional[DedupCache] = None
+) -> Iterator[Tuple[Message, Dict[str, Tuple[int, bytes]]]]:
+    """Send messages from any iterable to an SMTP server at a URL over one
+    connection, yielding each message once it's sent.
+
+    Messages are rendered on a background thread while earlier ones are
+    being sent, at most prefetch messages ahead, so a generator of any length
+    can be sent in bounded memory. Nothing is sent until the result is
+    iterated over, and stopping part way stops the rendering too.
+
+    Args:
+        messages (Iterable[Message]): The messages to send.
+        smtp_url (str): The SMTP server URL to send the messages to.
+        signer (DKIMSigner): If given, the messages will be DKIM signed.
+        tls (TLSConfig): If given, the messages will be sent over TLS.
+        timeout (float): The timeout in seconds. If not specified then system
+            default will be used.
+        prefetch (int): The most messages to render ahead of sending.
+        outcomes (OutcomeStore): If given, the outcome of sending each message
+            will be recorded in it.
+        dedup (DedupCache): If given, messages won't be sent to recipients
+            that have already accepted them. Messages that every recipient
+            has already accepted are skipped, and not yielded.
+
+    Yields:
+        Tuple[Message, Dict[str, Tuple[int, bytes]]]: Each message sent, and
+            the recipients that were refused with the server's reply for
+            each, as returned by smtplib.SMTP.sendmail().
+
+    Raises:
+        smtplib.SMTPNotSupportedError: If a message has non-ASCII addresses,
+            and the server doesn't advertise SMTPUTF8.
+        Exception: Any error rendering or sending a message, once the
+            messages before it have been sent.
+    """
+    rendered: queue.Queue = queue.Queue(max(prefetch, 1))
+    stop = threading.Event()
+    renderer = None
+    try:
+        with connect(smtp_url, timeout, tls) as smtp:
+            # bodies can only be rendered once it's known whether the server
+            # takes 8bit data
+            smtp.ehlo_or_helo_if_needed()
+            renderer = threading.Thread(
+                target=_render_all,
+                args=(messages, signer, smtp.has_extn("8bitmime"),
+                      dedup is not None, rendered, stop),
+                name="sremail-render",
+                daemon=True)
+            renderer.start()
+            while True:
+                item = rendered.get()
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                message, wire = item
+                with profiling.timed("network", message), \
+                        _delivery(smtp_url, wire.message_id, wire.to_addrs,
+                                  outcomes, dedup) as (recipients, refused):
+                    if recipients:
+                        if "SMTPUTF8" in wire.mail_options \
+                                and not smtp.has_extn("smtputf8"):
+                            raise smtplib.SMTPNotSupportedError(
+                                "One or more source or delivery addresses "
+                                "require internationalized email support, "
+                                "but the server does not advertise the "
+                                "required SMTPUTF8 capability")
+                        refused.update(
+                            smtp.sendmail(wire.from_addr, recipients,
+                                          wire.data, wire.mail_options))
+                profiling.finish(message)
+                if recipients:
+                    yield message, refused
+    finally:
+        stop.set()
+        if renderer is not None:
+            renderer.join()
+        if outcomes is not None:
+            outcomes.flush()
+
+
+def send_all(messages: Iterable[Message],
+             smtp_url: str,
+             signer: Optional[DKIMSigner] = None,
+             tls: Optional[TLSConfig] = None,
+             prefetch: int = 8,
+             outcomes: Optional[OutcomeStore] = None,
+             dedup: Optional[DedupCache] = None) -> int:
+    """Send Messages to an SMTP server at a URL over one connection.
+
+    Any iterable can be given, including a generator, see send_iter().
+
+    Args:
+        messages (Iterable[Message]): The messages to send.
+        smtp_url (str): The SMTP server URL to send the messages to.
+        signer (DKIMSigner): If given, the messages will be DKIM signed.
+        tls (TLSConfig): If given, the messages will be sent over TLS.
+        prefetch (int): The most messages to render ahead of sending.
+        outcomes (OutcomeStore): If given, the outcome of sending each message
+            will be recorded in it.
+        dedup (DedupCache): If given, messages won't be sent to recipients
+            that have already accepted them.
+
+    Returns:
+        int: The number of messages sent, not counting any skipped as every
+            recipient had already accepted them.
+    """
+    sent = 0
+    for _ in send_iter(messages,
+                       smtp_url,
+                       signer,
+                       tls,
+                       prefetch=prefetch,
+                       outcomes=outcomes,
+                       dedup=dedup):
+        sent += 1
+    profiling.emit()
+    return sent
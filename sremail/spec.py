@@ -0,0 +1,251 @@
+"""MessageSpec
+
+Generation of messages from a config (YAML or JSON) of header templates.
+
+The config is validated once, up front, through MessageHeadersSchema, and
+then compiled so that generating messages from it doesn't validate them all
+again.
+
+Example config::
+    headers:
+      To: ["user{index}@example.com"]
+      From: ["Test Sender <sender@example.com>"]
+      Date: now
+      Subject: "Test message {index}"
+      X-FileTrust-Tenant: "<guid>"
+    body: "Hello, world!"
+    attachments:
+      - attachment.pdf
+
+Header names are raw MIME headers, as with Message.with_headers(). String
+values can use str.format() style placeholders, which are filled in from the
+context given when generating; 'index' is always available. A Date of 'now'
+is set to the time each message is generated.
+
+The spec is validated as a whole with the context given to it. Templated
+values of the headers the schema knows (addresses and dates) are also
+validated as each message is generated, as what they render to can't be
+known up front. Every other value is copied into the messages as it is.
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import json
+from os import path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from marshmallow import ValidationError
+
+from .message import MESSAGE_HEADERS_SCHEMA, Message, _read_attachment
+
+NOW = "now"
+"""Date header value that is replaced with the time of generation."""
+
+
+def _is_template(value) -> bool:
+    return isinstance(value, str) and "{" in value
+
+
+class MessageSpec:
+    """A validated, compiled specification to generate messages from.
+
+    Attributes:
+        headers (dict): The raw header templates.
+        body (str): The body template.
+        attachments (list): The attachments every message gets. These are
+            read once and shared between the messages.
+    """
+    def __init__(self,
+                 headers: dict,
+                 body: str = "",
+                 attachments: Iterable[str] = (),
+                 **context) -> None:
+        """Validate and compile a spec.
+
+        Args:
+            headers (dict): The raw header templates.
+            body (str): The body template.
+            attachments (Iterable[str]): Paths of files to attach.
+            context: Sample values for the placeholders in the templates,
+                used for validating them. 'index' defaults to 0.
+
+        Raises:
+            ValueError: If the headers aren't valid, or the templates have
+                placeholders that aren't in the context.
+        """
+        # header names have to match the schema exactly to be validated
+        known_fields = {
+            field.data_key.lower(): field
+            for field in MESSAGE_HEADERS_SCHEMA.fields.values()
+        }
+        self.headers = {
+            known_fields[key.lower()].data_key
+            if key.lower() in known_fields else key: value
+            for key, value in headers.items()
+        }
+        self.body = body
+        self._compiled = self._compile()
+        # the fields validating the headers that are rendered per message
+        self._templated_fields = [
+            (key, known_fields[key.lower()])
+            for key, _, needs_render in self._compiled
+            if needs_render and key.lower() in known_fields
+        ]
+        self._body_is_template = _is_template(body)
+
+        context.setdefault("index", 0)
+        sample_headers = self._render(context, self._compiled)
+        for key, value in sample_headers.items():
+            if key.lower() == "date" and value == NOW:
+                sample_headers[key] = format_datetime(
+                    datetime.now(timezone.utc))
+        try:
+            MESSAGE_HEADERS_SCHEMA.load(sample_headers)
+        except ValidationError as err:
+            raise ValueError(err.messages) from err
+        except (TypeError, ValueError) as err:
+            # the date parsing doesn't raise a ValidationError
+            raise ValueError(str(err)) from err
+        if self._body_is_template:
+            try:
+                body.format_map(context)
+            except (KeyError, IndexError, ValueError) as err:
+                raise ValueError(f"Bad body template: {err}") from err
+
+        self.attachments = [
+            _read_attachment(file_path) for file_path in attachments
+        ]
+
+    @classmethod
+    def from_dict(cls, config: dict, **context) -> "MessageSpec":
+        """Create a spec from a config dict.
+
+        Args:
+            config (dict): With the keys 'headers', and optionally 'body'
+                and 'attachments'.
+            context: Sample values for the placeholders, see __init__().
+
+        Returns:
+            MessageSpec: The spec.
+        """
+        return cls(config["headers"], config.get("body", ""),
+                   config.get("attachments", ()), **context)
+
+    @classmethod
+    def from_file(cls, file_path: str, **context) -> "MessageSpec":
+        """Load a spec from a YAML or JSON config file.
+
+        Relative attachment paths are relative to the config file.
+
+        Args:
+            file_path (str): The path of the config file. Files ending in
+                .yaml or .yml are read as YAML, anything else as JSON.
+            context: Sample values for the placeholders, see __init__().
+
+        Returns:
+            MessageSpec: The spec.
+
+        Raises:
+            ImportError: If the file is YAML and PyYAML isn't installed.
+        """
+        with open(file_path, "r") as config_file:
+            if file_path.endswith((".yaml", ".yml")):
+                try:
+                    import yaml  # pylint: disable=import-outside-toplevel
+                except ImportError as err:
+                    raise ImportError(
+                        "YAML specs require the 'PyYAML' package, install "
+                        "it with 'pip install sremail[yaml]'") from err
+                config = yaml.safe_load(config_file)
+            else:
+                config = json.load(config_file)
+
+        config_dir = path.dirname(file_path)
+        config["attachments"] = [
+            path.join(config_dir, attachment)
+            for attachment in config.get("attachments", ())
+        ]
+        return cls.from_dict(config, **context)
+
+    def message(self, index: int = 0, **context) -> Message:
+        """Generate a message.
+
+        Args:
+            index (int): The value of the 'index' placeholder.
+            context: Values for the other placeholders.
+
+        Returns:
+            Message: The message.
+
+        Raises:
+            ValueError: If a templated address or date header renders to
+                something that isn't valid.
+        """
+        context["index"] = index
+        headers = self._render(context, self._compiled)
+        for key, value in headers.items():
+            if value == NOW and key.lower() == "date":
+                headers[key] = format_datetime(datetime.now(timezone.utc))
+        for key, field in self._templated_fields:
+            try:
+                field.deserialize(headers[key])
+            except ValidationError as err:
+                raise ValueError({key: err.messages}) from err
+            except (TypeError, ValueError) as err:
+                # the date parsing doesn't raise a ValidationError
+                raise ValueError({key: [str(err)]}) from err
+        body = self.body.format_map(context) \
+            if self._body_is_template else self.body
+        msg = Message.with_headers(headers, body)
+        msg.attachments = list(self.attachments)
+        return msg
+
+    def generate(self, count: Optional[int] = None,
+                 **context) -> Iterator[Message]:
+        """Generate messages.
+
+        Args:
+            count (int): The number of messages to generate. If not given,
+                messages are generated forever.
+            context: Values for the placeholders other than 'index', which
+                counts up from 0.
+
+        Yields:
+            Message: The messages.
+        """
+        index = 0
+        while count is None or index < count:
+            yield self.message(index, **context)
+            index += 1
+
+    def _compile(self) -> List[Tuple[str, object, bool]]:
+        """Split the headers into those that need rendering and those that
+        can be copied as they are."""
+        compiled = []
+        for key, value in self.headers.items():
+            if isinstance(value, list):
+                needs_render = any(_is_template(item) for item in value)
+            else:
+                needs_render = _is_template(value)
+            compiled.append((key, value, needs_render))
+        return compiled
+
+    @staticmethod
+    def _render(context: dict,
+                compiled: List[Tuple[str, object, bool]]) -> dict:
+        """Render the compiled headers with a context."""
+        headers = {}
+        try:
+            for key, value, needs_render in compiled:
+                if not needs_render:
+                    headers[key] = list(value) if isinstance(value,
+                                                             list) else value
+                elif isinstance(value, list):
+                    headers[key] = [
+                        item.format_map(context) if _is_template(item) else
+                        item for item in value
+                    ]
+                else:
+                    headers[key] = value.format_map(context)
+        except (KeyError, IndexError, ValueError) as err:
+            raise ValueError(f"Bad header template: {err}") from err
+        return headers
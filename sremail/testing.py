@@ -0,0 +1,295 @@
+"""SinkServer, SinkStats
+
+A local SMTP server that accepts and discards mail as fast as it can, for
+testing and benchmarking the senders in sremail.smtp without a live cluster.
+
+It can simulate latency, throttling (421/451 replies) and recipient limits,
+and counts what it receives.
+
+Example::
+    with SinkServer(latency=0.01) as server:
+        smtp.send_all(messages, server.url)
+    print(server.stats.messages, server.stats.bytes)
+"""
+import asyncio
+import random
+import ssl
+import threading
+from typing import List, Optional
+
+
+class SinkStats:
+    """Counts of what a SinkServer has received.
+
+    Attributes:
+        connections (int): Connections accepted.
+        messages (int): Messages accepted.
+        recipients (int): Recipients accepted.
+        bytes (int): Bytes of message data accepted.
+        throttled (int): Transactions refused with the throttle code.
+        refused_recipients (int): Recipients refused over the limit.
+        tls_upgrades (int): Connections upgraded with STARTTLS.
+    """
+    def __init__(self) -> None:
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.throttled = 0
+        self.refused_recipients = 0
+        self.tls_upgrades = 0
+
+    def as_dict(self) -> dict:
+        """Get the stats as a dict."""
+        return dict(vars(self))
+
+
+class SinkServer:
+    """An asyncio SMTP server that discards everything it accepts.
+
+    It can be run on its own thread, using it as a context manager or with
+    start() and stop(), or on a running event loop with 'async with' or
+    start_async() and stop_async().
+
+    Attributes:
+        host (str): The host the server listens on.
+        port (int): The port the server listens on. If 0 was given, this will
+            be the port that was picked once the server has started.
+        stats (SinkStats): Counts of what the server has received.
+        messages (List[bytes]): The messages received, if keep_messages
+            was set.
+    """
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency: float = 0.0,
+                 throttle_rate: float = 0.0,
+                 throttle_code: int = 451,
+                 max_recipients: Optional[int] = None,
+                 pipelining: bool = True,
+                 keep_messages: bool = False,
+                 max_message_size: int = 64 * 1024 * 1024,
+                 seed: Optional[int] = None,
+                 tls_context: Optional[ssl.SSLContext] = None,
+                 implicit_tls: bool = False) -> None:
+        """Create a new sink server.
+
+        Args:
+            host (str): The host to listen on.
+            port (int): The port to listen on, 0 picks a free port.
+            latency (float): Seconds to wait before accepting each message.
+            throttle_rate (float): The fraction of transactions to refuse
+                with throttle_code, between 0 and 1.
+            throttle_code (int): The code to throttle with. 421 closes the
+                connection, 451 only refuses the transaction.
+            max_recipients (int): The most recipients to accept per
+                transaction, recipients over this are refused with 452.
+            pipelining (bool): Whether to advertise PIPELINING.
+            keep_messages (bool): Whether to keep the messages received.
+            max_message_size (int): The largest message accepted, in bytes.
+            seed (int): Seed for deciding which transactions to throttle.
+            tls_context (ssl.SSLContext): A server context to offer TLS
+                with. STARTTLS needs Python 3.11 or later.
+            implicit_tls (bool): Whether to use TLS from the start (SMTPS)
+                rather than offering STARTTLS.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.throttle_code = throttle_code
+        self.max_recipients = max_recipients
+        self.pipelining = pipelining
+        self.keep_messages = keep_messages
+        self.max_message_size = max_message_size
+        self.tls_context = tls_context
+        self.implicit_tls = implicit_tls
+        self.stats = SinkStats()
+        self.messages: List[bytes] = []
+        self._random = random.Random(seed)
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """The URL of the server, to give to the senders."""
+        return f"{self.host}:{self.port}"
+
+    async def start_async(self) -> None:
+        """Start the server on the running event loop."""
+        self._server = await asyncio.start_server(
+            self._handle,
+            self.host,
+            self.port,
+            limit=self.max_message_size,
+            ssl=self.tls_context if self.implicit_tls else None)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop_async(self) -> None:
+        """Stop the server."""
+        self._server.close()
+        await self._server.wait_closed()
+
+    def start(self) -> "SinkServer":
+        """Start the server on its own thread.
+
+        Returns:
+            SinkServer: this server, for chaining.
+        """
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start_async())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run,
+                                        name="SinkServer",
+                                        daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        """Stop the server started with start()."""
+        asyncio.run_coroutine_threadsafe(self.stop_async(),
+                                         self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self) -> "SinkServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    async def __aenter__(self) -> "SinkServer":
+        await self.start_async()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop_async()
+
+    def _ehlo_lines(self, writer: asyncio.StreamWriter) -> List[str]:
+        lines = ["sremail.sink", "8BITMIME", "SMTPUTF8",
+                 f"SIZE {self.max_message_size}"]
+        if self.pipelining:
+            lines.append("PIPELINING")
+        if self._can_start_tls(writer):
+            lines.append("STARTTLS")
+        return lines
+
+    def _can_start_tls(self, writer: asyncio.StreamWriter) -> bool:
+        return self.tls_context is not None and not self.implicit_tls \
+            and hasattr(writer, "start_tls") \
+            and writer.get_extra_info("sslcontext") is None
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        self.stats.connections += 1
+
+        def reply(code: int, text: str) -> None:
+            writer.write(f"{code} {text}\r\n".encode("ascii"))
+
+        reply(220, "sremail.sink ESMTP")
+        mail_from = None
+        recipients = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, _ = line.decode("utf-8", "replace").strip() \
+                    .partition(" ")
+                command = command.upper()
+
+                if command == "EHLO":
+                    lines = self._ehlo_lines(writer)
+                    writer.write("".join(f"250-{line}\r\n"
+                                         for line in lines[:-1]).encode())
+                    reply(250, lines[-1])
+                elif command == "HELO":
+                    reply(250, "sremail.sink")
+                elif command == "MAIL":
+                    if self.throttle_rate and \
+                            self._random.random() < self.throttle_rate:
+                        self.stats.throttled += 1
+                        reply(self.throttle_code, "4.7.0 Try again later")
+                        if self.throttle_code == 421:
+                            break
+                        continue
+                    mail_from = line
+                    recipients = 0
+                    reply(250, "2.1.0 Ok")
+                elif command == "RCPT":
+                    if mail_from is None:
+                        reply(503, "5.5.1 Need MAIL command")
+                    elif self.max_recipients is not None and \
+                            recipients >= self.max_recipients:
+                        self.stats.refused_recipients += 1
+                        reply(452, "4.5.3 Too many recipients")
+                    else:
+                        recipients += 1
+                        reply(250, "2.1.5 Ok")
+                elif command == "DATA":
+                    if not recipients:
+                        reply(503, "5.5.1 No valid recipients")
+                        continue
+                    reply(354, "End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    data = await self._read_data(reader)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.stats.messages += 1
+                    self.stats.recipients += recipients
+                    self.stats.bytes += len(data)
+                    if self.keep_messages:
+                        self.messages.append(data)
+                    mail_from = None
+                    recipients = 0
+                    reply(250, "2.0.0 Ok queued")
+                elif command == "STARTTLS":
+                    if not self._can_start_tls(writer):
+                        reply(454, "4.7.0 TLS not available")
+                        continue
+                    reply(220, "2.0.0 Ready to start TLS")
+                    await writer.drain()
+                    await writer.start_tls(self.tls_context)
+                    mail_from = None
+                    recipients = 0
+                    self.stats.tls_upgrades += 1
+                elif command == "RSET":
+                    mail_from = None
+                    recipients = 0
+                    reply(250, "2.0.0 Ok")
+                elif command == "NOOP":
+                    reply(250, "2.0.0 Ok")
+                elif command == "QUIT":
+                    reply(221, "2.0.0 Bye")
+                    break
+                else:
+                    reply(500, "5.5.2 Command not recognized")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_data(reader: asyncio.StreamReader) -> bytes:
+        # the CRLF ending the DATA command counts towards the terminator, as
+        # an empty message is just ".\r\n"
+        chunks = [b"\r\n"]
+        tail = b"\r\n"
+        while not tail.endswith(b"\r\n.\r\n"):
+            chunks.append(await reader.readuntil(b".\r\n"))
+            tail = (tail + chunks[-1])[-5:]
+        data = b"".join(chunks)[2:-3]
+        # undo the dot stuffing, see RFC5321 4.5.2
+        if data.startswith(b".."):
+            data = data[1:]
+        return data.replace(b"\r\n..", b"\r\n.")
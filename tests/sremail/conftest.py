@@ -3,10 +3,16 @@ configuration for tests
 """
 import builtins
 import contextlib
+import datetime
 import io
+import ipaddress
+import ssl
+from typing import Optional
 
 import pytest
 
+from sremail.message import Message
+
 
 @pytest.fixture
 def mock_open(monkeypatch):
@@ -15,7 +21,7 @@ def mock_open(monkeypatch):
     files = {}
 
     @contextlib.contextmanager
-    def mocked_open(filename):
+    def mocked_open(filename, *args, **kwargs):
         file = io.StringIO(files.get(filename, ""))
         try:
             yield file
@@ -24,3 +30,83 @@ def mock_open(monkeypatch):
             file.close()
 
     monkeypatch.setattr(builtins, "open", mocked_open)
+
+
+@pytest.fixture
+def create_message():
+    """Fixture returning a function that creates test messages.
+
+    The function takes the recipients (test@email.com if none are given),
+    and optionally the body, the content and file name of an attachment, and
+    any other headers as kwargs, which override the default sender and date.
+    """
+    def create(*to: str,
+               body: str = "Hello, world!",
+               attachment: Optional[bytes] = None,
+               file_name: str = "test.bin",
+               **headers) -> Message:
+        headers.setdefault("from_addresses", ["test@email.com"])
+        headers.setdefault("date", datetime.datetime.now())
+        msg = Message(body, to=list(to or ("test@email.com", )), **headers)
+        if attachment is not None:
+            msg.attach_stream(io.BytesIO(attachment), file_name)
+        return msg
+
+    return create
+
+
+@pytest.fixture
+def generate_messages(create_message):
+    """Fixture returning a generator function that creates test messages.
+
+    The function takes the number of messages, and the local parts of each
+    message's recipients ("test" if none are given), which are numbered
+    with the message's index at @email.com.
+    """
+    def generate(count: int, *local_parts: str):
+        for i in range(0, count):
+            yield create_message(*(f"{part}{i}@email.com"
+                                   for part in local_parts or ("test", )),
+                                 body="")
+
+    return generate
+
+
+@pytest.fixture
+def tls_contexts(tmp_path):
+    """Fixture creating a self-signed certificate for 127.0.0.1, and server
+    and client SSL contexts using it."""
+    pytest.importorskip("cryptography")
+    # pylint: disable=import-outside-toplevel
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=1)) \
+        .add_extension(x509.SubjectAlternativeName(
+            [x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+                       critical=False) \
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                       critical=True) \
+        .sign(key, hashes.SHA256())
+
+    cert_path = tmp_path / "cert.pem"
+    key_path = tmp_path / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(serialization.Encoding.PEM,
+                          serialization.PrivateFormat.PKCS8,
+                          serialization.NoEncryption()))
+
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(str(cert_path), str(key_path))
+    client_context = ssl.create_default_context(cafile=str(cert_path))
+    return server_context, client_context
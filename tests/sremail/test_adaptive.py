@@ -0,0 +1,128 @@
+"""
+adaptive test module
+"""
+import asyncio
+
+from sremail.adaptive import AdaptiveSender, AIMDLimiter
+from sremail.dedup import DedupCache
+from sremail.testing import SinkServer
+
+
+def test_limiter_aimd():
+    """
+    the limit should double each round trip at first, be cut in half when
+    throttled, then grow by one a round trip
+    """
+    limiter = AIMDLimiter(initial_limit=2, max_limit=100)
+    for _ in range(0, 6):
+        limiter.in_flight += 1
+        limiter.release(0.01)
+    assert int(limiter.limit) == 8
+
+    limiter.in_flight += 2
+    limiter.release(0.01, succeeded=False, throttled=True)
+    limiter.release(0.01, succeeded=False, throttled=True)
+    # only cut once for the same round trip
+    assert int(limiter.limit) == 4
+
+    for _ in range(0, 4):
+        limiter.in_flight += 1
+        limiter.release(0.01)
+    assert 4.9 < limiter.limit < 5.1
+
+    # much slower sends count as the server struggling
+    limiter.in_flight += 1
+    limiter.release(1.0)
+    assert 2.4 < limiter.limit < 2.6
+    assert limiter.as_dict()["sent"] == 11
+    assert limiter.as_dict()["throttled"] == 2
+    assert limiter.as_dict()["min_latency"] == 0.01
+
+
+def test_limiter_bounds():
+    """
+    the limit should stay between its minimum and maximum
+    """
+    limiter = AIMDLimiter(initial_limit=2, min_limit=1, max_limit=3)
+    for _ in range(0, 5):
+        limiter.in_flight += 1
+        limiter.release(0.01)
+    assert limiter.limit == 3
+    for _ in range(0, 5):
+        limiter.in_flight += 1
+        limiter.release(0.01, succeeded=False, throttled=True)
+    assert limiter.limit == 1
+
+
+def test_limiter_acquire():
+    """
+    sends should wait while the limit is reached
+    """
+    async def run():
+        limiter = AIMDLimiter(initial_limit=2)
+        await limiter.acquire()
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        limiter.release(0.01)
+        await asyncio.wait_for(waiting, 1)
+        return limiter.in_flight
+
+    assert asyncio.run(run()) == 2
+
+
+def test_send_all_adaptive(generate_messages):
+    """
+    the limit should grow while the server keeps up, and back off when it
+    throttles
+    Args:
+        generate_messages: message generator fixture
+    """
+    # latency is left out of it, a loaded test machine is too noisy
+    sender = AdaptiveSender(initial_limit=2, max_limit=16,
+                            latency_tolerance=100.0)
+    with SinkServer() as server:
+        sent = asyncio.run(sender.send_all(generate_messages(100),
+                                           server.url))
+    metrics = sender.metrics()[server.url]
+    assert sent == 100
+    assert server.stats.messages == 100
+    assert metrics["limit"] > 2
+    assert metrics["in_flight"] == 0
+    assert metrics["throughput"] > 0
+
+    sender = AdaptiveSender(initial_limit=8, max_limit=16)
+    with SinkServer(throttle_rate=0.5, seed=1) as server:
+        sent = asyncio.run(sender.send_all(generate_messages(100),
+                                           server.url))
+    metrics = sender.metrics()[server.url]
+    assert sent == server.stats.messages
+    assert metrics["throttled"] == server.stats.throttled
+    assert metrics["sent"] + metrics["failed"] == 100
+    assert metrics["limit"] < 16
+
+
+def test_send_all_own_count(generate_messages):
+    """
+    each send_all should count only the messages it sent itself, not those
+    sent at the same time by others, or skipped as already sent
+    Args:
+        generate_messages: message generator fixture
+    """
+    sender = AdaptiveSender(dedup=DedupCache())
+    msgs = list(generate_messages(10))
+
+    async def run(server):
+        return await asyncio.gather(
+            sender.send_all(msgs[:4], server.url),
+            sender.send_all(msgs[4:], server.url))
+
+    with SinkServer() as server:
+        assert asyncio.run(run(server)) == [4, 6]
+        assert asyncio.run(sender.send_all(msgs, server.url)) == 0
+
+    metrics = sender.metrics()[server.url]
+    assert metrics["sent"] == 10
+    assert metrics["in_flight"] == 0
+    assert server.stats.messages == 10
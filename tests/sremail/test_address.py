@@ -98,3 +98,18 @@ def test_address_repr():
     address = "Sam Gibson <sgibson@glasswallsolutions.com>"
     result = Address(address).__repr__()
     assert result == f"address.Address(\"{address}\")"
+
+
+def test_address_str_cache():
+    """
+    tests the formatted address is cached, and updated when it changes
+    Returns:
+        boolean
+    """
+    address = Address("Sam Gibson <sgibson@glasswallsolutions.com>")
+    assert str(address) is str(address)
+
+    address.name = "Someone Else"
+    assert str(address) == "Someone Else <sgibson@glasswallsolutions.com>"
+    address.email = "someone@else.com"
+    assert str(address) == "Someone Else <someone@else.com>"
@@ -0,0 +1,163 @@
+"""
+archive test module
+"""
+import os
+
+import pytest
+
+from sremail.archive import ArchiveReader, ArchiveWriter
+from sremail.smtp import RenderedMessage
+
+ATTACHMENT = os.urandom(50000)
+
+
+@pytest.fixture
+def archived(tmp_path, create_message):
+    """
+    Args:
+        tmp_path: temporary directory
+        create_message: message factory fixture
+
+    Returns:
+        the path of an archive, and the rendered messages in it
+    """
+    file_path = str(tmp_path / "test.sremail")
+    mime_messages = [
+        create_message(f"test{i}@email.com",
+                       attachment=ATTACHMENT,
+                       file_name="test.pdf").as_mime() for i in range(0, 20)
+    ]
+    raw = RenderedMessage.from_wire(None, "test@email.com",
+                                    ["raw@email.com"],
+                                    b"Subject: raw\r\n\r\nraw message\r\n")
+    with ArchiveWriter(file_path, segment_size=8) as writer:
+        for mime_message in mime_messages:
+            writer.write(mime_message)
+        writer.write(raw)
+    expected = [
+        RenderedMessage(mime_message) for mime_message in mime_messages
+    ]
+    expected.append(raw)
+    return file_path, expected
+
+
+def assert_same(result: RenderedMessage, expected: RenderedMessage) -> None:
+    """
+    Args:
+        result: message read from the archive
+        expected: message written to it
+    """
+    assert result.message_id == expected.message_id
+    assert result.from_addr == expected.from_addr
+    assert result.to_addrs == expected.to_addrs
+    assert result.data == expected.data
+    assert result.mail_options == expected.mail_options
+
+
+def test_archive_read_sequential(archived):
+    """
+    reading the archive through should give back every message, in order
+    Args:
+        archived: archive fixture
+    """
+    file_path, expected = archived
+    with ArchiveReader(file_path) as reader:
+        results = list(reader)
+    assert len(results) == len(expected)
+    for result, message in zip(results, expected):
+        assert_same(result, message)
+
+
+def test_archive_read_index(archived):
+    """
+    reading through the index should give back the same messages
+    Args:
+        archived: archive fixture
+    """
+    file_path, expected = archived
+    with ArchiveReader(file_path) as reader:
+        assert len(reader) == len(expected)
+        for i in (20, 3, 15, 0, 9):
+            assert_same(reader[i], expected[i])
+
+
+def test_archive_blob_cache(tmp_path, create_message):
+    """
+    only a few attachments should be kept in memory while reading, and those
+    that have dropped out should be read again when they're needed
+    Args:
+        tmp_path: temporary directory
+        create_message: message factory fixture
+    """
+    file_path = str(tmp_path / "test.sremail")
+    attachments = [os.urandom(5000) for _ in range(0, 4)]
+    mime_messages = [
+        create_message(f"test{i}@email.com",
+                       attachment=attachments[i % 4],
+                       file_name="test.pdf").as_mime() for i in range(0, 12)
+    ]
+    with ArchiveWriter(file_path) as writer:
+        for mime_message in mime_messages:
+            writer.write(mime_message)
+
+    with ArchiveReader(file_path, blob_cache_size=2) as reader:
+        for result, mime_message in zip(reader, mime_messages):
+            assert_same(result, RenderedMessage(mime_message))
+            assert len(reader._blobs) <= 2  # pylint: disable=protected-access
+
+
+def test_archive_deduplicates(archived):
+    """
+    the shared attachment should only be stored once
+    Args:
+        archived: archive fixture
+    """
+    file_path, expected = archived
+    assert os.path.getsize(file_path) < 2 * len(ATTACHMENT)
+    assert sum(len(wire.data) for wire in expected) > 20 * len(ATTACHMENT)
+
+
+def test_archive_envelope(tmp_path, create_message):
+    """
+    Bcc recipients should only be kept in the envelope, not the message
+    Args:
+        tmp_path: temporary directory
+        create_message: message factory fixture
+    """
+    file_path = str(tmp_path / "test.sremail")
+    with ArchiveWriter(file_path) as writer:
+        writer.write(create_message("test@email.com",
+                                    "caf\u00e9@email.com",
+                                    bcc=["secret@email.com"],
+                                    message_id="<1@email.com>"))
+
+    with ArchiveReader(file_path) as reader:
+        wire = reader[0]
+    assert wire.message_id == "<1@email.com>"
+    assert wire.from_addr == "test@email.com"
+    assert wire.to_addrs == [
+        "test@email.com", "caf\u00e9@email.com", "secret@email.com"
+    ]
+    assert wire.mail_options == ("SMTPUTF8", "BODY=8BITMIME")
+    assert b"secret@email.com" not in wire.data
+
+
+def test_archive_not_an_archive(tmp_path):
+    """
+    opening something that isn't an archive should raise ValueError
+    Args:
+        tmp_path: temporary directory
+    """
+    file_path = tmp_path / "test.eml"
+    file_path.write_bytes(b"Subject: test\r\n\r\ntest\r\n")
+    with pytest.raises(ValueError):
+        ArchiveReader(str(file_path))
+
+
+def test_archive_unknown_codec(tmp_path):
+    """
+    Args:
+        tmp_path: temporary directory
+    """
+    with pytest.raises(ValueError):
+        ArchiveWriter(str(tmp_path / "test.sremail"), codec="lzma")
@@ -0,0 +1,133 @@
+"""
+dedup test module
+"""
+from datetime import datetime
+import time
+
+from sremail import smtp
+from sremail.dedup import DedupCache
+from sremail.message import Message
+from sremail.testing import SinkServer
+
+
+def test_seen():
+    """
+    recipients added for a message should be seen for that message only
+    """
+    dedup = DedupCache()
+    dedup.add("<1@email.com>", ["a@email.com", "b@email.com"])
+
+    assert dedup.seen("<1@email.com>", "a@email.com")
+    assert ("<1@email.com>", "b@email.com") in dedup
+    assert not dedup.seen("<1@email.com>", "c@email.com")
+    assert not dedup.seen("<2@email.com>", "a@email.com")
+    assert len(dedup) == 2
+
+
+def test_bounded(monkeypatch):
+    """
+    entries should expire after the ttl, and the oldest should be dropped
+    when the cache is full
+    Args:
+        monkeypatch: pytest monkeypatch
+    """
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    dedup = DedupCache(max_size=2, ttl=10)
+    for i in range(0, 3):
+        dedup.add(f"<{i}@email.com>", ["a@email.com"])
+
+    assert not dedup.seen("<0@email.com>", "a@email.com")
+    assert dedup.seen("<1@email.com>", "a@email.com")
+
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert not dedup.seen("<2@email.com>", "a@email.com")
+    assert len(dedup) == 0
+
+
+def test_persisted(tmp_path, monkeypatch):
+    """
+    entries should be read back from the file, without the expired ones
+    Args:
+        tmp_path: temporary directory
+        monkeypatch: pytest monkeypatch
+    """
+    file_path = str(tmp_path / "sent.dedup")
+    with DedupCache(ttl=10, file_path=file_path) as dedup:
+        dedup.add("<1@email.com>", ["a@email.com"])
+    with DedupCache(ttl=100, file_path=file_path) as dedup:
+        assert dedup.seen("<1@email.com>", "a@email.com")
+        dedup.add("<2@email.com>", ["a@email.com"])
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 50)
+    with DedupCache(file_path=file_path) as dedup:
+        assert not dedup.seen("<1@email.com>", "a@email.com")
+        assert dedup.seen("<2@email.com>", "a@email.com")
+    with open(file_path) as dedup_file:
+        assert len(dedup_file.readlines()) == 1
+
+
+def test_persisted_without_close(tmp_path):
+    """
+    entries should be in the file as soon as they're added, so a run that
+    crashes can be resumed
+    Args:
+        tmp_path: temporary directory
+    """
+    file_path = str(tmp_path / "sent.dedup")
+    crashed = DedupCache(file_path=file_path)
+    crashed.add("<1@email.com>", ["a@email.com", "b@email.com"])
+
+    with DedupCache(file_path=file_path) as dedup:
+        assert dedup.seen("<1@email.com>", "a@email.com")
+        assert dedup.seen("<1@email.com>", "b@email.com")
+    crashed.close()
+
+
+def test_send_all_dedup():
+    """
+    resending messages should only send them to the recipients that haven't
+    accepted them yet
+    """
+    msgs = [
+        Message(to=[f"a{i}@email.com", f"b{i}@email.com"],
+                from_addresses=["test@email.com"],
+                date=datetime.now()) for i in range(0, 5)
+    ]
+    dedup = DedupCache()
+    with SinkServer(max_recipients=1) as server:
+        assert smtp.send_all(msgs, server.url, dedup=dedup) == 5
+        assert server.stats.recipients == 5
+
+        server.max_recipients = None
+        assert smtp.send_all(msgs, server.url, dedup=dedup) == 5
+        assert smtp.send_all(msgs, server.url, dedup=dedup) == 0
+        smtp.send(msgs[0], server.url, dedup=dedup)
+
+    assert server.stats.messages == 10
+    assert server.stats.recipients == 10
+
+
+def test_send_all_dedup_resumed():
+    """
+    the same messages created again, as a resumed run would, should be
+    recognised as already sent
+    """
+    def create_messages():
+        return [
+            Message(to=[f"a{i}@email.com"],
+                    from_addresses=["test@email.com"],
+                    date=datetime(2019, 11, 12, 15, 24, 28))
+            for i in range(0, 5)
+        ]
+
+    dedup = DedupCache()
+    with SinkServer() as server:
+        assert smtp.send_all(create_messages()[:3], server.url,
+                             dedup=dedup) == 3
+        assert smtp.send_all(create_messages(), server.url, dedup=dedup) == 2
+        # without a cache, messages get a new Message-ID each time
+        assert smtp.send_all(create_messages(), server.url) == 5
+
+    assert server.stats.messages == 10
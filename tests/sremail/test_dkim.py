@@ -0,0 +1,196 @@
+"""
+DKIM test module
+"""
+import base64
+import email
+import email.policy
+from email.generator import BytesGenerator
+import hashlib
+from io import BytesIO
+import re
+
+import pytest
+
+from sremail.dkim import DKIMSigner, canonicalize_body, canonicalize_header
+
+pytest.importorskip("cryptography")
+
+# pylint: disable=wrong-import-position
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+
+def pem(private_key) -> bytes:
+    """
+    Args:
+        private_key: a cryptography private key
+
+    Returns:
+        the key as unencrypted PKCS8 PEM
+    """
+    return private_key.private_bytes(serialization.Encoding.PEM,
+                                     serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption())
+
+
+def verify(raw: bytes, public_key) -> bool:
+    """Verify the DKIM signature of a flattened message.
+
+    Args:
+        raw: the flattened message
+        public_key: the public key of the signer
+
+    Returns:
+        whether the body hash and the signature are valid
+    """
+    raw = raw.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+    header_block, body = raw.split(b"\r\n\r\n", 1)
+    headers = [
+        tuple(header.split(b":", 1))
+        for header in re.split(rb"\r\n(?![ \t])", header_block)
+    ]
+    signature_value = headers[0][1]
+    tags = dict(
+        tag.strip().split(b"=", 1)
+        for tag in re.sub(rb"\s", b"", signature_value).split(b";") if tag)
+
+    body_hash = base64.b64encode(
+        hashlib.sha256(canonicalize_body(body)).digest())
+    if body_hash != tags[b"bh"]:
+        return False
+
+    available = headers[1:]
+    signed = b""
+    for name in tags[b"h"].split(b":"):
+        for i in range(len(available) - 1, -1, -1):
+            if available[i][0].lower() == name:
+                signed += canonicalize_header(*available.pop(i))
+                break
+    unsigned_value = re.sub(rb"b=[^;]*$", b"b=", signature_value)
+    signed += canonicalize_header(b"DKIM-Signature", unsigned_value)[:-2]
+
+    signature = base64.b64decode(tags[b"b"])
+    if isinstance(public_key, rsa.RSAPublicKey):
+        public_key.verify(signature, signed, padding.PKCS1v15(),
+                          hashes.SHA256())
+    else:
+        public_key.verify(signature, hashlib.sha256(signed).digest())
+    return True
+
+
+def flatten(mime_message) -> bytes:
+    """
+    Args:
+        mime_message: an email.message.EmailMessage
+
+    Returns:
+        the message as it would be sent
+    """
+    out = BytesIO()
+    BytesGenerator(out, policy=email.policy.SMTP).flatten(mime_message)
+    return out.getvalue()
+
+
+def test_canonicalize_header():
+    """
+    RFC6376 3.4.5 example header canonicalization
+    """
+    assert canonicalize_header(b"A", b" X\r\n") == b"a:X\r\n"
+    assert canonicalize_header(b"B ", b" Y\t\r\n\tZ  \r\n") == b"b:Y Z\r\n"
+
+
+def test_canonicalize_body():
+    """
+    RFC6376 3.4.5 example body canonicalization
+    """
+    assert canonicalize_body(b" C \r\nD \t E\r\n\r\n\r\n") == \
+        b" C\r\nD E\r\n"
+    assert canonicalize_body(b"") == b""
+    assert canonicalize_body(b"\r\n\r\n") == b""
+
+
+@pytest.mark.parametrize(
+    "private_key",
+    [rsa.generate_private_key(public_exponent=65537, key_size=2048),
+     ed25519.Ed25519PrivateKey.generate()],
+    ids=["RSA", "Ed25519"])
+def test_sign_message(private_key, create_message):
+    """
+    Args:
+        private_key: key to sign with
+        create_message: message factory fixture
+    """
+    signer = DKIMSigner("example.com", "test", pem(private_key))
+    raw = flatten(
+        create_message(attachment=b"attachment data").as_mime(signer))
+
+    result = email.message_from_bytes(raw)
+    assert "d=example.com" in result["DKIM-Signature"]
+    assert "s=test" in result["DKIM-Signature"]
+    assert verify(raw, private_key.public_key())
+
+
+def test_sign_reuses_body_hash(create_message):
+    """
+    Messages to different recipients with the same content should share a
+    body hash, and still verify.
+    Args:
+        create_message: message factory fixture
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537,
+                                           key_size=2048)
+    signer = DKIMSigner("example.com", "test", pem(private_key))
+
+    raws = [
+        flatten(
+            create_message(to, attachment=b"attachment data").as_mime(signer))
+        for to in ("a@email.com", "b@email.com")
+    ]
+
+    # pylint: disable=protected-access
+    assert len(signer._body_hashes) == 1
+    # the cache holds digests of bodies, not the bodies themselves
+    assert all(
+        isinstance(key, bytes) and len(key) == 16
+        for key in signer._body_hashes)
+    for raw in raws:
+        assert verify(raw, private_key.public_key())
+
+
+def test_sign_detects_tampering(create_message):
+    """
+    Changing the body after signing should invalidate the body hash.
+    Args:
+        create_message: message factory fixture
+    """
+    private_key = ed25519.Ed25519PrivateKey.generate()
+    signer = DKIMSigner("example.com", "test", pem(private_key))
+    raw = flatten(
+        create_message(attachment=b"attachment data").as_mime(signer))
+
+    assert not verify(raw.replace(b"Hello, world!", b"Hello, there!"),
+                      private_key.public_key())
+
+
+def test_sign_smtputf8(create_message):
+    """
+    Messages to non-ASCII addresses should be signed as they'll be sent, with
+    UTF-8 headers.
+    Args:
+        create_message: message factory fixture
+    """
+    # pylint: disable=import-outside-toplevel
+    from sremail.smtp import RenderedMessage, render
+
+    private_key = ed25519.Ed25519PrivateKey.generate()
+    signer = DKIMSigner("example.com", "test", pem(private_key))
+    msg = create_message("Ünïcode Name <ü@d.com>")
+    wire = render(msg, signer, True)
+
+    assert wire.mail_options == ("SMTPUTF8", "BODY=8BITMIME")
+    assert "Ünïcode Name".encode("utf-8") in wire.data
+    assert verify(wire.data, private_key.public_key())
+
+    # signed without knowing it'd be sent with SMTPUTF8
+    with pytest.raises(ValueError):
+        RenderedMessage(msg.as_mime(signer, True))
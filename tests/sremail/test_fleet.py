@@ -0,0 +1,107 @@
+"""
+fleet test module
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import queue
+
+import aiosmtplib
+import pytest
+
+from sremail import fleet
+from sremail.fleet import Fleet, FleetStats
+from sremail.testing import SinkServer
+
+
+def test_fleet_run(generate_messages):
+    """
+    the workers should send every message between them, and report back
+    what they sent
+    Args:
+        generate_messages: message generator fixture
+    """
+    with SinkServer(max_recipients=1) as server:
+        stats = Fleet(server.url, workers=2, connections=3,
+                      queue_size=4).run(generate_messages(50, "a", "b"))
+
+    assert stats.messages == 50
+    assert stats.failed == 0
+    assert stats.recipients == 50
+    assert stats.refused == 50
+    assert stats.bytes == server.stats.bytes
+    assert stats.messages_per_second > 0
+    assert server.stats.messages == 50
+    assert server.stats.connections <= 6
+
+
+def test_fleet_errors(generate_messages):
+    """
+    messages the server won't take should be counted by reply code
+    Args:
+        generate_messages: message generator fixture
+    """
+    with SinkServer(throttle_rate=1.0) as server:
+        stats = Fleet(server.url, workers=2,
+                      connections=1).run(generate_messages(10, "a", "b"))
+
+    assert stats.messages == 0
+    assert stats.failed == 10
+    assert stats.as_dict()["errors"] == {"451": 10}
+
+
+def test_fleet_workers_exited(monkeypatch, generate_messages):
+    """
+    run() should raise rather than wait forever to queue messages once every
+    worker has exited
+    Args:
+        monkeypatch: pytest monkeypatch
+        generate_messages: message generator fixture
+    """
+    monkeypatch.setattr(fleet, "_work", lambda *args: None)
+    with SinkServer() as server:
+        with pytest.raises(RuntimeError):
+            Fleet(server.url, workers=2, queue_size=1,
+                  start_method="fork").run(generate_messages(20, "a", "b"))
+
+
+def test_fleet_empty_refusal(monkeypatch):
+    """
+    a refusal without any recipients in it should be counted, not kill the
+    worker
+    Args:
+        monkeypatch: pytest monkeypatch
+    """
+    class RefusingSMTP:
+        """
+        Refuses every message, without saying who it refused
+        """
+        is_connected = True
+
+        @staticmethod
+        async def sendmail(*args):
+            raise aiosmtplib.SMTPRecipientsRefused([])
+
+        @staticmethod
+        async def rset():
+            pass
+
+        @staticmethod
+        async def quit():
+            pass
+
+    async def connect_async(*args):
+        return RefusingSMTP()
+
+    monkeypatch.setattr(fleet, "connect_async", connect_async)
+    work = queue.Queue()
+    for _ in range(0, 3):
+        work.put(("test@email.com", ["a@email.com"], b"data", ()))
+    work.put(None)
+    stats = FleetStats()
+    with ThreadPoolExecutor(1) as executor:
+        asyncio.run(
+            fleet._send_from(  # pylint: disable=protected-access
+                "localhost:25", 1, None, None, work, executor, stats))
+
+    assert stats.failed == 3
+    assert stats.errors == {"SMTPRecipientsRefused": 3}
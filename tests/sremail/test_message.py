@@ -2,15 +2,18 @@
 Message test module
 """
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import nullcontext as does_not_raise
 from datetime import datetime
 import email
+from email.mime.application import MIMEApplication
+from email.mime.text import MIMEText
 import io
 from typing import Dict, List
 
 import pytest
 
-from sremail.message import Message, MIMEApplication, MIMEText
+from sremail.message import MappedAttachment, Message
 
 
 def create_message(body: str, headers: Dict[str, object],
@@ -100,6 +103,29 @@ def test_create_message_unknown_headers():
     assert mime_result["Unknown-Header"] == "test"
 
 
+def test_unknown_headers_threads():
+    """
+    unknown headers shouldn't leak between messages rendered at the same time
+    on different threads
+    Returns:
+        boolean
+    """
+    def render(name):
+        msg = Message(to=["test@email.com"],
+                      from_addresses=["a@b.com"],
+                      date=datetime.now(),
+                      **{f"{name}_{i}": name for i in range(0, 20)})
+        for _ in range(0, 50):
+            mime_result = msg.as_mime()
+            assert all(mime_result[f"{name}-{i}"] == name
+                       for i in range(0, 20))
+            assert len(mime_result.keys()) == 26
+
+    with ThreadPoolExecutor(4) as executor:
+        for result in [executor.submit(render, f"X{i}") for i in range(4)]:
+            result.result()
+
+
 def test_add_header():
     """
     Adds a header
@@ -242,6 +268,7 @@ def test_as_mime(mock_open):
     expected_str = f"""Content-Type: multipart/mixed; boundary="{boundary}"
 MIME-Version: 1.0
 From: test@email.com
+Message-ID: {msg.message_id}
 To: test@email.com
 Date: Tue, 12 Nov 2019 15:24:28 +0000
 
@@ -274,3 +301,233 @@ TEXT
         expected_payload.get_content_type()
     assert result_payload.get_content_disposition() == \
         expected_payload.get_content_disposition()
+
+
+def test_message_attach_all(tmp_path):
+    """
+    tests attaching many files in parallel keeps them in order
+    Args:
+        tmp_path: temporary directory
+
+    Returns:
+        boolean from assertions
+    """
+    file_paths = []
+    for i in range(0, 8):
+        file_path = tmp_path / f"attachment{i}.pdf"
+        file_path.write_bytes(bytes([i]) * (1000 * i))
+        file_paths.append(str(file_path))
+
+    msg = Message(to=["test@email.com"],
+                  from_addresses=["test@email.com"],
+                  date=datetime.now())
+    msg.attach_all(file_paths, max_workers=4)
+
+    assert len(msg.attachments) == 8
+    for i, attachment in enumerate(msg.attachments):
+        assert attachment.get_content_type() == "application/pdf"
+        assert attachment.get_filename() == f"attachment{i}.pdf"
+        assert attachment.get_content() == bytes([i]) * (1000 * i)
+        # make sure the bulk encoding gives the same lines as email would
+        assert attachment.get_payload() == \
+            MIMEApplication(bytes([i]) * (1000 * i)).get_payload()
+
+
+def test_message_attach_mapped(tmp_path):
+    """
+    tests memory mapped attachments are shared between messages and encode
+    the same as read attachments
+    Args:
+        tmp_path: temporary directory
+
+    Returns:
+        boolean from assertions
+    """
+    file_path = tmp_path / "attachment.pdf"
+    file_path.write_bytes(b"testing testing 123" * 1000)
+
+    msgs = [
+        Message(to=["test@email.com"],
+                from_addresses=["test@email.com"],
+                date=datetime.now()).attach(str(file_path), mapped=True)
+        for _ in range(0, 2)
+    ]
+    read_msg = Message(to=["test@email.com"],
+                       from_addresses=["test@email.com"],
+                       date=datetime.now()).attach(str(file_path))
+
+    mapped_a, mapped_b = (msg.attachments[0] for msg in msgs)
+    assert isinstance(mapped_a, MappedAttachment)
+    assert mapped_a._mapped_file is mapped_b._mapped_file
+    assert mapped_a.items() == read_msg.attachments[0].items()
+    assert mapped_a.get_payload() == read_msg.attachments[0].get_payload()
+    assert mapped_a.get_content() == b"testing testing 123" * 1000
+
+
+def test_message_attach_mapped_empty(tmp_path):
+    """
+    tests empty files, which can't be mapped, are still attached
+    Args:
+        tmp_path: temporary directory
+
+    Returns:
+        boolean from assertions
+    """
+    file_path = tmp_path / "empty.bin"
+    file_path.write_bytes(b"")
+
+    msg = Message(to=["test@email.com"],
+                  from_addresses=["test@email.com"],
+                  date=datetime.now()).attach(str(file_path), mapped=True)
+
+    assert not isinstance(msg.attachments[0], MappedAttachment)
+    assert msg.attachments[0].get_content() == b""
+
+
+def test_as_mime_header_cache():
+    """
+    tests messages with the same recipients share parsed headers
+    Returns:
+        boolean from assertions
+    """
+    recipients = [f"Person {i} <person{i}@email.com>" for i in range(0, 100)]
+    date = datetime.strptime("2019-11-12T15:24:28+00:00",
+                             "%Y-%m-%dT%H:%M:%S%z")
+    results = [
+        Message(to=recipients, from_addresses=["test@email.com"],
+                date=date).as_mime() for _ in range(0, 2)
+    ]
+
+    assert results[0]["To"] is results[1]["To"]
+    assert results[0]["Date"] is results[1]["Date"]
+    assert results[0]["To"] == ", ".join(recipients)
+    assert len(results[0]["To"].addresses) == 100
+
+
+def test_as_mime_date_offset():
+    """
+    the same instant in different time zones should keep its own offset
+    Returns:
+        boolean from assertions
+    """
+    dates = [
+        datetime.strptime(date, "%Y-%m-%dT%H:%M:%S%z")
+        for date in ("2019-11-12T12:00:00+00:00", "2019-11-12T13:00:00+01:00")
+    ]
+    results = [
+        Message(to=["test@email.com"], from_addresses=["test@email.com"],
+                date=date).as_mime()["Date"] for date in dates
+    ]
+
+    assert results == ["Tue, 12 Nov 2019 12:00:00 +0000",
+                       "Tue, 12 Nov 2019 13:00:00 +0100"]
+
+
+def test_as_mime_header_linefeed():
+    """
+    tests header values with linefeeds are still refused
+    Returns:
+        boolean from assertions
+    """
+    msg = Message(to=["test@email.com"],
+                  from_addresses=["test@email.com"],
+                  date=datetime.now(),
+                  subject="line\nfeed")
+    with pytest.raises(ValueError):
+        msg.as_mime()
+
+
+def test_message_id():
+    """
+    messages should get a unique Message-ID, or one derived from their
+    content when asked, unless they're given one
+    """
+    def create_message(body, **headers):
+        msg = Message(body,
+                      to=["test@email.com"],
+                      from_addresses=["Test <test@email.com>"],
+                      date=datetime(2019, 11, 12, 15, 24, 28),
+                      **headers)
+        return msg.attach_stream(io.BytesIO(b"attachment data"), "data.bin")
+
+    msg = create_message("Hello, world!")
+    assert msg.message_id.endswith("@email.com>")
+    assert msg.message_id == msg.message_id
+    assert msg.message_id != create_message("Hello, world!").message_id
+    assert msg.as_mime()["Message-ID"] == msg.message_id
+
+    derived = create_message("Hello, world!").derive_message_id()
+    assert derived.endswith("@email.com>")
+    assert derived == create_message("Hello, world!").derive_message_id()
+    assert derived != create_message("Goodbye, world!").derive_message_id()
+
+    msg = create_message("Hello, world!", message_id="<1@email.com>")
+    assert msg.message_id == "<1@email.com>"
+    assert msg.derive_message_id() == "<1@email.com>"
+    assert msg.as_mime().get_all("Message-ID") == ["<1@email.com>"]
+
+
+def create_body_message(body="", html=None):
+    """
+    Args:
+        body: the plaintext body
+        html: the HTML body
+
+    Returns:
+        a Message with the bodies
+    """
+    return Message(body,
+                   html,
+                   to=["test@email.com"],
+                   from_addresses=["test@email.com"],
+                   date=datetime.now())
+
+
+def test_message_html():
+    """
+    HTML bodies should be sent alone, or as an alternative to the plaintext
+    """
+    result = create_body_message(html="<p>Hello, world!</p>").as_mime()
+    assert [part.get_content_type() for part in result.iter_parts()] == \
+        ["text/html"]
+
+    result = create_body_message("Hello, world!",
+                                 "<p>Hello, world!</p>").as_mime()
+    alternatives = result.get_payload()[0]
+    assert alternatives.get_content_type() == "multipart/alternative"
+    assert [part.get_content() for part in alternatives.iter_parts()] == \
+        ["Hello, world!", "<p>Hello, world!</p>"]
+
+
+@pytest.mark.parametrize("body, eight_bit, expected", [
+    ("Hello, world!", False, "7bit"),
+    ("Hello, world!" * 100, False, "quoted-printable"),
+    ("Caf\u00e9 ouvert, " * 10, False, "quoted-printable"),
+    ("\u041f\u0440\u0438\u0432\u0435\u0442" * 10, False, "base64"),
+    ("Caf\u00e9 ouvert, " * 10, True, "8bit"),
+    ("\u041f\u0440\u0438\u0432\u0435\u0442" * 200, True, "base64"),
+])
+def test_body_encoding(body, eight_bit, expected):
+    """
+    bodies should be sent with the cheapest transfer encoding that's correct,
+    and encoded only once
+    Args:
+        body: the body
+        eight_bit: whether the server takes 8bit data
+        expected: the expected transfer encoding
+    """
+    result = create_body_message(body).as_mime(eight_bit=eight_bit)
+    part = result.get_payload()[0]
+
+    assert part["Content-Transfer-Encoding"] == expected
+    assert part.get_content() == body
+    # the encoded payload is shared, but not the part
+    other_part = create_body_message(body).as_mime(
+        eight_bit=eight_bit).get_payload()[0]
+    assert other_part is not part
+    # pylint: disable=protected-access
+    assert other_part._payload is part._payload
+
+    part.set_payload("tampered")
+    assert create_body_message(body).as_mime(
+        eight_bit=eight_bit).get_payload()[0].get_content() == body
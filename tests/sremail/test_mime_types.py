@@ -0,0 +1,94 @@
+"""
+mime_types test module
+"""
+import io
+from datetime import datetime
+import mimetypes
+
+import pytest
+
+from sremail.message import Message
+from sremail.mime_types import DEFAULT_TYPE, MimeResolver, sniff
+
+
+@pytest.mark.parametrize("file_name, expected", [
+    ("report.pdf", ("application", "pdf")),
+    ("REPORT.PDF", ("application", "pdf")),
+    ("dir.with.dots/image.jpeg", ("image", "jpeg")),
+    ("archive.tar.gz", ("application", "gzip")),
+    ("test.coff", DEFAULT_TYPE),
+    ("test.bin", DEFAULT_TYPE),
+    ("no_extension", DEFAULT_TYPE),
+])
+def test_resolve_extension(file_name, expected):
+    """
+    types should be resolved from the extension, whatever its case
+    Args:
+        file_name: the name of the file
+        expected: the expected maintype and subtype
+    """
+    resolver = MimeResolver()
+    assert resolver.resolve(file_name) == expected
+    # the second lookup comes from the cache
+    assert resolver.resolve(file_name) == expected
+
+
+def test_resolve_standard_types():
+    """
+    every type in the mimetypes module's built in table should be resolved
+    the same way it would be
+    """
+    resolver = MimeResolver()
+    # pylint: disable=protected-access
+    for extension, mime_type in mimetypes._types_map_default.items():
+        assert "/".join(resolver.resolve("test" + extension)) == mime_type
+
+
+def test_resolve_custom_types():
+    """
+    custom types should be added to, and override, the defaults
+    """
+    resolver = MimeResolver({".coff": "application/x-coff",
+                             ".TXT": "text/x-custom"})
+    assert resolver.resolve("test.coff") == ("application", "x-coff")
+    assert resolver.resolve("test.txt") == ("text", "x-custom")
+    assert resolver.resolve("test.pdf") == ("application", "pdf")
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"%PDF-1.7\n", ("application", "pdf")),
+    (b"\x89PNG\r\n\x1a\n\x00\x00", ("image", "png")),
+    (b"PK\x03\x04\x14\x00", ("application", "zip")),
+    (b"Hello,\r\n\tworld!\n", ("text", "plain")),
+    ("café ".encode("utf-8") * 200, ("text", "plain")),
+    (b"\x7fELF\x02\x01\x01\x00", DEFAULT_TYPE),
+    (b"\xff\xfe\x00\x01", DEFAULT_TYPE),
+    (b"", DEFAULT_TYPE),
+])
+def test_sniff(data, expected):
+    """
+    files without an extension should have their type sniffed
+    Args:
+        data: the content of the file
+        expected: the expected maintype and subtype
+    """
+    assert sniff(data) == expected
+    assert MimeResolver().resolve("no_extension", data) == expected
+    assert MimeResolver(sniff=False).resolve("no_extension",
+                                             data) == DEFAULT_TYPE
+
+
+def test_message_resolver():
+    """
+    messages should resolve attachment types with their resolver
+    """
+    msg = Message(to=["test@email.com"],
+                  from_addresses=["test@email.com"],
+                  date=datetime.now())
+    msg.attach_stream(io.BytesIO(b"%PDF-1.7\n"), "report")
+    msg.mime_resolver = MimeResolver({".coff": "application/x-coff"})
+    msg.attach_stream(io.BytesIO(b"testing testing 123"), "test.coff")
+
+    assert [attachment.get_content_type()
+            for attachment in msg.attachments] == \
+        ["application/pdf", "application/x-coff"]
@@ -0,0 +1,138 @@
+"""
+outcomes test module
+"""
+import asyncio
+import smtplib
+
+import pytest
+
+from sremail import smtp
+from sremail.outcomes import ACCEPTED, FAILED, REFUSED, OutcomeStore
+from sremail.testing import SinkServer
+
+
+def test_record(tmp_path):
+    """
+    outcomes should be buffered, and queryable once inserted
+    Args:
+        tmp_path: temporary directory
+    """
+    db_path = str(tmp_path / "outcomes.db")
+    with OutcomeStore(db_path, batch_size=2) as outcomes:
+        outcomes.record("smtp.a:25", ["a@email.com", "b@email.com"],
+                        {"b@email.com": (452, b"Too many recipients")},
+                        message_id="<1@email.com>", code=250)
+        assert outcomes.connection.execute(
+            "SELECT COUNT(*) FROM sends").fetchone()[0] == 0
+        outcomes.record("smtp.b:25", ["a@email.com"],
+                        code=451, error="Try again later")
+        assert outcomes.connection.execute(
+            "SELECT COUNT(*) FROM sends").fetchone()[0] == 2
+
+        refused = outcomes.with_status(REFUSED)
+        assert len(refused) == 1
+        assert refused[0]["recipient"] == "b@email.com"
+        assert refused[0]["code"] == 452
+        assert refused[0]["response"] == "Too many recipients"
+        assert refused[0]["message_id"] == "<1@email.com>"
+        assert [outcome["status"]
+                for outcome in outcomes.recipient("a@email.com")] == \
+            [ACCEPTED, FAILED]
+        assert outcomes.with_status(FAILED, endpoint="smtp.a:25") == []
+
+    # reopening the store adds to it
+    with OutcomeStore(db_path) as outcomes:
+        outcomes.record("smtp.a:25", ["c@email.com"], code=250)
+        assert outcomes.counts() == {ACCEPTED: 2, REFUSED: 1, FAILED: 1}
+
+
+def test_record_shared(tmp_path):
+    """
+    stores writing to the same database at once shouldn't hand out the same
+    ids, or mix up each other's recipients
+    Args:
+        tmp_path: temporary directory
+    """
+    db_path = str(tmp_path / "outcomes.db")
+    with OutcomeStore(db_path) as first, OutcomeStore(db_path) as second:
+        for i in range(0, 3):
+            first.record("smtp.a:25", [f"a{i}@email.com"],
+                         message_id=f"<a{i}@email.com>", code=250)
+            second.record("smtp.b:25", [f"b{i}@email.com"],
+                          message_id=f"<b{i}@email.com>", code=250)
+        first.flush()
+        second.flush()
+
+        for store, name in ((first, "a"), (second, "b")):
+            for i in range(0, 3):
+                outcome, = store.recipient(f"{name}{i}@email.com")
+                assert outcome["message_id"] == f"<{name}{i}@email.com>"
+        assert first.counts() == {ACCEPTED: 6}
+
+
+def test_send_all_outcomes(tmp_path, create_message):
+    """
+    send_all should record the refused recipients of every message
+    Args:
+        tmp_path: temporary directory
+        create_message: message factory fixture
+    """
+    msgs = [
+        create_message(f"a{i}@email.com", f"b{i}@email.com")
+        for i in range(0, 10)
+    ]
+    with OutcomeStore(str(tmp_path / "outcomes.db")) as outcomes, \
+            SinkServer(max_recipients=1) as server:
+        smtp.send_all(msgs, server.url, outcomes=outcomes)
+
+        assert outcomes.counts() == {ACCEPTED: 10, REFUSED: 10}
+        refused = outcomes.with_status(REFUSED, endpoint=server.url)
+        assert [outcome["recipient"] for outcome in refused] == \
+            [f"b{i}@email.com" for i in range(0, 10)]
+        assert all(outcome["code"] == 452 for outcome in refused)
+
+
+def test_send_failure_outcome(tmp_path, create_message):
+    """
+    a message the server won't take should be recorded as failed
+    Args:
+        tmp_path: temporary directory
+        create_message: message factory fixture
+    """
+    with OutcomeStore(str(tmp_path / "outcomes.db")) as outcomes, \
+            SinkServer(throttle_rate=1.0) as server:
+        with pytest.raises(smtplib.SMTPSenderRefused):
+            smtp.send(create_message("a@email.com"),
+                      server.url,
+                      outcomes=outcomes)
+
+        failed = outcomes.with_status(FAILED)
+        assert len(failed) == 1
+        assert failed[0]["recipient"] == "a@email.com"
+        assert outcomes.connection.execute(
+            "SELECT code FROM sends").fetchone()[0] == 451
+
+
+def test_session_outcomes(tmp_path, create_message):
+    """
+    sessions should record outcomes against the server they're connected to
+    Args:
+        tmp_path: temporary directory
+        create_message: message factory fixture
+    """
+    async def run(server, outcomes):
+        session = await smtp.SMTPSession.connect(server.url,
+                                                 outcomes=outcomes)
+        async with session:
+            await session.send_all(
+                create_message("a@email.com", "b@email.com")
+                for _ in range(0, 3))
+
+    with OutcomeStore(str(tmp_path / "outcomes.db")) as outcomes, \
+            SinkServer(max_recipients=1) as server:
+        asyncio.run(run(server, outcomes))
+
+        refused = outcomes.recipient("b@email.com")
+        assert len(refused) == 3
+        assert all(outcome["status"] == REFUSED and
+                   outcome["endpoint"] == server.url for outcome in refused)
@@ -0,0 +1,96 @@
+"""
+profiling test module
+"""
+import json
+import smtplib
+
+from sremail import profiling, smtp
+
+
+class MockSMTP:
+    """
+    Creates a mock smtp
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def send_message(message):
+        pass
+
+    @staticmethod
+    def sendmail(from_addr, to_addrs, msg, mail_options=()):
+        return {}
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    @staticmethod
+    def has_extn(name):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def test_profiling_off():
+    """
+    timing stages when profiling is off should do nothing
+    """
+    assert profiling.active() is None
+    with profiling.timed("rendering"):
+        pass
+    assert profiling.active() is None
+
+
+def test_profile_send_all(monkeypatch, tmp_path, create_message):
+    """
+    profiling a send_all should time every stage, and write the summary
+    Args:
+        monkeypatch: pytest monkeypatch
+        tmp_path: temporary directory
+        create_message: message factory fixture
+    """
+    monkeypatch.setattr(smtplib, "SMTP", MockSMTP)
+    output_path = tmp_path / "profile.json"
+
+    with profiling.profile(top_n=2, output_path=str(output_path)) as prof:
+        msgs = [
+            create_message(f"test{i}@email.com",
+                           attachment=b"testing testing 123")
+            for i in range(0, 5)
+        ]
+        smtp.send_all(msgs, "smtp.test.not_real.com:25")
+
+    summary = prof.summary()
+    assert set(summary["stages"]) == set(profiling.STAGES)
+    assert summary["stages"]["rendering"]["count"] == 5
+    assert summary["stages"]["network"]["count"] == 5
+    assert summary["stages"]["validation"]["count"] == 5
+    assert len(summary["slowest_messages"]) == 2
+    assert all(msg["message"].startswith("to=test")
+               for msg in summary["slowest_messages"])
+    assert json.loads(output_path.read_text()) == summary
+    assert profiling.active() is None
+
+
+def test_profile_unsent_messages(create_message):
+    """
+    messages that are never sent should be finished when they're garbage
+    collected, each under its own label
+    Args:
+        create_message: message factory fixture
+    """
+    with profiling.profile(top_n=5) as prof:
+        for i in range(0, 200):
+            create_message(f"test{i}@email.com").as_mime()
+        # pylint: disable=protected-access
+        assert not prof._message_totals
+
+    slowest = prof.summary()["slowest_messages"]
+    assert len(slowest) == 5
+    assert len({msg["message"] for msg in slowest}) == 5
+    assert all(msg["message"].startswith("to=test") for msg in slowest)
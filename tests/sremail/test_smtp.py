@@ -1,6 +1,7 @@
 """
 smtp test module
 """
+import asyncio
 from datetime import datetime
 import email
 import smtplib
@@ -9,6 +10,7 @@ import pytest
 
 from sremail.message import Message
 from sremail import smtp
+from sremail.testing import SinkServer
 
 
 @pytest.fixture
@@ -29,9 +31,22 @@ def mock_smtp(monkeypatch):
             pass
 
         @staticmethod
-        def send_message(message):
+        def send_message(message, from_addr=None, to_addrs=None,
+                         mail_options=()):
             print(message)
 
+        @staticmethod
+        def sendmail(from_addr, to_addrs, msg, mail_options=()):
+            print(msg.decode().replace("\r\n", "\n"))
+            return {}
+
+        def ehlo_or_helo_if_needed(self):
+            pass
+
+        @staticmethod
+        def has_extn(name):
+            return False
+
         def __enter__(self):
             return self
 
@@ -70,6 +85,7 @@ MIME-Version: 1.0
 Date: Tue, 12 Nov 2019 16:48:25 -0000
 To: test@email.com
 From: test@email.com
+Message-ID: {msg.message_id}
 
 --{boundary}
 Content-Type: text/plain
@@ -137,12 +153,17 @@ TEXT
     smtp.send_all(msgs, "smtp.test.not_real.com:25")
 
     captured = capsys.readouterr()
-    for message in captured.out.split("--\n\n"):
-        if len(message.strip()) == 0:
-            continue
-
+    results = [
+        message for message in captured.out.split("--\n\n")
+        if len(message.strip()) > 0
+    ]
+    assert len(results) == len(msgs)
+    for message, msg in zip(results, msgs):
         result_after_send = email.message_from_string(message.strip())
         result_after_send.set_boundary(boundary)
+        # every message gets its own Message-ID
+        assert result_after_send["Message-ID"] == msg.message_id
+        del result_after_send["Message-ID"]
 
         assert dict(result_after_send) == dict(expected)
         result_payload = result_after_send.get_payload()[0]
@@ -153,3 +174,221 @@ TEXT
             expected_payload.get_content_type()
         assert result_payload.get_content_disposition() == \
             expected_payload.get_content_disposition()
+
+
+def test_send_all_generator():
+    """
+    send_all should take a generator, and only render a few messages ahead
+    of sending them
+    """
+    generated = []
+
+    def generate_messages(count):
+        for i in range(0, count):
+            generated.append(i)
+            yield Message(to=[f"test{i}@email.com"],
+                          bcc=["hidden@email.com"],
+                          from_addresses=["test@email.com"],
+                          date=datetime.now())
+
+    with SinkServer(keep_messages=True) as server:
+        sent = smtp.send_iter(generate_messages(50), server.url, prefetch=2)
+        message, refused = next(sent)
+        assert refused == {}
+        assert str(message.headers["to"][0]) == "test0@email.com"
+        # one being sent, two on the queue and one waiting to go on it
+        assert len(generated) <= 4
+        sent.close()
+
+        assert smtp.send_all(generate_messages(20), server.url) == 20
+
+    assert server.stats.connections == 2
+    assert server.stats.messages == 21
+    assert server.stats.recipients == 42
+    assert all(b"hidden@email.com" not in data for data in server.messages)
+
+
+def test_send_iter_error():
+    """
+    an error generating a message should be raised once the messages before
+    it have been sent
+    """
+    def generate_messages():
+        for i in range(0, 3):
+            yield Message(to=[f"test{i}@email.com"],
+                          from_addresses=["test@email.com"],
+                          date=datetime.now())
+        raise RuntimeError("out of messages")
+
+    with SinkServer() as server:
+        sent = []
+        with pytest.raises(RuntimeError, match="out of messages"):
+            for message, _ in smtp.send_iter(generate_messages(), server.url):
+                sent.append(message)
+
+    assert len(sent) == 3
+    assert server.stats.messages == 3
+
+
+def test_session_send_all():
+    """
+    sending an async generator of messages should use one connection, and
+    reset in between each message
+    """
+    async def generate_messages(count):
+        for i in range(0, count):
+            yield Message(to=[f"test{i}@email.com"],
+                          from_addresses=["test@email.com"],
+                          date=datetime.now())
+
+    async def run(server):
+        session = await smtp.SMTPSession.connect(server.url)
+        async with session:
+            return await session.send_all(generate_messages(20))
+
+    with SinkServer() as server:
+        sent = asyncio.run(run(server))
+
+    assert sent == 20
+    assert server.stats.connections == 1
+    assert server.stats.messages == 20
+
+
+def test_session_send_refused():
+    """
+    the session should return refused recipients and carry on sending
+    """
+    async def run(server):
+        session = await smtp.SMTPSession.connect(server.url)
+        async with session:
+            msg = Message(to=["a@email.com", "b@email.com"],
+                          from_addresses=["test@email.com"],
+                          date=datetime.now())
+            return [await session.send(msg) for _ in range(0, 2)]
+
+    with SinkServer(max_recipients=1) as server:
+        results = asyncio.run(run(server))
+
+    assert [list(refused) for refused in results] == [["b@email.com"]] * 2
+    assert server.stats.messages == 2
+
+
+@pytest.mark.parametrize("start_tls", [True, False], ids=["STARTTLS", "SMTPS"])
+def test_send_all_tls(tls_contexts, start_tls):
+    """
+    messages should be sent over TLS, and later connections should resume
+    the TLS session
+    Args:
+        tls_contexts: server and client SSL contexts
+        start_tls: whether to use STARTTLS rather than SMTPS
+    """
+    if start_tls and not hasattr(asyncio.StreamWriter, "start_tls"):
+        pytest.skip("the sink server needs Python 3.11+ for STARTTLS")
+    server_context, client_context = tls_contexts
+    tls = smtp.TLSConfig(client_context, start_tls=start_tls)
+    msg = Message(to=["test@email.com"],
+                  from_addresses=["test@email.com"],
+                  date=datetime.now())
+
+    with SinkServer(tls_context=server_context,
+                    implicit_tls=not start_tls) as server:
+        smtp.send_all([msg, msg], server.url, tls=tls)
+        with smtp.SMTPConnectionPool(server.url, tls=tls) as pool:
+            pool.warm_up(3)
+            with pool.connection() as connection:
+                assert connection.sock.session_reused
+                connection.send_message(msg.as_mime())
+
+    assert server.stats.connections == 4
+    assert server.stats.messages == 3
+    assert server.stats.tls_upgrades == (4 if start_tls else 0)
+
+
+def test_session_tls(tls_contexts):
+    """
+    async sessions should connect over TLS, several at a time
+    Args:
+        tls_contexts: server and client SSL contexts
+    """
+    server_context, client_context = tls_contexts
+    tls = smtp.TLSConfig(client_context, start_tls=False)
+
+    async def run(server):
+        sessions = await smtp.SMTPSession.warm_up(server.url, 3, tls=tls)
+        for session in sessions:
+            async with session:
+                await session.send(
+                    Message(to=["test@email.com"],
+                            from_addresses=["test@email.com"],
+                            date=datetime.now()))
+
+    with SinkServer(tls_context=server_context, implicit_tls=True) as server:
+        asyncio.run(run(server))
+
+    assert server.stats.connections == 3
+    assert server.stats.messages == 3
+
+
+def test_send_all_8bit():
+    """
+    non-ASCII bodies should be sent as they are to servers that take 8bit
+    data
+    """
+    msg = Message("Caf\u00e9 ouvert",
+                  to=["test@email.com"],
+                  from_addresses=["test@email.com"],
+                  date=datetime.now())
+
+    with SinkServer(keep_messages=True) as server:
+        smtp.send_all([msg], server.url)
+
+    assert b"Content-Transfer-Encoding: 8bit" in server.messages[0]
+    assert "Caf\u00e9 ouvert".encode("utf-8") in server.messages[0]
+
+
+def test_send_all_smtputf8(monkeypatch):
+    """
+    messages to non-ASCII addresses should only be sent to servers that take
+    them, and not be sent with SMTPUTF8 for non-ASCII names alone
+    Args:
+        monkeypatch: pytest monkeypatch
+    """
+    msgs = [
+        Message(to=[to],
+                from_addresses=["test@email.com"],
+                date=datetime.now())
+        for to in ("Caf\u00e9 <test@email.com>", "caf\u00e9@email.com")
+    ]
+
+    with SinkServer(keep_messages=True) as server:
+        assert smtp.send_all(msgs, server.url) == 2
+        assert b"=?utf-8?" in server.messages[0]
+        assert "caf\u00e9@email.com".encode("utf-8") in server.messages[1]
+
+        has_extn = smtplib.SMTP.has_extn
+        monkeypatch.setattr(
+            smtplib.SMTP, "has_extn",
+            lambda self, opt: opt != "smtputf8" and has_extn(self, opt))
+        with pytest.raises(smtplib.SMTPNotSupportedError):
+            smtp.send_all(msgs, server.url)
+
+    assert server.stats.messages == 3
+
+
+def test_pool_connection_error():
+    """
+    connections should only go back in the pool if nothing went wrong using
+    them
+    """
+    with SinkServer() as server:
+        with smtp.SMTPConnectionPool(server.url) as pool:
+            with pool.connection() as connection:
+                pass
+            # pylint: disable=protected-access
+            assert pool._idle == [connection]
+
+            with pytest.raises(RuntimeError):
+                with pool.connection() as connection:
+                    raise RuntimeError("caller error")
+            assert pool._idle == []
+            assert connection.sock is None
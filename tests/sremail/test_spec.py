@@ -0,0 +1,147 @@
+"""
+spec test module
+"""
+import json
+
+import pytest
+
+from sremail import message
+from sremail.spec import MessageSpec
+
+CONFIG = {
+    "headers": {
+        "To": ["user{index}@email.com"],
+        "From": ["Test Sender <sender@email.com>"],
+        "Date": "now",
+        "Subject": "Test message {index} of {run}",
+        "X-FileTrust-Tenant": "tenant"
+    },
+    "body": "Hello, {index}!"
+}
+
+
+def test_spec_generate(monkeypatch):
+    """
+    generating messages should fill in the templates, without validating
+    every message
+    Args:
+        monkeypatch: pytest monkeypatch
+    """
+    spec = MessageSpec.from_dict(CONFIG, run="a")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("validated a generated message")
+
+    monkeypatch.setattr(message.MESSAGE_HEADERS_SCHEMA, "load", fail)
+    monkeypatch.setattr(message.MESSAGE_HEADERS_SCHEMA, "validate", fail)
+    msgs = list(spec.generate(100, run="b"))
+
+    assert len(msgs) == 100
+    assert msgs[42].headers["To"] == ["user42@email.com"]
+    assert msgs[42].headers["Subject"] == "Test message 42 of b"
+    assert msgs[42].body == "Hello, 42!"
+    mime_message = msgs[42].as_mime()
+    assert mime_message["To"] == "user42@email.com"
+    assert mime_message["From"] == "Test Sender <sender@email.com>"
+    assert mime_message["X-FileTrust-Tenant"] == "tenant"
+    assert mime_message["Date"].datetime is not None
+
+
+@pytest.mark.parametrize("headers", [{
+    "To": ["user@email.com"],
+    "From": ["sender@email.com"],
+    "Date": "not a date"
+}, {
+    "To": ["user@email.com"],
+    "Date": "now"
+}, {
+    "To": ["user{missing}@email.com"],
+    "From": ["sender@email.com"],
+    "Date": "now"
+}],
+                         ids=["BadDate", "MissingFrom", "MissingPlaceholder"])
+def test_spec_invalid(headers):
+    """
+    invalid specs should be refused up front
+    Args:
+        headers: the header templates
+    """
+    with pytest.raises(ValueError):
+        MessageSpec(headers)
+
+
+@pytest.mark.parametrize("context", [{
+    "rcpt": "not an address, \u00e9vil"
+}, {
+    "date": "not a date"
+}],
+                         ids=["BadAddress", "BadDate"])
+def test_spec_invalid_rendered(context):
+    """
+    templated addresses and dates should be validated for each message
+    Args:
+        context: the values for one message
+    """
+    spec = MessageSpec(
+        {
+            "To": ["{rcpt}"],
+            "From": ["sender@email.com"],
+            "Date": "{date}"
+        },
+        rcpt="user@email.com",
+        date="Tue, 12 Nov 2019 15:24:28 +0000")
+    assert spec.message(
+        rcpt="user@email.com",
+        date="Tue, 12 Nov 2019 15:24:28 +0000").headers["To"] == \
+        ["user@email.com"]
+    with pytest.raises(ValueError):
+        spec.message(**{
+            "rcpt": "user@email.com",
+            "date": "Tue, 12 Nov 2019 15:24:28 +0000",
+            **context
+        })
+
+
+def test_spec_header_case():
+    """
+    header names should be validated whatever case they're in
+    """
+    with pytest.raises(ValueError):
+        MessageSpec({
+            "to": ["user@email.com"],
+            "from": ["sender@email.com"],
+            "date": "not a date"
+        })
+
+
+def test_spec_from_json(tmp_path):
+    """
+    specs should load from JSON, with attachments relative to the config
+    Args:
+        tmp_path: temporary directory
+    """
+    (tmp_path / "attachment.pdf").write_bytes(b"testing testing 123")
+    config = dict(CONFIG, attachments=["attachment.pdf"])
+    config_path = tmp_path / "spec.json"
+    config_path.write_text(json.dumps(config))
+
+    spec = MessageSpec.from_file(str(config_path), run="a")
+    msgs = list(spec.generate(2, run="a"))
+
+    assert msgs[0].attachments[0] is msgs[1].attachments[0]
+    assert msgs[0].attachments[0].get_content() == b"testing testing 123"
+
+
+def test_spec_from_yaml(tmp_path):
+    """
+    specs should load from YAML
+    Args:
+        tmp_path: temporary directory
+    """
+    yaml = pytest.importorskip("yaml")
+    config_path = tmp_path / "spec.yaml"
+    config_path.write_text(yaml.safe_dump(CONFIG))
+
+    spec = MessageSpec.from_file(str(config_path), run="a")
+
+    assert spec.message(7, run="c").headers["To"] == ["user7@email.com"]
@@ -0,0 +1,99 @@
+"""
+testing (SinkServer) test module
+"""
+import asyncio
+import smtplib
+
+import pytest
+
+from sremail import smtp
+from sremail.testing import SinkServer
+
+
+def test_sink_send_all(create_message):
+    """
+    messages sent to the sink should be counted and kept intact
+    Args:
+        create_message: message factory fixture
+    """
+    msgs = [
+        create_message(body="Hello, world!\n.\n..dots",
+                       attachment=b"testing testing 123")
+        for _ in range(0, 10)
+    ]
+    with SinkServer(keep_messages=True) as server:
+        smtp.send_all(msgs, server.url)
+
+    assert server.stats.connections == 1
+    assert server.stats.messages == 10
+    assert server.stats.recipients == 10
+    assert server.stats.bytes == sum(len(msg) for msg in server.messages)
+    assert b"\r\n.\r\n..dots" in server.messages[0]
+
+
+def test_sink_empty_message():
+    """
+    an empty message should still be accepted
+    """
+    with SinkServer(keep_messages=True) as server:
+        with smtplib.SMTP(server.url) as client:
+            client.ehlo()
+            client.mail("a@b.com")
+            client.rcpt("c@d.com")
+            # smtplib would add a CRLF to the data, so send it by hand
+            client.putcmd("data")
+            assert client.getreply()[0] == 354
+            client.send(b".\r\n")
+            assert client.getreply()[0] == 250
+
+    assert server.messages == [b""]
+
+
+@pytest.mark.parametrize("code", [421, 451])
+def test_sink_throttle(code, create_message):
+    """
+    throttled transactions should be refused with the throttle code
+    Args:
+        code: the throttle code
+        create_message: message factory fixture
+    """
+    with SinkServer(throttle_rate=1.0, throttle_code=code) as server:
+        with pytest.raises(smtplib.SMTPSenderRefused) as err:
+            smtp.send(create_message(), server.url)
+
+    assert err.value.smtp_code == code
+    assert server.stats.throttled == 1
+    assert server.stats.messages == 0
+
+
+def test_sink_max_recipients():
+    """
+    recipients over the limit should be refused, but the message accepted
+    """
+    with SinkServer(max_recipients=2) as server:
+        with smtplib.SMTP(server.url) as client:
+            refused = client.sendmail("a@b.com",
+                                      ["1@b.com", "2@b.com", "3@b.com"],
+                                      b"Subject: test\r\n\r\ntest\r\n")
+
+    assert list(refused) == ["3@b.com"]
+    assert refused["3@b.com"][0] == 452
+    assert server.stats.recipients == 2
+    assert server.stats.refused_recipients == 1
+
+
+def test_sink_async(create_message):
+    """
+    the sink should run on an existing event loop too
+    Args:
+        create_message: message factory fixture
+    """
+    async def run():
+        async with SinkServer(latency=0.01) as server:
+            await asyncio.gather(*(smtp.send_async(create_message(),
+                                                   server.url)
+                                   for _ in range(0, 5)))
+        return server
+
+    server = asyncio.run(run())
+    assert server.stats.messages == 5